@@ -0,0 +1,102 @@
+import time
+import random
+import asyncio
+import argparse
+import resource
+
+from features import build_feature_row
+from inference import load_model, predict_rows
+from bulk_score import BulkScorer, SCENARIO_DEFAULTS, score_chunk, _init_worker
+from inference import MODEL_PATH, COMPILED_MODEL_PATH, MODEL_MMAP_MODE
+
+# Скоринг сценария по всей базе: построчно (как /predict) против пачек
+# build_feature_columns + predict_columns, и целиком через BulkScorer с mongomock.
+# Профили генерируются кусками, в памяти одновременно только один кусок.
+# mongomock ищет каждый upsert перебором коллекции, поэтому прогон через него
+# проверяет конвейер целиком, а не пропускную способность настоящей MongoDB.
+# Запуск: python -m benchmarks.bench_bulk_score --profiles 1000000
+
+
+def profile_chunks(total, chunk_size, seed=0):
+    rng = random.Random(seed)
+    for start in range(0, total, chunk_size):
+        yield [{
+            "user_id": user_id,
+            "age": rng.randint(18, 65),
+            "gender": rng.choice(["male", "female", "other"]),
+            "weight": round(rng.uniform(50, 120), 1),
+            "height": round(rng.uniform(150, 200), 1),
+            "fitness_goal": rng.choice(["weight loss", "muscle gain", "endurance"]),
+            "fitness_level": rng.choice(["beginner", "intermediate", "advanced"]),
+        } for user_id in range(start, min(total, start + chunk_size))]
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench_per_row(model, rows):
+    profiles = next(profile_chunks(rows, rows))
+    start = time.perf_counter()
+    for profile in profiles:
+        predict_rows(model, [build_feature_row(profile, SCENARIO_DEFAULTS)])
+    return rows / (time.perf_counter() - start)
+
+
+def bench_chunks(total, chunk_size):
+    start = time.perf_counter()
+    generate = 0.0
+    scored = 0
+    chunks = profile_chunks(total, chunk_size)
+    while True:
+        t = time.perf_counter()
+        profiles = next(chunks, None)
+        generate += time.perf_counter() - t
+        if profiles is None:
+            break
+        user_ids, _ = score_chunk(profiles, SCENARIO_DEFAULTS)
+        scored += len(user_ids)
+    # генерация синтетики — не часть скоринга
+    return scored / (time.perf_counter() - start - generate)
+
+
+async def bench_mongo(rows, chunk_size, workers, executor):
+    import mongomock
+    from storage import ThreadedDatabase
+
+    db = ThreadedDatabase(mongomock.MongoClient()["fitness_bot"])
+    for profiles in profile_chunks(rows, 10_000):
+        await db["user_profiles"].insert_many(profiles)
+    scorer = BulkScorer(db, "bench", {"sessions_per_week": 4, "sleep_hours": 8.0},
+                        chunk_size=chunk_size, workers=workers, executor=executor)
+    await scorer.ensure_indexes()
+    start = time.perf_counter()
+    scored = await scorer.run()
+    elapsed = time.perf_counter() - start
+    stored = await db["scenario_scores"].count_documents({"scenario": "bench"})
+    return scored / elapsed, stored
+
+
+def main(args):
+    _init_worker(MODEL_PATH, COMPILED_MODEL_PATH, MODEL_MMAP_MODE)
+    model = load_model()
+    per_row = bench_per_row(model, args.per_row_sample)
+    print(f"{'per row':<28} {per_row:9.0f} profiles/s -> {args.profiles / per_row / 60:6.1f} min "
+          f"for {args.profiles}")
+    chunked = bench_chunks(args.profiles, args.chunk_size)
+    print(f"{f'chunks of {args.chunk_size}':<28} {chunked:9.0f} profiles/s -> {args.profiles / chunked / 60:6.1f} min "
+          f"for {args.profiles}, peak RSS {peak_rss_mb():.0f} MB")
+    rate, stored = asyncio.run(bench_mongo(args.mongo_profiles, args.chunk_size, args.workers, args.executor))
+    print(f"{'BulkScorer + mongomock':<28} {rate:9.0f} profiles/s ({args.mongo_profiles} profiles, "
+          f"{stored} scores stored, {args.executor} x{args.workers})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profiles", type=int, default=1_000_000)
+    parser.add_argument("--per-row-sample", type=int, default=2000)
+    parser.add_argument("--chunk-size", type=int, default=10_000)
+    parser.add_argument("--mongo-profiles", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--executor", choices=["process", "thread"], default="process")
+    main(parser.parse_args())
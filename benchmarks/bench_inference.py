@@ -0,0 +1,92 @@
+import time
+import random
+import asyncio
+import argparse
+
+import joblib
+
+from features import FEATURE_COLUMNS
+from compiled_model import CompiledProgressModel
+from inference import BatchPredictor, MODEL_PATH, COMPILED_MODEL_PATH, predict_rows
+from benchmarks.bench_llm import percentile
+
+# Пропускная способность и хвостовая задержка /predict: старый путь (одна строка
+# DataFrame прямо в event loop) против скомпилированной модели и BatchPredictor.
+# Запуск: python -m benchmarks.bench_inference (нужны .pkl и скомпилированный артефакт)
+
+
+def random_row(rng):
+    return {
+        "age": rng.randint(18, 65),
+        "weight_start": round(rng.uniform(50, 120), 1),
+        "height": round(rng.uniform(1.55, 1.95), 2),
+        "gender": rng.choice(["Male", "Female"]),
+        "goal": rng.choice(["weight_loss", "muscle_gain", "endurance"]),
+        "level": rng.choice(["beginner", "intermediate", "advanced"]),
+        "sessions_per_week": rng.randint(1, 7),
+        "session_duration_minutes": rng.randint(20, 90),
+        "sleep_hours": round(rng.uniform(5, 9), 1),
+        "diet_followed": rng.random() < 0.5,
+        "restrictions_or_breaks": rng.random() < 0.3,
+        "consistency_percent": round(rng.uniform(40, 100), 1),
+    }
+
+
+async def run_per_row(model, rows):
+    start = time.perf_counter()
+
+    async def handler(row):
+        predict_rows(model, [row])
+        return time.perf_counter() - start
+
+    latencies = await asyncio.gather(*(handler(r) for r in rows))
+    return latencies, time.perf_counter() - start
+
+
+async def run_batched(predictor, rows):
+    start = time.perf_counter()
+
+    async def handler(row):
+        await predictor.predict(row)
+        return time.perf_counter() - start
+
+    latencies = await asyncio.gather(*(handler(r) for r in rows))
+    return latencies, time.perf_counter() - start
+
+
+def report(name, latencies, wall):
+    print(
+        f"{name:<28} rows/s={len(latencies) / wall:9.1f} "
+        f"p50={percentile(latencies, 50) * 1000:8.1f}ms p99={percentile(latencies, 99) * 1000:8.1f}ms"
+    )
+
+
+async def main(args):
+    rng = random.Random(42)
+    rows = [random_row(rng) for _ in range(args.requests)]
+    assert set(rows[0]) == set(FEATURE_COLUMNS)
+    model = joblib.load(args.model)
+    compiled = CompiledProgressModel.load(args.compiled)
+    print(f"{args.requests} concurrent /predict requests")
+    report("per-row pickle (baseline)", *await run_per_row(model, rows))
+    report("per-row compiled", *await run_per_row(compiled, rows))
+    for executor in ("thread", "process"):
+        predictor = BatchPredictor(compiled if executor == "thread" else None,
+                                   model_path=args.model, compiled_path=args.compiled,
+                                   max_batch_size=args.max_batch, max_wait_ms=args.max_wait_ms,
+                                   executor=executor, workers=args.workers)
+        await predictor.predict(rows[0])  # прогрев пула
+        report(f"batched ({executor} x{args.workers})", *await run_batched(predictor, rows))
+        print(f"{'':<28} batches={predictor.batches} mean batch={predictor.rows / predictor.batches:.1f}")
+        await predictor.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--compiled", default=COMPILED_MODEL_PATH)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=5)
+    parser.add_argument("--workers", type=int, default=2)
+    asyncio.run(main(parser.parse_args()))
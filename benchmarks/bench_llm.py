@@ -0,0 +1,96 @@
+import time
+import asyncio
+import threading
+import argparse
+import statistics
+
+import openai
+
+from llm_client import AsyncLLMClient
+from benchmarks.fake_openai import FakeOpenAIServer
+
+# Сравнение задержки хендлеров: старый синхронный ChatCompletion.create внутри
+# event loop против AsyncLLMClient. Запуск: python -m benchmarks.bench_llm
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def report(name, latencies, wall):
+    print(
+        f"{name:<22} users={len(latencies):<5} wall={wall:7.2f}s "
+        f"p50={percentile(latencies, 50) * 1000:8.1f}ms "
+        f"p99={percentile(latencies, 99) * 1000:8.1f}ms "
+        f"mean={statistics.mean(latencies) * 1000:8.1f}ms"
+    )
+
+
+def messages_for(user, shared):
+    profile = "age 30, male, weight loss, beginner" if shared else f"user {user}"
+    return [{"role": "system", "content": "You are a fitness expert."},
+            {"role": "user", "content": f"User Profile: {profile}"}]
+
+
+async def run_blocking(server, users):
+    # задержка считается от общего момента прихода апдейтов, включая ожидание loop
+    start = time.perf_counter()
+
+    async def handler(user):
+        openai.ChatCompletion.create(model="gpt-4o", messages=messages_for(user, False),
+                                     api_base=server.url, api_key="fake")
+        return time.perf_counter() - start
+
+    latencies = await asyncio.gather(*(handler(u) for u in range(users)))
+    return latencies, time.perf_counter() - start
+
+
+async def run_async(server, users, concurrency, shared):
+    client = AsyncLLMClient(max_concurrency=concurrency, api_base=server.url, api_key="fake")
+
+    start = time.perf_counter()
+
+    async def handler(user):
+        await client.complete(messages_for(user, shared))
+        return time.perf_counter() - start
+
+    latencies = await asyncio.gather(*(handler(u) for u in range(users)))
+    wall = time.perf_counter() - start
+    await client.close()
+    return latencies, wall
+
+
+async def main(args):
+    # блокирующий вызов занимает поток event loop, сервер держим в отдельном потоке
+    loop = asyncio.new_event_loop()
+    server = FakeOpenAIServer(latency=args.latency_ms / 1000)
+
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    asyncio.run_coroutine_threadsafe(server.start(), loop).result()
+
+    print(f"fake latency={args.latency_ms}ms concurrency={args.concurrency}")
+    if not args.skip_blocking:
+        requests_before = server.requests
+        report("blocking (baseline)", *await run_blocking(server, args.users))
+        print(f"{'':<22} upstream requests={server.requests - requests_before}")
+    for shared in (False, True):
+        requests_before = server.requests
+        name = "async coalesced" if shared else "async unique"
+        report(name, *await run_async(server, args.users, args.concurrency, shared))
+        print(f"{'':<22} upstream requests={server.requests - requests_before}")
+
+    asyncio.run_coroutine_threadsafe(server.close(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--skip-blocking", action="store_true")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,197 @@
+import time
+import asyncio
+import logging
+import argparse
+import warnings
+
+from benchmarks.bench_llm import percentile
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.fake_telegram import FakeBotAPI, UpdateGenerator
+
+# Вызовы GPT при сбоях, fake OpenAI с инъекцией ошибок:
+#   1. --error-rate ответов 503 и --slow-rate медленных (--slow-ms): доля успешных
+#      вызовов и p50/p95/p99 без повторов, с повторами и с повторами + hedge;
+#   2. полный отказ API на --outage-s: время вызова и число запросов к API с
+#      предохранителем и без, время до первого успеха после восстановления;
+#   3. /plan через настоящий хендлер во время отказа: запасной план из кэша,
+#      ни один текст ошибки не сохранён в профиль.
+# Запуск: python -m benchmarks.bench_llm_resilience
+
+
+def messages(i):
+    # разные промпты: совпадающие объединились бы в один запрос
+    return [{"role": "user", "content": f"plan {i}"}]
+
+
+async def run_calls(client, calls, concurrency, offset=0):
+    slots = asyncio.Semaphore(concurrency)
+    latencies, failures = [], 0
+
+    async def one(i):
+        nonlocal failures
+        async with slots:
+            start = time.perf_counter()
+            try:
+                await client.complete(messages(offset + i))
+            except Exception:
+                failures += 1
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    return latencies, failures
+
+
+def report(name, latencies, failures, requests, client):
+    ok = len(latencies) - failures
+    print(f"{name:<18} ok={ok / len(latencies) * 100:5.1f}% p50={percentile(latencies, 50) * 1000:7.0f}ms "
+          f"p95={percentile(latencies, 95) * 1000:7.0f}ms p99={percentile(latencies, 99) * 1000:7.0f}ms "
+          f"api requests={requests} retried={client.retried} hedged={client.hedged} (won {client.hedge_wins})")
+
+
+async def faults(args):
+    from llm_client import AsyncLLMClient, CircuitBreaker
+
+    server = FakeOpenAIServer(latency=args.llm_ms / 1000, jitter=args.llm_ms / 10000, error_rate=args.error_rate,
+                              slow_rate=args.slow_rate, slow_latency=args.slow_ms / 1000, seed=args.seed)
+    async with server:
+        print(f"llm={args.llm_ms:.0f}ms errors={args.error_rate:.0%} slow={args.slow_rate:.0%} "
+              f"({args.slow_ms:.0f}ms) calls={args.calls} concurrency={args.concurrency}")
+        for name, retries, hedge in (("no retries", 0, False), ("retries", 2, False), ("retries + hedge", 2, True)):
+            client = AsyncLLMClient(api_base=server.url, api_key="fake", max_concurrency=args.concurrency * 2,
+                                    retries=retries, hedge=hedge, hedge_min_delay=args.llm_ms / 1000,
+                                    breaker=CircuitBreaker(failures=10 ** 9))
+            # прогрев: сессия, импорт openai и выборка задержек для p95 hedge
+            await run_calls(client, 40, args.concurrency, offset=10 ** 6)
+            client.retried = client.hedged = client.hedge_wins = 0
+            before = server.requests
+            latencies, failures = await run_calls(client, args.calls, args.concurrency)
+            report(name, latencies, failures, server.requests - before, client)
+            await client.close()
+
+
+async def outage(args):
+    from llm_client import AsyncLLMClient, CircuitBreaker
+
+    server = FakeOpenAIServer(latency=args.llm_ms / 1000)
+    async with server:
+        print(f"outage for {args.outage_s:.0f}s, calls arrive every {1000 / args.rate:.0f}ms")
+        for name, breaker in (("no breaker", CircuitBreaker(failures=10 ** 9)),
+                              ("breaker", CircuitBreaker(failures=5, cooldown=args.cooldown_s))):
+            client = AsyncLLMClient(api_base=server.url, api_key="fake", breaker=breaker)
+            await client.complete(messages(-1))
+            server.outage = True
+            before = server.requests
+            loop = asyncio.get_running_loop()
+            recovered = asyncio.Event()
+            outage_end = loop.time() + args.outage_s
+            recovery = []
+            latencies = []
+
+            async def one(i):
+                start = time.perf_counter()
+                try:
+                    await client.complete(messages(i))
+                    if loop.time() >= outage_end and not recovered.is_set():
+                        recovered.set()
+                        recovery.append(loop.time() - outage_end)
+                except Exception:
+                    pass
+                if loop.time() < outage_end:
+                    latencies.append(time.perf_counter() - start)
+
+            tasks = []
+            i = 0
+            while not recovered.is_set() and loop.time() < outage_end + 60:
+                if server.outage and loop.time() >= outage_end:
+                    server.outage = False
+                    outage_requests = server.requests - before
+                tasks.append(asyncio.ensure_future(one(i)))
+                i += 1
+                await asyncio.sleep(1 / args.rate)
+            await asyncio.gather(*tasks)
+            print(f"{name:<18} call during outage p50={percentile(latencies, 50) * 1000:7.0f}ms "
+                  f"p99={percentile(latencies, 99) * 1000:7.0f}ms api requests during outage={outage_requests} "
+                  f"first success {recovery[0] if recovery else float('nan'):.1f}s after recovery")
+            await client.close()
+
+
+async def plan_during_outage(args):
+    import mongomock
+    from telegram import Update
+    from main import FitnessAssistantBot, GPT_DOWN_TEXT, GPT_FAILED_TEXT, FALLBACK_PLAN_PREFIX
+    from llm_client import CircuitBreaker
+    from outcome_log import OutcomeLog
+    from storage import ThreadedDatabase
+
+    server = FakeOpenAIServer(latency=args.llm_ms / 1000, first_token_latency=args.llm_ms / 4000)
+    async with server, FakeBotAPI() as api:
+        db = ThreadedDatabase(mongomock.MongoClient()["fitness_bot"])
+        bot = FitnessAssistantBot("1:fake", db=db, base_url=api.base_url, metrics_port=0)
+        bot.outcomes = OutcomeLog(enabled=False)
+        bot.templates.enabled = False
+        bot.ai_assistant.llm.api_base = server.url
+        bot.ai_assistant.llm.api_key = "fake"
+        bot.ai_assistant.llm.breaker = CircuitBreaker(failures=5, cooldown=args.cooldown_s)
+        application = bot.application
+        await application.initialize()
+        generator = UpdateGenerator()
+
+        def profile(goal):
+            return {"name": "Alex", "age": 30, "gender": "male", "weight": 80.0, "height": 180.0,
+                    "fitness_goal": goal, "fitness_level": "beginner"}
+
+        async def plan(user_id):
+            await application.process_update(Update.de_json(generator.update(user_id, "/plan"), application.bot))
+
+        # до отказа: один пользователь корзины "weight loss" получил план; запись в кэше устарела
+        bot.plan_cache.ttl = 0
+        await bot.profiles.save_user_profile(1, profile("weight loss"))
+        await plan(1)
+        server.outage = True
+        users = range(100, 100 + args.users)
+        for user_id in users:
+            await bot.profiles.save_user_profile(user_id, profile("weight loss" if user_id % 2 else "endurance"))
+        start = time.perf_counter()
+        await asyncio.gather(*(plan(user_id) for user_id in users))
+        elapsed = time.perf_counter() - start
+
+        texts = {user_id: [] for user_id in users}
+        for method, params, _ in api.calls:
+            if int(params.get("chat_id", 0)) in texts:
+                texts[int(params["chat_id"])].append(params.get("text", ""))
+        fallback = sum(any(text.startswith(FALLBACK_PLAN_PREFIX) for text in sent) for sent in texts.values())
+        refused = args.users - fallback
+        saved = []
+        for user_id in users:
+            plan = await bot.profiles.get_user_plan((await bot.profiles.get_user_profile(user_id)).plan_id)
+            saved.append(plan["plan"] if plan else None)
+        bad = sum(1 for text in saved if text and (text.startswith("Error") or text in (GPT_DOWN_TEXT, GPT_FAILED_TEXT)))
+        print(f"/plan during outage: {args.users} users in {elapsed:.1f}s, fallback plan={fallback} "
+              f"no plan={refused}, plans saved={sum(1 for text in saved if text)}, error text saved={bad}, "
+              f"circuit={bot.ai_assistant.llm.breaker.state}")
+        await application.shutdown()
+        await bot.shutdown(application)
+
+
+async def main(args):
+    logging.disable(logging.WARNING)
+    warnings.filterwarnings("ignore", message="Ignoring `conversation_timeout`")
+    await faults(args)
+    await outage(args)
+    await plan_during_outage(args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--llm-ms", type=float, default=500)
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    parser.add_argument("--slow-ms", type=float, default=8000)
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--outage-s", type=float, default=10)
+    parser.add_argument("--cooldown-s", type=float, default=2)
+    parser.add_argument("--rate", type=float, default=20, help="calls per second during the outage test")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
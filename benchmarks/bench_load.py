@@ -0,0 +1,199 @@
+import sys
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import warnings
+from collections import defaultdict
+
+from benchmarks.bench_llm import percentile
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.fake_telegram import FakeBotAPI, UpdateGenerator
+
+# Нагрузочный тест бота целиком: N пользователей проходят онбординг /start,
+# /plan, /profile, /predict, /improve и снова /profile через настоящие хендлеры
+# FitnessAssistantBot. Telegram — fake Bot API, Mongo — mongomock, OpenAI — fake
+# с заданной задержкой. Пользователь ждёт ответа на сообщение, «думает» и пишет
+# следующее. Задержка — от отправки апдейта до конца его обработки.
+#   --mode queue  — апдейты идут через update_queue и обработчик PTB, как в run_polling
+#   --mode direct — process_update на каждый апдейт сразу (обработка без очереди PTB)
+# Запуск: python -m benchmarks.bench_load --users 1000 --llm-ms 2000 [--max-p99-ms 5000]
+
+GOALS = ["Weight Loss", "Muscle Gain", "Endurance"]
+LEVELS = ["Beginner", "Intermediate", "Advanced"]
+IMPROVE_REQUESTS = ["make it easier", "add more cardio", "make day 3 harder", "days 5-7 should be shorter"]
+
+
+def user_script(rng):
+    # (шаг, текст) — шаг для отчёта; анкета разная, чтобы профили попадали в разные корзины кэша
+    onboarding = ["/start", "Alex", str(rng.randint(18, 65)), rng.choice(["Male", "Female"]),
+                  str(rng.randint(55, 110)), str(rng.randint(155, 195)), rng.choice(GOALS), rng.choice(LEVELS)]
+    predict = ["/predict", str(rng.randint(2, 5)), rng.choice(["30", "45", "60"]), rng.choice(["6.5", "7", "8"]),
+               rng.choice(["yes", "no"]), rng.choice(["yes", "no"]), str(rng.choice([60, 70, 80, 90]))]
+    return (
+        [("/start" if text == "/start" else "onboarding", text) for text in onboarding]
+        + [("/plan", "/plan"), ("/profile", "/profile")]
+        + [("/predict" if text == "/predict" else "predict answer", text) for text in predict]
+        + [("/improve", "/improve"), ("improve request", rng.choice(IMPROVE_REQUESTS)), ("/profile", "/profile")]
+    )
+
+
+async def measure_lag(stop, lags, interval=0.01):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append(loop.time() - expected)
+
+
+class LoadTest:
+    def __init__(self, bot, mode):
+        self.bot = bot
+        self.application = bot.application
+        self.mode = mode
+        self.generator = UpdateGenerator()
+        self._done = {}
+        self.latencies = defaultdict(list)
+        self.errors = 0
+        self.rejected = defaultdict(int)
+
+    def install(self):
+        from telegram import Update
+        from telegram.ext import TypeHandler
+
+        async def completed(update, context):
+            future = self._done.pop(update.update_id, None)
+            if future is not None and not future.done():
+                future.set_result(time.perf_counter())
+
+        # последняя группа: PTB вызывает её после хендлера бота, когда тот закончил
+        self.application.add_handler(TypeHandler(Update, completed), group=1000)
+        self.application.add_error_handler(self._error)
+        # отказ планировщика: хендлеры не запускались, ответ — сообщение об отказе
+        if hasattr(self.application.update_processor, "on_reject"):
+            self.application.update_processor.on_reject = self._rejected
+
+    def _rejected(self, update, reason):
+        self.rejected[reason] += 1
+        future = self._done.pop(update.update_id, None)
+        if future is not None and not future.done():
+            future.set_result(time.perf_counter())
+
+    async def _error(self, update, context):
+        self.errors += 1
+        future = self._done.pop(getattr(update, "update_id", None), None)
+        if future is not None and not future.done():
+            future.set_result(time.perf_counter())
+
+    async def send(self, user_id, step, text):
+        from telegram import Update
+
+        update = Update.de_json(self.generator.update(user_id, text), self.application.bot)
+        future = asyncio.get_running_loop().create_future()
+        self._done[update.update_id] = future
+        start = time.perf_counter()
+        if self.mode == "queue":
+            await self.application.update_queue.put(update)
+        else:
+            await self.application.process_update(update)
+        finished = await future
+        self.latencies[step].append(finished - start)
+
+    async def user(self, user_id, rng, delay, think):
+        await asyncio.sleep(delay)
+        for step, text in user_script(rng):
+            await self.send(user_id, step, text)
+            await asyncio.sleep(rng.expovariate(1 / think) if think else 0)
+
+
+def report(test, elapsed, lags):
+    total = sum(len(values) for values in test.latencies.values())
+    print(f"{'step':<16} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    everything = []
+    for step, values in sorted(test.latencies.items()):
+        everything.extend(values)
+        print(f"{step:<16} {len(values):6d} {percentile(values, 50) * 1000:9.1f} {percentile(values, 95) * 1000:9.1f} "
+              f"{percentile(values, 99) * 1000:9.1f} {max(values) * 1000:9.1f}")
+    print(f"{'all':<16} {total:6d} {percentile(everything, 50) * 1000:9.1f} {percentile(everything, 95) * 1000:9.1f} "
+          f"{percentile(everything, 99) * 1000:9.1f} {max(everything) * 1000:9.1f}")
+    print(f"throughput={total / elapsed:.1f} updates/s wall={elapsed:.1f}s errors={test.errors} "
+          f"rejected={dict(test.rejected) or 0} "
+          f"loop lag p50={percentile(lags, 50) * 1000:.1f}ms p99={percentile(lags, 99) * 1000:.1f}ms "
+          f"max={max(lags) * 1000:.1f}ms")
+    return percentile(everything, 99)
+
+
+async def main(args):
+    import mongomock
+    from main import FitnessAssistantBot
+    from outcome_log import OutcomeLog
+    from storage import ThreadedDatabase
+
+    logging.disable(logging.WARNING)
+    warnings.filterwarnings("ignore", message="Ignoring `conversation_timeout`")
+    rng = random.Random(args.seed)
+    server = FakeOpenAIServer(latency=args.llm_ms / 1000, first_token_latency=args.first_token_ms / 1000,
+                              jitter=args.llm_jitter_ms / 1000)
+    log_dir = tempfile.TemporaryDirectory()
+    async with server, FakeBotAPI(latency=args.telegram_ms / 1000) as api:
+        db = ThreadedDatabase(mongomock.MongoClient()["fitness_bot"])
+        bot = FitnessAssistantBot("1:fake", db=db, base_url=api.base_url, metrics_port=0)
+        # /predict пишет лог исходов как в бою, но во временный каталог, не в рабочее дерево
+        bot.outcomes = OutcomeLog(log_dir.name)
+        bot.plan_cache.enabled = not args.no_plan_cache
+        bot.streaming = not args.no_streaming
+        bot.ai_assistant.llm.api_base = server.url
+        bot.ai_assistant.llm.api_key = "fake"
+        test = LoadTest(bot, args.mode)
+        test.install()
+        application = bot.application
+        await application.initialize()
+        await bot.startup(application)
+        await application.start()
+        # прогрев: импорт openai/aiohttp и загрузка модели не должны попасть в замер
+        await bot.ai_assistant.llm.complete([{"role": "user", "content": "warm up"}])
+        bot.predictor._get_model()
+
+        print(f"users={args.users} mode={args.mode} ramp={args.ramp}s think={args.think_ms:.0f}ms "
+              f"llm={args.llm_ms:.0f}ms (first token {args.first_token_ms:.0f}ms) telegram={args.telegram_ms:.0f}ms "
+              f"plan cache={'off' if args.no_plan_cache else 'on'} streaming={'off' if args.no_streaming else 'on'}")
+        stop = asyncio.Event()
+        lags = []
+        monitor = asyncio.create_task(measure_lag(stop, lags))
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            test.user(10_000 + i, random.Random(rng.random()), args.ramp * i / args.users, args.think_ms / 1000)
+            for i in range(args.users)
+        ))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await monitor
+        p99 = report(test, elapsed, lags)
+        print(f"openai requests={server.requests} bot api calls={len(api.calls)}")
+
+        await application.stop()
+        await application.shutdown()
+        await bot.shutdown(application)
+    log_dir.cleanup()
+    if args.max_p99_ms and p99 * 1000 > args.max_p99_ms:
+        print(f"REGRESSION: p99 above {args.max_p99_ms}ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--mode", choices=["queue", "direct"], default="queue")
+    parser.add_argument("--ramp", type=float, default=10, help="seconds over which users arrive")
+    parser.add_argument("--think-ms", type=float, default=500, help="mean pause between a reply and the next message")
+    parser.add_argument("--llm-ms", type=float, default=2000)
+    parser.add_argument("--first-token-ms", type=float, default=400)
+    parser.add_argument("--llm-jitter-ms", type=float, default=0)
+    parser.add_argument("--telegram-ms", type=float, default=20)
+    parser.add_argument("--no-plan-cache", action="store_true")
+    parser.add_argument("--no-streaming", action="store_true")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--max-p99-ms", type=float, default=0, help="exit 1 if the overall p99 is above this")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,115 @@
+import time
+import asyncio
+import logging
+import argparse
+import warnings
+
+import metrics
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.fake_telegram import FakeBotAPI, UpdateGenerator, ONBOARDING, PREDICT
+
+# Цена инструментирования и что оно показывает. Сначала — накладные расходы
+# trace_handler и phase() на пустом колбэке, затем настоящие хендлеры (анкета,
+# /predict, /plan со стримингом) на mongomock, fake Bot API и fake OpenAI:
+# пропускная способность с метриками и без и разбивка времени хендлеров по фазам.
+# Запуск: python -m benchmarks.bench_metrics --users 50
+
+
+def micro(calls):
+    async def noop(update, context):
+        return None
+
+    async def with_phase(update, context):
+        with metrics.phase("mongo"):
+            return None
+
+    async def loop(callback):
+        start = time.perf_counter()
+        for _ in range(calls):
+            await callback(None, None)
+        return (time.perf_counter() - start) / calls
+
+    async def run():
+        registry = metrics.Registry()
+        base = await loop(noop)
+        traced = await loop(metrics.trace_handler(noop, "noop", registry))
+        traced_phase = await loop(metrics.trace_handler(with_phase, "phase", registry))
+        print(f"per call: bare {base * 1e6:.2f}us, traced +{(traced - base) * 1e6:.2f}us, "
+              f"traced with one phase +{(traced_phase - base) * 1e6:.2f}us")
+
+    asyncio.run(run())
+
+
+async def drive(args, enabled):
+    import mongomock
+    from telegram import Update
+    from main import FitnessAssistantBot
+    from outcome_log import OutcomeLog
+    from storage import ThreadedDatabase
+
+    metrics.METRICS_ENABLED = enabled
+    metrics.REGISTRY.clear()
+    server = FakeOpenAIServer(latency=args.llm_ms / 1000, first_token_latency=args.llm_ms / 4000)
+    async with server, FakeBotAPI(latency=args.telegram_ms / 1000) as api:
+        bot = FitnessAssistantBot("1:fake", db=ThreadedDatabase(mongomock.MongoClient()["fitness_bot"]),
+                                  base_url=api.base_url, metrics_port=0)
+        bot.outcomes = OutcomeLog(enabled=False)
+        bot.plan_cache.enabled = False
+        bot.ai_assistant.llm.api_base = server.url
+        bot.ai_assistant.llm.api_key = "fake"
+        application = bot.application
+        await application.initialize()
+        await bot.startup(application)
+        generator = UpdateGenerator()
+
+        async def user(user_id):
+            for text in ONBOARDING + PREDICT + ["/plan"]:
+                await application.process_update(Update.de_json(generator.update(user_id, text), application.bot))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(user(user_id) for user_id in range(1, args.users + 1)))
+        elapsed = time.perf_counter() - start
+        await application.shutdown()
+        await bot.shutdown(application)
+    updates = args.users * (len(ONBOARDING) + len(PREDICT) + 1)
+    return updates / elapsed
+
+
+def breakdown(registry):
+    handlers = sorted({dict(labels)["handler"] for name, labels in registry.histograms
+                       if name == "bot_handler_seconds"})
+    print(f"{'handler':<24} {'calls':>6} {'mean ms':>8} " + " ".join(f"{p:>9}" for p in metrics.PHASES + ("app",)))
+    for handler in handlers:
+        total = registry.histograms[("bot_handler_seconds", (("handler", handler),))]
+        shares = []
+        for phase_name in metrics.PHASES + ("app",):
+            histogram = registry.histograms.get(("bot_phase_seconds", (("handler", handler), ("phase", phase_name))))
+            shares.append(f"{histogram.sum / total.count * 1000:9.1f}" if histogram else f"{'-':>9}")
+        print(f"{handler:<24} {total.count:6d} {total.sum / total.count * 1000:8.1f} " + " ".join(shares))
+    for (name, labels), value in sorted(registry.counters.items()):
+        if name == "bot_llm_tokens_total":
+            print(f"tokens {dict(labels)['command']} {dict(labels)['kind']}: {value}")
+
+
+def main(args):
+    logging.disable(logging.WARNING)
+    # без JobQueue PTB предупреждает про conversation_timeout на каждый диалог
+    warnings.filterwarnings("ignore", message="Ignoring `conversation_timeout`")
+    micro(args.micro_calls)
+    rates = {}
+    for enabled in (False, True):
+        rates[enabled] = asyncio.run(drive(args, enabled))
+    print(f"handlers, updates/s: metrics off {rates[False]:.0f}, on {rates[True]:.0f} "
+          f"({(rates[True] / rates[False] - 1) * 100:+.1f}%)")
+    print("mean time per call by phase, ms:")
+    breakdown(metrics.REGISTRY)
+    print(f"prometheus exposition: {len(metrics.REGISTRY.prometheus().splitlines())} lines")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--llm-ms", type=float, default=400)
+    parser.add_argument("--telegram-ms", type=float, default=5)
+    parser.add_argument("--micro-calls", type=int, default=100_000)
+    main(parser.parse_args())
@@ -0,0 +1,96 @@
+import os
+import csv
+import time
+import shutil
+import asyncio
+import argparse
+
+from benchmarks.bench_llm import percentile
+from features import FEATURE_COLUMNS
+from outcome_log import OutcomeLog
+
+# Журнал исходов /predict под нагрузкой: сколько стоит вызов в хендлере и насколько
+# запись задерживает event loop. Наивная запись строки CSV на каждое событие
+# против OutcomeLog (буфер в памяти, Arrow IPC в отдельном потоке).
+# Запуск: python -m benchmarks.bench_outcome_log --rate 5000 --seconds 5
+
+ROW = {"age": 30, "weight_start": 80.0, "height": 180.0, "gender": "male", "goal": "weight_loss",
+       "level": "beginner", "sessions_per_week": 3, "session_duration_minutes": 45, "sleep_hours": 7.5,
+       "diet_followed": True, "restrictions_or_breaks": False, "consistency_percent": 80.0}
+
+
+class CsvPerEventLog:
+    # как сделали бы «в лоб»: открыть файл и дописать строку прямо в хендлере
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "events.csv")
+        self.rows_written = 0
+
+    def log_prediction(self, user_id, row, prediction, model_version=None):
+        with open(self.path, "a", newline="") as f:
+            csv.writer(f).writerow([user_id, model_version, *(row[c] for c in FEATURE_COLUMNS), *prediction])
+            f.flush()
+            os.fsync(f.fileno())
+        self.rows_written += 1
+
+    async def close(self):
+        pass
+
+
+async def measure_lag(stop, lags, interval=0.005):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append(loop.time() - expected)
+
+
+async def run(log, rate, seconds):
+    stop = asyncio.Event()
+    lags = []
+    monitor = asyncio.create_task(measure_lag(stop, lags))
+    call_times = []
+    tick = 0.001
+    per_tick = max(1, round(rate * tick))
+    start = time.perf_counter()
+    sent = 0
+    while time.perf_counter() - start < seconds:
+        t = time.perf_counter()
+        for _ in range(per_tick):
+            log.log_prediction(sent % 10_000, ROW, (10.0, -4.0), "v0001")
+            sent += 1
+        call_times.append((time.perf_counter() - t) / per_tick)
+        # держим заданный темп: следующий тик по расписанию
+        await asyncio.sleep(max(0.0, start + sent / rate - time.perf_counter()))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await monitor
+    await log.close()
+    return sent / elapsed, call_times, lags
+
+
+def directory_size(directory):
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+
+async def main(args):
+    print(f"offered rate={args.rate}/s for {args.seconds}s")
+    for name, make in (("csv per event", CsvPerEventLog), ("OutcomeLog", OutcomeLog)):
+        directory = os.path.join(args.dir, name.replace(" ", "_"))
+        shutil.rmtree(directory, ignore_errors=True)
+        log = make(directory)
+        achieved, call_times, lags = await run(log, args.rate, args.seconds)
+        size = directory_size(directory)
+        print(
+            f"{name:<14} events/s={achieved:8.0f} call p50={percentile(call_times, 50) * 1e6:6.1f}us "
+            f"p99={percentile(call_times, 99) * 1e6:7.1f}us loop lag p99={percentile(lags, 99) * 1000:6.2f}ms "
+            f"max={max(lags) * 1000:6.2f}ms rows={log.rows_written} bytes/row={size / max(1, log.rows_written):5.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=int, default=5000)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--dir", default="/tmp/bench_outcome_log")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,176 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import warnings
+
+from benchmarks.bench_llm import percentile
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.fake_telegram import FakeBotAPI, UpdateGenerator
+
+# Библиотека шаблонов планов:
+#   1. офлайн-сборка против fake OpenAI: время, затем сборка, прерванная на середине,
+#      и повторный запуск — догенерируются только недостающие шаблоны;
+#   2. задержка поиска шаблона: словарь в памяти (как в боте), точечный запрос в SQLite,
+#      find_one по составному индексу в Mongo (mongomock, или --mongo-uri для настоящей);
+#   3. /plan через настоящий хендлер: шаблон против GPT (fake с задержкой --llm-ms).
+# Запуск: python -m benchmarks.bench_plan_templates
+
+
+def random_profile(rng):
+    from plan_templates import GOALS, LEVELS, GENDERS
+
+    return {"name": "Alex", "age": rng.randint(13, 100), "gender": rng.choice(GENDERS),
+            "weight": float(rng.randint(45, 140)), "height": float(rng.randint(150, 205)),
+            "fitness_goal": rng.choice(GOALS), "fitness_level": rng.choice(LEVELS)}
+
+
+async def build_library(path, server, concurrency, interrupt_after=None):
+    from llm_client import AsyncLLMClient
+    from plan_templates import TemplateStore, all_keys, generate
+
+    store = TemplateStore(path)
+    llm = AsyncLLMClient(api_base=server.url, api_key="fake", max_concurrency=concurrency)
+    start = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(generate(store, llm, all_keys(), concurrency), interrupt_after)
+    except asyncio.TimeoutError:
+        # как падение процесса: всё, что успели закоммитить, остаётся в файле
+        result = None
+        for task in list(llm._in_flight.values()):
+            task.cancel()
+        await asyncio.gather(*llm._in_flight.values(), return_exceptions=True)
+    finally:
+        await llm.close()
+        store.close()
+    return result, time.perf_counter() - start
+
+
+def time_lookups(lookup, keys, profiles):
+    latencies = []
+    for key, profile in zip(keys, profiles):
+        start = time.perf_counter()
+        plan = lookup(key, profile)
+        latencies.append(time.perf_counter() - start)
+        assert plan is not None
+    return latencies
+
+
+def report(name, latencies):
+    print(f"{name:<26} p50={percentile(latencies, 50) * 1e6:8.1f}us p99={percentile(latencies, 99) * 1e6:8.1f}us "
+          f"{len(latencies) / sum(latencies):10.0f} lookups/s")
+
+
+async def lookup_latency(path, lookups, mongo_uri, seed):
+    from plan_templates import PlanTemplates, TemplateStore, personalize, template_key
+
+    rng = random.Random(seed)
+    profiles = [random_profile(rng) for _ in range(lookups)]
+    keys = [template_key(profile) for profile in profiles]
+
+    templates = PlanTemplates(path, enabled=True).load()
+    report("in-memory (bot)", time_lookups(lambda key, profile: templates.get(profile), keys, profiles))
+
+    store = TemplateStore(path)
+    report("sqlite point query", time_lookups(lambda key, profile: personalize(store.get(key), profile),
+                                              keys, profiles))
+
+    if mongo_uri:
+        from pymongo import MongoClient
+        client = MongoClient(mongo_uri)
+        name = "mongo find_one"
+    else:
+        import mongomock
+        client = mongomock.MongoClient()
+        name = "mongomock find_one"
+    collection = client["bench_plan_templates"]["plan_templates"]
+    collection.drop()
+    fields = ("goal", "level", "gender", "age_band")
+    collection.create_index([(field, 1) for field in fields], unique=True)
+    collection.insert_many([dict(zip(fields, key), plan=plan) for key, plan in store.all().items()])
+    store.close()
+
+    def mongo_lookup(key, profile):
+        doc = collection.find_one(dict(zip(fields, key)), {"_id": 0, "plan": 1})
+        return personalize(doc["plan"], profile)
+
+    report(name, time_lookups(mongo_lookup, keys[:min(len(keys), 2000)], profiles))
+    collection.drop()
+
+
+async def plan_command(path, server, users, seed):
+    import mongomock
+    from telegram import Update
+    from main import FitnessAssistantBot
+    from outcome_log import OutcomeLog
+    from storage import ThreadedDatabase
+
+    rng = random.Random(seed)
+    async with FakeBotAPI() as api:
+        for use_templates in (False, True):
+            db = ThreadedDatabase(mongomock.MongoClient()["fitness_bot"])
+            bot = FitnessAssistantBot("1:fake", db=db, base_url=api.base_url, metrics_port=0)
+            bot.outcomes = OutcomeLog(enabled=False)
+            bot.plan_cache.enabled = False
+            bot.streaming = False
+            bot.templates.path = path
+            bot.templates.enabled = use_templates
+            bot.templates.load()
+            bot.ai_assistant.llm.api_base = server.url
+            bot.ai_assistant.llm.api_key = "fake"
+            application = bot.application
+            await application.initialize()
+            await bot.ai_assistant.llm.complete([{"role": "user", "content": "warm up"}])
+            generator = UpdateGenerator()
+            for user_id in range(users):
+                await bot.profiles.save_user_profile(user_id, random_profile(rng))
+            requests_before = server.requests
+
+            async def one(user_id):
+                start = time.perf_counter()
+                await application.process_update(Update.de_json(generator.update(user_id, "/plan"), application.bot))
+                return time.perf_counter() - start
+
+            latencies = await asyncio.gather(*(one(user_id) for user_id in range(users)))
+            print(f"{'/plan ' + ('template' if use_templates else 'GPT'):<26} "
+                  f"p50={percentile(latencies, 50) * 1000:8.1f}ms p99={percentile(latencies, 99) * 1000:8.1f}ms "
+                  f"openai requests={server.requests - requests_before}")
+            await application.shutdown()
+            await bot.shutdown(application)
+
+
+async def main(args):
+    from plan_templates import all_keys
+
+    logging.disable(logging.WARNING)
+    warnings.filterwarnings("ignore", message="Ignoring `conversation_timeout`")
+    server = FakeOpenAIServer(latency=args.llm_ms / 1000)
+    with tempfile.TemporaryDirectory() as tmp:
+        async with server:
+            full = os.path.join(tmp, "full.sqlite")
+            (created, skipped, failed), elapsed = await build_library(full, server, args.concurrency)
+            print(f"library: {len(all_keys())} templates, llm={args.llm_ms:.0f}ms concurrency={args.concurrency}: "
+                  f"built in {elapsed:.1f}s, {os.path.getsize(full) / 1024:.0f} KiB")
+
+            partial = os.path.join(tmp, "partial.sqlite")
+            await build_library(partial, server, args.concurrency, interrupt_after=elapsed / 2)
+            (created, skipped, failed), elapsed = await build_library(partial, server, args.concurrency)
+            print(f"resume after interruption: {skipped} kept, {created} generated, {len(failed)} failed "
+                  f"in {elapsed:.1f}s")
+
+            await lookup_latency(full, args.lookups, args.mongo_uri, args.seed)
+            await plan_command(full, server, args.users, args.seed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--llm-ms", type=float, default=1500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--mongo-uri", default=None, help="real MongoDB for the find_one comparison")
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,115 @@
+import os
+import time
+import random
+import shutil
+import asyncio
+import argparse
+
+from inference import BatchPredictor, COMPILED_MODEL_PATH, MODEL_PATH
+from prediction_memo import PredictionMemo
+from benchmarks.bench_llm import percentile
+
+# /predict с мемо результатов и без. Поток запросов похож на настоящий: у каждого
+# пользователя свой профиль, ответы — небольшие целые и округлённые числа, активные
+# пользователи спрашивают чаще (Zipf), ответы между запросами меняются редко. В конце — публикация новой модели: мемо
+# должно очиститься, модель перечитаться.
+# Запуск: python -m benchmarks.bench_prediction_memo --requests 20000 --users 2000
+
+
+def user_profiles(users, rng):
+    return [{
+        "age": rng.randint(18, 65),
+        "weight_start": round(rng.uniform(50, 120), 1),
+        "height": round(rng.uniform(1.55, 1.95), 2),
+        "gender": rng.choice(["Male", "Female"]),
+        "goal": rng.choice(["weight_loss", "muscle_gain", "endurance"]),
+        "level": rng.choice(["beginner", "intermediate", "advanced"]),
+    } for _ in range(users)]
+
+
+ANSWER_CHOICES = {
+    "sessions_per_week": [2, 3, 4, 5],
+    "session_duration_minutes": [30, 45, 60, 90],
+    "sleep_hours": [6, 6.5, 7, 7.5, 8],
+    "diet_followed": [True, False],
+    "restrictions_or_breaks": [False, False, False, True],
+    "consistency_percent": [50, 60, 70, 80, 90, 100],
+}
+
+
+def random_answers(rng):
+    return {field: rng.choice(choices) for field, choices in ANSWER_CHOICES.items()}
+
+
+def request_stream(profiles, requests, rng, change_rate):
+    # пользователь обычно повторяет прошлые ответы, иногда меняет один из них
+    weights = [1 / (rank + 1) for rank in range(len(profiles))]
+    answers = [random_answers(rng) for _ in profiles]
+    for user in rng.choices(range(len(profiles)), weights, k=requests):
+        if rng.random() < change_rate:
+            field = rng.choice(list(ANSWER_CHOICES))
+            answers[user] = {**answers[user], field: rng.choice(ANSWER_CHOICES[field])}
+        yield {**profiles[user], **answers[user]}
+
+
+async def run(predictor, rows, concurrency):
+    latencies = []
+    queue = iter(rows)
+
+    async def client():
+        for row in queue:
+            start = time.perf_counter()
+            await predictor.predict(row)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - start
+
+
+def publish_copy(compiled_path):
+    # как publish(): новый каталог подменяется переименованием
+    staging = f"{compiled_path}.tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    shutil.copytree(compiled_path, staging)
+    os.rename(compiled_path, f"{compiled_path}.old")
+    os.rename(staging, compiled_path)
+    shutil.rmtree(f"{compiled_path}.old")
+
+
+async def main(args):
+    rng = random.Random(42)
+    rows = list(request_stream(user_profiles(args.users, rng), args.requests, rng, args.change_rate))
+    print(f"{args.requests} /predict requests from {args.users} users, {args.concurrency} concurrent")
+    for name, enabled in (("no memo", False), ("memo", True)):
+        predictor = BatchPredictor(compiled_path=args.compiled, model_path=args.model,
+                                   memo=PredictionMemo(enabled=enabled))
+        await predictor.predict(rows[0])  # прогрев: загрузка модели
+        latencies, wall = await run(predictor, rows, args.concurrency)
+        stats = predictor.stats()
+        print(f"{name:<8} rows/s={len(rows) / wall:8.0f} p50={percentile(latencies, 50) * 1000:6.2f}ms "
+              f"p99={percentile(latencies, 99) * 1000:6.2f}ms forest rows={stats['rows']:6d} "
+              f"hit ratio={stats['hit_ratio']:.2f}")
+        if enabled:
+            print(f"{'':<8} hit p50={stats['hit_p50_ms']:.3f}ms miss p50={stats['miss_p50_ms']:.3f}ms "
+                  f"memo size={stats['size']}")
+            # новая модель: мемо очищается при следующей проверке артефакта
+            publish_copy(args.compiled)
+            predictor.check_interval = 0
+            predictor._next_check = 0
+            await predictor.predict(rows[0])
+            stats = predictor.stats()
+            print(f"{'':<8} after publish: reloads={stats['reloads']} invalidations={stats['invalidations']} "
+                  f"memo size={stats['size']}")
+        await predictor.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--compiled", default=COMPILED_MODEL_PATH)
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--change-rate", type=float, default=0.3, help="share of requests with a changed answer")
+    parser.add_argument("--concurrency", type=int, default=32)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,139 @@
+import json
+import time
+import asyncio
+import logging
+import argparse
+import tracemalloc
+
+import bson
+import mongomock
+
+from prompts import parse_plan
+from benchmarks.fake_openai import FAKE_PLAN
+from storage import (ThreadedCollection, UserProfile, UserProfileManager,
+                     PREDICT_FIELDS, PLAN_FIELDS, PLAN_REF_FIELDS)
+
+# Байты из Mongo и время разбора ответа на команду: прежние чтения целого
+# документа (анкета + last_plan + plan_days) против проекций под хендлер и плана
+# отдельным документом. Кэш профилей выключен — каждое чтение идёт в Mongo.
+# Байты — размер BSON-ответа; разбор — bson.decode и сборка объекта профиля.
+# Ещё: размер predict_profile в user_data (уходит в persistence) и память кэша
+# на --cache-users профилей, словари против UserProfile.
+# Запуск: python -m benchmarks.bench_profile_reads
+
+OLD_PROJECTION = {"_id": 0, "user_id": 0}
+
+
+def profile_for(user_id):
+    return {"name": f"user{user_id}", "age": 30, "gender": "male", "weight": 80.0,
+            "height": 180.0, "fitness_goal": "weight loss", "fitness_level": "beginner"}
+
+
+class RecordingCollection(ThreadedCollection):
+    # запоминает BSON каждого ответа find_one
+    def __init__(self, collection, replies):
+        super().__init__(collection)
+        self.replies = replies
+
+    async def find_one(self, *args, **kwargs):
+        doc = await asyncio.to_thread(self.collection.find_one, *args, **kwargs)
+        if doc is not None:
+            self.replies.append(bson.encode(doc))
+        return doc
+
+
+# чтения хендлеров в main.py
+async def read_profile(profiles, user_id):
+    profile = await profiles.get_user_profile(user_id)
+    await profiles.get_user_plan(profile.plan_id)
+
+
+async def read_plan(profiles, user_id):
+    await profiles.get_user_profile(user_id, PLAN_FIELDS)
+
+
+async def read_improve(profiles, user_id):
+    await profiles.get_user_profile(user_id, PLAN_REF_FIELDS)
+    profile = await profiles.get_user_profile(user_id, PLAN_FIELDS)
+    await profiles.get_user_plan(profile.plan_id)
+
+
+async def read_deleteplan(profiles, user_id):
+    await profiles.get_user_profile(user_id, PLAN_REF_FIELDS)
+
+
+async def read_predict(profiles, user_id):
+    return (await profiles.get_user_profile(user_id, PREDICT_FIELDS)).as_dict(PREDICT_FIELDS)
+
+
+# сколько раз команда раньше читала профиль целиком
+OLD_READS = {read_profile: 1, read_plan: 1, read_improve: 2, read_deleteplan: 1, read_predict: 1}
+
+
+def decode_seconds(replies, build, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for raw in replies:
+            build(bson.decode(raw))
+    return (time.perf_counter() - start) / repeat
+
+
+def build_new(doc):
+    # ответ с plan — документ плана, его бот кэширует как есть
+    return doc if "plan" in doc else UserProfile(doc)
+
+
+async def main(args):
+    logging.disable(logging.CRITICAL)
+    plan = "\n".join([FAKE_PLAN] * max(1, args.plan_chars // len(FAKE_PLAN)))
+    client = mongomock.MongoClient()
+    replies = []
+    legacy = client["fitness_bot"]["legacy_profiles"]
+    profiles = UserProfileManager(RecordingCollection(client["fitness_bot"]["user_profiles"], replies),
+                                  RecordingCollection(client["fitness_bot"]["user_plans"], replies),
+                                  cache_size=0, plan_cache_size=0)
+    await profiles.ensure_indexes()
+    await profiles.save_user_profile(1, profile_for(1))
+    await profiles.save_user_plan(1, plan, parse_plan(plan))
+    legacy.insert_one({"user_id": 1, **profile_for(1), "last_plan": plan, "plan_days": parse_plan(plan)})
+    old_raw = bson.encode(legacy.find_one({"user_id": 1}, OLD_PROJECTION))
+
+    print(f"plan={len(plan)} chars, whole profile document={len(old_raw)} bytes")
+    print(f"{'command':<12} {'old bytes':>10} {'new bytes':>10} {'old decode':>11} {'new decode':>11} {'reads':>6}")
+    for command, old_reads in OLD_READS.items():
+        replies.clear()
+        result = await command(profiles, 1)
+        new_replies = list(replies)
+        old_bytes = len(old_raw) * old_reads
+        new_bytes = sum(len(raw) for raw in new_replies)
+        # раньше get_user_profile отдавал копию словаря
+        old_time = decode_seconds([old_raw] * old_reads, dict, args.repeat)
+        new_time = decode_seconds(new_replies, build_new, args.repeat)
+        print(f"/{command.__name__[5:]:<11} {old_bytes:>10d} {new_bytes:>10d} {old_time * 1e6:>9.1f}us "
+              f"{new_time * 1e6:>9.1f}us {old_reads:>3d}->{len(new_replies)}")
+        if command is read_predict:
+            predict_profile = result
+    old_user_data = json.dumps(legacy.find_one({"user_id": 1}, OLD_PROJECTION), separators=(",", ":"), default=str)
+    new_user_data = json.dumps(predict_profile, separators=(",", ":"), default=str)
+    print(f"predict_profile in user_data: {len(old_user_data)} -> {len(new_user_data)} bytes")
+
+    # память кэша: раньше в нём лежал словарь с планом, теперь запись без плана
+    docs = [{**profile_for(i), "last_plan": plan, "plan_days": parse_plan(plan)} for i in range(args.cache_users)]
+    raws = [bson.encode(doc) for doc in docs]
+    del docs
+    for name, build in (("dict with plan", lambda raw: bson.decode(raw)),
+                        ("UserProfile", lambda raw: UserProfile(bson.decode(raw), ("plan_id",)))):
+        tracemalloc.start()
+        cache = [build(raw) for raw in raws]
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"profile cache, {args.cache_users} users, {name:<15} {size / args.cache_users:8.0f} bytes/user")
+        del cache
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--plan-chars", type=int, default=1500)
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--cache-users", type=int, default=10000)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,80 @@
+import json
+import argparse
+
+from prompts import (count_message_tokens, count_tokens, improve_messages, parse_plan,
+                     plan_messages, requested_days, PROMPT_TOKEN_BUDGET)
+
+# Входные токены на запрос к GPT: старые промпты (json.dumps всего профиля вместе
+# с last_plan плюс план ещё раз) против prompts.py (компактный профиль, план один
+# раз, только названные дни, бюджет PROMPT_TOKEN_BUDGET).
+# Запуск: python -m benchmarks.bench_prompts
+
+PROFILE = {"name": "Alex", "age": 30, "gender": "male", "weight": 80.0, "height": 180.0,
+           "fitness_goal": "weight loss", "fitness_level": "beginner"}
+
+DAY = ("Day {n}: Warm-up 10 min brisk walk and dynamic stretches. Main: 3x12 goblet squats, "
+       "3x10 push-ups, 3x12 dumbbell rows, 3x30s plank. Finish with 15 min steady cardio at a "
+       "conversational pace and 5 min cool-down stretching for hips and hamstrings.")
+
+REQUESTS = [
+    "make day 3 harder",
+    "swap days 2 and 4, I have no gym on day 4",
+    "add more cardio",
+    "day 5-7 should be shorter, 30 minutes max",
+    "make it easier overall, my knees hurt",
+]
+
+
+def legacy_improve_messages(profile, request):
+    # как было в main.py до prompts.py
+    prompt = (
+        f"User profile: {json.dumps(profile)}\n\n"
+        f"Current plan: {profile.get('last_plan', '')}\n\n"
+        f"User wants to improve the plan as follows: {request}\n\n"
+        "Please provide an improved version of the plan only. Keep it under 200 words."
+    )
+    return [{"role": "system", "content": "You are a fitness expert."},
+            {"role": "user", "content": prompt}]
+
+
+def legacy_plan_messages(profile):
+    prompt = (
+        f"User Profile: {json.dumps(profile)}\n\n"
+         "Generate a personalized workout plan based on the user's profile, fitness goal, and fitness level. for next 7 days only PLAN nothing else. and dont exceed limit  answer more than 200 words."
+    )
+    return [{"role": "system", "content": "You are a fitness expert."},
+            {"role": "user", "content": prompt}]
+
+
+def main(args):
+    import prompts
+
+    count_tokens("")  # выбирает токенизатор
+    print(f"tokenizer: {'tiktoken' if prompts._encoding else 'estimate (tiktoken not installed)'}, "
+          f"budget={PROMPT_TOKEN_BUDGET}")
+    before = count_message_tokens(legacy_plan_messages(PROFILE))
+    after = count_message_tokens(plan_messages(PROFILE))
+    print(f"{'/plan':<48} before={before:6d} after={after:6d} saved={1 - after / before:6.1%}")
+
+    for days_in_plan in args.plan_days:
+        plan = "\n".join(DAY.format(n=n) for n in range(1, days_in_plan + 1))
+        legacy_profile = {**PROFILE, "last_plan": plan}
+        profile = {**legacy_profile, "plan_days": parse_plan(plan)}
+        print(f"\nplan: {days_in_plan} days, {count_tokens(plan)} tokens")
+        total_before = total_after = 0
+        for request in REQUESTS:
+            days = requested_days(request, profile["plan_days"])
+            before = count_message_tokens(legacy_improve_messages(legacy_profile, request))
+            after = count_message_tokens(improve_messages(profile, request, days))
+            total_before += before
+            total_after += after
+            print(f"/improve {request[:38]!r:<40} before={before:6d} after={after:6d} "
+                  f"saved={1 - after / before:6.1%} days={days or 'all'}")
+        print(f"{'total':<48} before={total_before:6d} after={total_after:6d} "
+              f"saved={1 - total_after / total_before:6.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--plan-days", type=int, nargs="+", default=[7, 28])
+    main(parser.parse_args())
@@ -0,0 +1,112 @@
+import time
+import random
+import asyncio
+import logging
+import argparse
+import warnings
+
+import main as bot_main
+from outcome_log import OutcomeLog
+from benchmarks.bench_llm import percentile
+from benchmarks.bench_load import LoadTest
+from benchmarks.fake_openai import FakeOpenAIServer, FAKE_PLAN
+from benchmarks.fake_telegram import FakeBotAPI, ONBOARDING
+from prompts import parse_plan
+
+# Всплеск /improve против обычных пользователей. --spammers пользователей шлют
+# /improve и текст правки без пауз, остальные проходят анкету и смотрят /profile.
+# Сравнение: обработка по одному апдейту (PTB по умолчанию) и PriorityUpdateProcessor
+# с лимитами. Задержка обычных шагов должна остаться низкой, число вызовов GPT —
+# в пределах лимитов.
+# Запуск: python -m benchmarks.bench_scheduler --users 100 --spammers 10
+
+
+async def run(args, scheduler):
+    import mongomock
+    from storage import ThreadedDatabase
+
+    bot_main.SCHEDULER_ENABLED = scheduler
+    server = FakeOpenAIServer(latency=args.llm_ms / 1000, first_token_latency=args.llm_ms / 4000)
+    async with server, FakeBotAPI(latency=args.telegram_ms / 1000) as api:
+        db = ThreadedDatabase(mongomock.MongoClient()["fitness_bot"])
+        bot = bot_main.FitnessAssistantBot("1:fake", db=db, base_url=api.base_url, metrics_port=0)
+        bot.outcomes = OutcomeLog(enabled=False)
+        bot.ai_assistant.llm.api_base = server.url
+        bot.ai_assistant.llm.api_key = "fake"
+        test = LoadTest(bot, "queue")
+        test.install()
+        application = bot.application
+        await application.initialize()
+        await bot.startup(application)
+        await application.start()
+        await bot.ai_assistant.llm.complete([{"role": "user", "content": "warm up"}])
+
+        spammers = range(1, args.spammers + 1)
+        for user_id in spammers:
+            await bot.profiles.save_user_profile(user_id, {
+                "name": "Spam", "age": 30, "gender": "male", "weight": 80.0, "height": 180.0,
+                "fitness_goal": "weight loss", "fitness_level": "beginner",
+            })
+            await bot.profiles.save_user_plan(user_id, FAKE_PLAN, parse_plan(FAKE_PLAN))
+        server.requests = 0
+        processor = application.update_processor
+        depth = []
+
+        async def spammer(user_id):
+            for i in range(args.bursts):
+                await test.send(user_id, "/improve", "/improve")
+                await test.send(user_id, "improve request", f"make day {i % 7 + 1} harder")
+
+        async def regular(user_id, rng):
+            await asyncio.sleep(rng.uniform(0, args.ramp))
+            for text in ONBOARDING + ["/profile"]:
+                await test.send(user_id, "regular step", text)
+                await asyncio.sleep(rng.expovariate(1000 / args.think_ms))
+
+        async def sample(stop):
+            while not stop.is_set():
+                depth.append(getattr(processor, "queued", 0))
+                await asyncio.sleep(0.05)
+
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample(stop))
+        rng = random.Random(1)
+        start = time.perf_counter()
+        await asyncio.gather(*(spammer(user_id) for user_id in spammers),
+                             *(regular(1000 + i, random.Random(rng.random())) for i in range(args.users)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await sampler
+
+        regular_steps = test.latencies["regular step"]
+        improve = test.latencies["improve request"]
+        name = "scheduler" if scheduler else "sequential"
+        print(f"{name:<11} regular step p50={percentile(regular_steps, 50) * 1000:7.1f}ms "
+              f"p99={percentile(regular_steps, 99) * 1000:8.1f}ms | improve p50={percentile(improve, 50) * 1000:7.0f}ms "
+              f"| GPT calls={server.requests} rejected={dict(test.rejected) or 0} "
+              f"max queue={max(depth)} wall={elapsed:.1f}s")
+
+        await application.stop()
+        await application.shutdown()
+        await bot.shutdown(application)
+
+
+def main(args):
+    logging.disable(logging.WARNING)
+    warnings.filterwarnings("ignore", message="Ignoring `conversation_timeout`")
+    print(f"{args.users} regular users, {args.spammers} users sending /improve x{args.bursts} without pauses, "
+          f"llm={args.llm_ms:.0f}ms")
+    for scheduler in (False, True):
+        asyncio.run(run(args, scheduler))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--spammers", type=int, default=10)
+    parser.add_argument("--bursts", type=int, default=10)
+    parser.add_argument("--ramp", type=float, default=5)
+    parser.add_argument("--think-ms", type=float, default=300)
+    parser.add_argument("--llm-ms", type=float, default=2000)
+    parser.add_argument("--telegram-ms", type=float, default=20)
+    main(parser.parse_args())
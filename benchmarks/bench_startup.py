@@ -0,0 +1,101 @@
+import sys
+import json
+import argparse
+import subprocess
+
+# Холодный старт: время от запуска интерпретатора до готового бота и память
+# воркеров с моделью (pickle / compiled / compiled+mmap).
+# Запуск: python -m benchmarks.bench_startup [--max-ready-ms 1500]
+
+READY_SCRIPT = """
+import time, json, sys
+start = time.perf_counter()
+import main
+main.FitnessAssistantBot("1:fake")
+ready = time.perf_counter() - start
+heavy = [m for m in ("pandas", "sklearn", "openai", "numpy", "joblib") if m in sys.modules]
+from benchmarks.bench_startup import memory
+print(json.dumps({"ready": ready, "heavy": heavy, **memory()}))
+"""
+
+WORKER_SCRIPT = """
+import time, json, sys
+from benchmarks.bench_startup import memory
+from inference import load_model
+mode, model_path, compiled_path = sys.argv[1:4]
+start = time.perf_counter()
+if mode == "pickle":
+    model = load_model(model_path, None, None)
+else:
+    model = load_model(model_path, compiled_path, "r" if mode == "mmap" else None)
+loaded = time.perf_counter() - start
+row = {"age": 30, "weight_start": 80.0, "height": 1.8, "gender": "Male", "goal": "weight_loss",
+       "level": "beginner", "sessions_per_week": 3, "session_duration_minutes": 45, "sleep_hours": 7.0,
+       "diet_followed": True, "restrictions_or_breaks": False, "consistency_percent": 80.0}
+from inference import predict_rows
+predict_rows(model, [row] * 64)
+print(json.dumps({"load": loaded, **memory()}), flush=True)
+sys.stdin.read()
+"""
+
+
+def memory():
+    # Rss считает разделяемые страницы mmap целиком, Pss — долю этого процесса
+    result = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in ("Rss", "Pss"):
+                    result[key.lower() + "_mb"] = int(rest.split()[0]) / 1024
+    except OSError:
+        import resource
+        result["rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result
+
+
+def measure_ready(runs):
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", READY_SCRIPT], capture_output=True, text=True, check=True)
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return min(samples, key=lambda s: s["ready"])
+
+
+def measure_workers(mode, workers, model_path, compiled_path):
+    procs = [
+        subprocess.Popen([sys.executable, "-c", WORKER_SCRIPT, mode, model_path, compiled_path],
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        for _ in range(workers)
+    ]
+    # все воркеры живы одновременно, иначе Pss не покажет разделение страниц
+    stats = [json.loads(p.stdout.readline()) for p in procs]
+    for p in procs:
+        p.stdin.close()
+        p.wait()
+    return stats
+
+
+def main(args):
+    ready = measure_ready(args.runs)
+    print(f"import-to-ready: {ready['ready'] * 1000:.0f}ms  rss={ready.get('rss_mb', 0):.1f}MB  "
+          f"heavy modules at startup: {ready['heavy'] or 'none'}")
+    for mode in ("pickle", "compiled", "mmap"):
+        stats = measure_workers(mode, args.workers, args.model, args.compiled)
+        load = max(s["load"] for s in stats) * 1000
+        rss = sum(s.get("rss_mb", 0) for s in stats) / len(stats)
+        pss = sum(s.get("pss_mb", 0) for s in stats) / len(stats)
+        print(f"{mode:<9} x{args.workers} workers: load={load:6.0f}ms  rss/worker={rss:6.1f}MB  pss/worker={pss:6.1f}MB")
+    if args.max_ready_ms and ready["ready"] * 1000 > args.max_ready_ms:
+        print(f"REGRESSION: import-to-ready above {args.max_ready_ms}ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--model", default="progress_predictor_extended.pkl")
+    parser.add_argument("--compiled", default="progress_predictor_compiled")
+    parser.add_argument("--max-ready-ms", type=float, default=0)
+    main(parser.parse_args())
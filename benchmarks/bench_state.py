@@ -0,0 +1,100 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tracemalloc
+
+# Память бота во времени при «текучке» пользователей: часть пользователей проходит
+# онбординг до конца, часть бросает его на середине. Брошенные диалоги должны
+# уходить по STATE_TTL, завершённые — сразу после END.
+# Запуск: python -m benchmarks.bench_state --backend mongo|file
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--users-per-round", type=int, default=200)
+    parser.add_argument("--abandon", type=float, default=0.4)
+    parser.add_argument("--ttl", type=float, default=3)
+    parser.add_argument("--backend", choices=["mongo", "file"], default="mongo")
+    parser.add_argument("--state-file", default="/tmp/bench_state.json")
+    return parser.parse_args()
+
+
+def conversation_entries(application):
+    from telegram.ext import ConversationHandler
+
+    return sum(
+        len(handler._conversations)
+        for handlers in application.handlers.values() for handler in handlers
+        if isinstance(handler, ConversationHandler)
+    )
+
+
+async def main(args):
+    import mongomock
+    from telegram import Update
+    from main import FitnessAssistantBot
+    from outcome_log import OutcomeLog
+    from persistence import create_persistence
+    from storage import ThreadedDatabase
+    from benchmarks.fake_telegram import FakeBotAPI, UpdateGenerator, ONBOARDING
+
+    logging.disable(logging.WARNING)
+    rng = random.Random(1)
+    generator = UpdateGenerator()
+    db = ThreadedDatabase(mongomock.MongoClient()["fitness_bot"])
+    async with FakeBotAPI() as api:
+        persistence = create_persistence(db, args.backend, path=args.state_file) if args.backend == "file" \
+            else create_persistence(db, args.backend)
+        bot = FitnessAssistantBot("1:fake", db=db, persistence=persistence, base_url=api.base_url)
+        bot.outcomes = OutcomeLog(enabled=False)
+        application = bot.application
+        await application.initialize()
+        await bot.startup(application)
+        await application.start()
+
+        async def drive(user_id, texts):
+            for update in generator.conversation(user_id, texts):
+                await application.process_update(Update.de_json(update, application.bot))
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        print(f"{'t, s':>6} {'users':>7} {'user_data':>10} {'conversations':>14} {'heap, MB':>9} {'flushes':>8} {'writes':>7}")
+
+        def sample(total_users):
+            heap = tracemalloc.get_traced_memory()[0] / 2 ** 20
+            print(f"{time.perf_counter() - start:6.1f} {total_users:7d} {len(application.user_data):10d} "
+                  f"{conversation_entries(application):14d} {heap:9.1f} {persistence.flushes:8d} {persistence.writes:7d}")
+
+        next_user = 10_000
+        for _ in range(args.rounds):
+            jobs = []
+            for _ in range(args.users_per_round):
+                texts = ONBOARDING
+                if rng.random() < args.abandon:
+                    texts = ONBOARDING[:rng.randint(1, len(ONBOARDING) - 1)]
+                jobs.append(drive(next_user, texts))
+                next_user += 1
+            await asyncio.gather(*jobs)
+            await application.update_persistence()
+            sample(next_user - 10_000)
+
+        # брошенные диалоги доживают до TTL и снимаются таймаутом ConversationHandler
+        await asyncio.sleep(args.ttl + 1.5)
+        await application.update_persistence()
+        await persistence.flush()
+        sample(next_user - 10_000)
+
+        await application.stop()
+        await application.shutdown()
+        await bot.shutdown(application)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    # TTL читается при импорте main/persistence
+    os.environ["STATE_TTL"] = str(args.ttl)
+    asyncio.run(main(args))
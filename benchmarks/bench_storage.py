@@ -0,0 +1,87 @@
+import time
+import asyncio
+import logging
+import argparse
+
+import mongomock
+
+from storage import ThreadedDatabase, UserProfileManager, PREDICT_FIELDS, PLAN_FIELDS, PLAN_REF_FIELDS
+
+# Сколько обращений к Mongo делает каждая команда бота: без кэша профилей и с ним.
+# Запуск: python -m benchmarks.bench_storage
+
+
+def profile_for(user_id):
+    return {"name": f"user{user_id}", "age": 30, "gender": "male", "weight": 80.0,
+            "height": 180.0, "fitness_goal": "weight loss", "fitness_level": "beginner"}
+
+
+# те же обращения к хранилищу, что и у хендлеров в main.py
+async def cmd_start(profiles, user_id):
+    await profiles.save_user_profile(user_id, profile_for(user_id))
+
+
+async def cmd_profile(profiles, user_id):
+    profile = await profiles.get_user_profile(user_id)
+    await profiles.get_user_plan(profile.plan_id)
+
+
+async def cmd_plan(profiles, user_id):
+    await profiles.get_user_profile(user_id, PLAN_FIELDS)
+    await profiles.save_user_plan(user_id, "Day 1: walk")
+
+
+async def cmd_improve(profiles, user_id):
+    await profiles.get_user_profile(user_id, PLAN_REF_FIELDS)  # improve_plan
+    profile = await profiles.get_user_profile(user_id, PLAN_FIELDS)  # process_improvement
+    await profiles.get_user_plan(profile.plan_id)
+    await profiles.save_user_plan(user_id, "Day 1: run")
+
+
+async def cmd_deleteplan(profiles, user_id):
+    await profiles.get_user_profile(user_id, PLAN_REF_FIELDS)
+    await profiles.delete_user_plan(user_id)
+
+
+async def cmd_predict(profiles, user_id):
+    await profiles.get_user_profile(user_id, PREDICT_FIELDS)
+
+
+COMMANDS = [cmd_start, cmd_profile, cmd_plan, cmd_improve, cmd_deleteplan, cmd_predict]
+
+
+async def run(cache_size, users):
+    db = ThreadedDatabase(mongomock.MongoClient()["fitness_bot"])
+    profiles = UserProfileManager(db["user_profiles"], db["user_plans"], cache_size=cache_size,
+                                  plan_cache_size=cache_size)
+    await profiles.ensure_indexes()
+    results = {}
+    for command in COMMANDS:
+        before = profiles.round_trips
+        start = time.perf_counter()
+        await asyncio.gather(*(command(profiles, u) for u in range(users)))
+        elapsed = time.perf_counter() - start
+        results[command.__name__[4:]] = ((profiles.round_trips - before) / users, elapsed)
+    return results
+
+
+async def main(args):
+    logging.disable(logging.CRITICAL)
+    baseline = await run(0, args.users)
+    cached = await run(args.cache_size, args.users)
+    print(f"{'command':<12} {'trips/cmd (no cache)':>22} {'trips/cmd (cache)':>18} {'time no cache':>14} {'time cache':>11}")
+    total_base = total_cached = 0.0
+    for name in baseline:
+        b_trips, b_time = baseline[name]
+        c_trips, c_time = cached[name]
+        total_base += b_trips
+        total_cached += c_trips
+        print(f"/{name:<11} {b_trips:>22.2f} {c_trips:>18.2f} {b_time:>13.3f}s {c_time:>10.3f}s")
+    print(f"{'total':<12} {total_base:>22.2f} {total_cached:>18.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--cache-size", type=int, default=10000)
+    asyncio.run(main(parser.parse_args()))
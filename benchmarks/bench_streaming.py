@@ -0,0 +1,94 @@
+import time
+import asyncio
+import logging
+import argparse
+
+from benchmarks.bench_llm import percentile
+from benchmarks.fake_openai import FakeOpenAIServer, FAKE_PLAN
+from benchmarks.fake_telegram import FakeBotAPI, UpdateGenerator
+
+# /plan через настоящий хендлер: время до первого текста плана у пользователя
+# (time-to-first-byte) и до полного ответа, обычный ответ против стриминга.
+# Fake OpenAI отдаёт первый токен через --first-token-ms, весь ответ за --latency-ms.
+# Запуск: python -m benchmarks.bench_streaming
+
+
+def profile_for(user_id):
+    return {"name": f"user{user_id}", "age": 30, "gender": "male", "weight": 80.0,
+            "height": 180.0, "fitness_goal": "weight loss", "fitness_level": "beginner"}
+
+
+def user_timings(api, user_id, start):
+    calls = [(method, params, at) for method, params, at in api.calls
+             if method in ("sendMessage", "editMessageText") and int(params.get("chat_id", 0)) == user_id]
+    first_text = next(at for _, params, at in calls if params.get("text", "").startswith("Your Fitness Plan:"))
+    edits = sum(1 for method, _, _ in calls if method == "editMessageText")
+    messages = sum(1 for method, _, _ in calls if method == "sendMessage")
+    return calls[0][2] - start, first_text - start, calls[-1][2] - start, edits, messages
+
+
+async def run(bot, api, users, first_user, streaming):
+    from telegram import Update
+
+    bot.streaming = streaming
+    application = bot.application
+    generator = UpdateGenerator(start_id=first_user)
+    user_ids = range(first_user, first_user + users)
+    for user_id in user_ids:
+        await bot.profiles.save_user_profile(user_id, profile_for(user_id))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        application.process_update(Update.de_json(generator.update(user_id, "/plan"), application.bot))
+        for user_id in user_ids
+    ))
+    return [user_timings(api, user_id, start) for user_id in user_ids]
+
+
+def report(name, timings):
+    first_reply, first_text, complete, edits, messages = zip(*timings)
+    print(
+        f"{name:<10} first reply p50={percentile(first_reply, 50) * 1000:7.0f}ms "
+        f"first text p50={percentile(first_text, 50) * 1000:7.0f}ms p99={percentile(first_text, 99) * 1000:7.0f}ms "
+        f"complete p50={percentile(complete, 50) * 1000:7.0f}ms "
+        f"edits/reply={sum(edits) / len(edits):4.1f} messages/reply={sum(messages) / len(messages):3.1f}"
+    )
+
+
+async def main(args):
+    import mongomock
+    from main import FitnessAssistantBot
+    from outcome_log import OutcomeLog
+    from storage import ThreadedDatabase
+
+    logging.disable(logging.WARNING)
+    reply = "\n".join([FAKE_PLAN] * max(1, args.reply_chars // len(FAKE_PLAN)))
+    server = FakeOpenAIServer(latency=args.latency_ms / 1000, first_token_latency=args.first_token_ms / 1000,
+                              reply=reply)
+    async with server, FakeBotAPI() as api:
+        db = ThreadedDatabase(mongomock.MongoClient()["fitness_bot"])
+        bot = FitnessAssistantBot("1:fake", db=db, base_url=api.base_url)
+        bot.outcomes = OutcomeLog(enabled=False)
+        bot.plan_cache.enabled = False
+        bot.ai_assistant.llm.api_base = server.url
+        bot.ai_assistant.llm.api_key = "fake"
+        await bot.application.initialize()
+        # прогрев: импорт openai/aiohttp при первом запросе не должен попасть в замер
+        await bot.ai_assistant.llm.complete([{"role": "user", "content": "warm up"}])
+
+        print(f"fake latency={args.latency_ms:.0f}ms first token={args.first_token_ms:.0f}ms "
+              f"reply={len(reply)} chars users={args.users}")
+        report("blocking", await run(bot, api, args.users, 10_000, streaming=False))
+        report("streaming", await run(bot, api, args.users, 20_000, streaming=True))
+
+        await bot.application.shutdown()
+        await bot.shutdown(bot.application)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=6000)
+    parser.add_argument("--first-token-ms", type=float, default=400)
+    parser.add_argument("--reply-chars", type=int, default=1200)
+    asyncio.run(main(parser.parse_args()))
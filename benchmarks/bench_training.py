@@ -0,0 +1,86 @@
+import os
+import time
+import argparse
+
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.multioutput import MultiOutputRegressor
+from sklearn.metrics import r2_score
+
+from features import TARGET_COLUMNS
+from train_progress_model import (DATASET_PATH, CATEGORICAL_FEATURES, build_pipeline,
+                                  holdout_mask, load_dataset)
+
+# Время обучения модели прогресса в зависимости от числа строк: прежняя схема
+# (MultiOutputRegressor, два леса, одно ядро) против многовыходного леса на всех
+# ядрах и его варианта для больших данных (max_samples, min_samples_leaf).
+# Синтетические строки — выборка из датасета с шумом в числовых колонках, поэтому
+# R² на них завышен (почти-дубликаты в train и test) и годится только для сравнения.
+# Запуск: python -m benchmarks.bench_training --rows 350 10000 100000 1000000
+
+
+def synthetic_rows(x, y, rows, seed=0):
+    if rows <= len(x):
+        return x.head(rows), y.head(rows)
+    rng = np.random.default_rng(seed)
+    index = rng.integers(0, len(x), rows)
+    x, y = x.iloc[index].reset_index(drop=True), y.iloc[index].reset_index(drop=True).copy()
+    x = x.copy()
+    for column in x.columns:
+        if column not in CATEGORICAL_FEATURES and x[column].dtype.kind == "f":
+            x[column] += rng.normal(0, x[column].std() * 0.05, rows)
+    for column in TARGET_COLUMNS:
+        y[column] += rng.normal(0, y[column].std() * 0.05, rows)
+    return x, y
+
+
+def configs(n_estimators):
+    def baseline(numerical):
+        pipeline = build_pipeline(numerical, n_estimators, n_jobs=1)
+        pipeline.steps[-1] = ("regressor", MultiOutputRegressor(RandomForestRegressor(n_estimators=n_estimators,
+                                                                                     random_state=42)))
+        return pipeline
+
+    return [
+        ("2 forests, 1 core", baseline),
+        ("multi-output, all cores", lambda numerical: build_pipeline(numerical, n_estimators, n_jobs=-1)),
+        ("multi-output, subsampled", lambda numerical: build_pipeline(numerical, n_estimators, n_jobs=-1,
+                                                                     min_samples_leaf=5, max_samples=0.25)),
+    ]
+
+
+def node_count(pipeline):
+    regressor = pipeline.named_steps["regressor"]
+    forests = regressor.estimators_ if isinstance(regressor, MultiOutputRegressor) else [regressor]
+    return sum(tree.tree_.node_count for forest in forests for tree in forest.estimators_)
+
+
+def main(args):
+    x, y = load_dataset([DATASET_PATH])
+    numerical = [col for col in x.columns if col not in CATEGORICAL_FEATURES]
+    runs = configs(args.n_estimators)
+    print(f"cores={os.cpu_count()} trees={args.n_estimators}")
+    print(f"{'rows':>9} {'config':<26} {'fit, s':>8} {'rows/s':>10} {'nodes':>10} {'R²':>6}")
+    for rows in args.rows:
+        x_rows, y_rows = synthetic_rows(x, y, rows)
+        test = holdout_mask(x_rows, y_rows, 0.2)
+        for name, make in runs:
+            if rows > args.full_tree_max_rows and "subsampled" not in name:
+                # полные деревья на миллионе строк — минуты на дерево на одном ядре
+                print(f"{rows:9d} {name:<26} {'skipped (--full-tree-max-rows)':>40}")
+                continue
+            pipeline = make(numerical)
+            start = time.perf_counter()
+            pipeline.fit(x_rows[~test], y_rows[~test])
+            elapsed = time.perf_counter() - start
+            score = r2_score(y_rows[test], pipeline.predict(x_rows[test]))
+            print(f"{rows:9d} {name:<26} {elapsed:8.2f} {(~test).sum() / elapsed:10.0f} "
+                  f"{node_count(pipeline):10d} {score:6.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[350, 10_000, 100_000, 1_000_000])
+    parser.add_argument("--n-estimators", type=int, default=20)
+    parser.add_argument("--full-tree-max-rows", type=int, default=100_000)
+    main(parser.parse_args())
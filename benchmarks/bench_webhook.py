@@ -0,0 +1,78 @@
+import time
+import asyncio
+import logging
+import argparse
+import functools
+
+import aiohttp
+
+from webhook import WebhookFrontend
+from benchmarks.fake_telegram import FakeBotAPI, UpdateGenerator, ONBOARDING
+
+# Пропускная способность webhook-фронта в зависимости от числа воркеров.
+# Каждый пользователь проходит онбординг /start, сообщения пользователя идут
+# последовательно, пользователи — параллельно. Ответы бота принимает fake Bot API.
+# Запуск: python -m benchmarks.bench_webhook --workers 1 2 4
+
+
+def bench_bot_factory(base_url, shard_index, shard_count):
+    import mongomock
+    from main import FitnessAssistantBot
+    from outcome_log import OutcomeLog
+    from persistence import MongoPersistence
+    from storage import ThreadedDatabase
+
+    logging.disable(logging.INFO)
+    # mongomock живёт внутри процесса: для замера пропускной способности этого достаточно
+    db = ThreadedDatabase(mongomock.MongoClient()["fitness_bot"])
+    persistence = MongoPersistence(db, shard_index, shard_count)
+    bot = FitnessAssistantBot("1:fake", db=db, persistence=persistence, base_url=base_url)
+    bot.outcomes = OutcomeLog(enabled=False)
+    return bot
+
+
+async def wait_alive(frontend):
+    await asyncio.sleep(0.02)
+    if not frontend.alive():
+        raise RuntimeError("A bot worker died, see its traceback above")
+
+
+async def drive_user(session, url, generator, user_id):
+    for update in generator.conversation(user_id, ONBOARDING):
+        async with session.post(url, json=update) as response:
+            response.raise_for_status()
+
+
+async def run(workers, users, api):
+    frontend = WebhookFrontend(workers, functools.partial(bench_bot_factory, api.base_url),
+                               host="127.0.0.1", port=0, secret=None)
+    await frontend.start()
+    # ждём, пока все воркеры ответят на getMe
+    while api.count("getMe") < workers:
+        await wait_alive(frontend)
+
+    url = f"http://127.0.0.1:{frontend.port}{frontend.path}"
+    expected = api.count("sendMessage") + users * len(ONBOARDING)
+    generator = UpdateGenerator()
+    start = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(drive_user(session, url, generator, 1000 + u) for u in range(users)))
+    while api.count("sendMessage") < expected:
+        await wait_alive(frontend)
+    elapsed = time.perf_counter() - start
+    await frontend.close()
+    return users * len(ONBOARDING) / elapsed
+
+
+async def main(args):
+    async with FakeBotAPI() as api:
+        for workers in args.workers:
+            rate = await run(workers, args.users, api)
+            print(f"workers={workers:<3} users={args.users:<6} updates/sec={rate:9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--users", type=int, default=200)
+    asyncio.run(main(parser.parse_args()))
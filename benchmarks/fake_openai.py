@@ -0,0 +1,201 @@
+import re
+import json
+import time
+import random
+import asyncio
+import argparse
+
+# Локальный fake /v1/chat/completions: отвечает после заданной задержки,
+# чтобы мерить задержку хендлеров без сети и без расхода токенов.
+# С "stream": true отдаёт SSE: первый токен через first_token_latency,
+# остальные равномерно до latency — полное время ответа то же, что без стриминга.
+# Сбои: error_rate — доля ответов 503, slow_rate — доля ответов с задержкой
+# slow_latency (хвост), outage=True — все запросы получают 503, пока не выключат.
+
+FAKE_PLAN = (
+    "Day 1: 30 min brisk walk, 3x12 squats, 3x10 push-ups\n"
+    "Day 2: Rest or light stretching\n"
+    "Day 3: 20 min intervals, 3x12 lunges, 3x30s plank\n"
+    "Day 4: Rest\n"
+    "Day 5: 30 min cycling, 3x10 rows, 3x12 glute bridges\n"
+    "Day 6: 45 min easy run or swim\n"
+    "Day 7: Rest and mobility work"
+)
+
+
+class FakeOpenAIServer:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.5, jitter=0.0, reply=FAKE_PLAN,
+                 first_token_latency=0.3, error_rate=0.0, slow_rate=0.0, slow_latency=10.0, seed=None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.first_token_latency = first_token_latency
+        self.jitter = jitter
+        self.reply = reply
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.outage = False
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self._server = None
+        self._connections = set()
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            # закрываем keep-alive соединения, чтобы хендлеры вышли сами
+            for writer in list(self._connections):
+                writer.close()
+            # потоковые ответы замечают закрытие на следующем токене
+            while self._connections:
+                await asyncio.sleep(0.01)
+            await self._server.wait_closed()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _read_request(self, reader):
+        head = await reader.readuntil(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        method, path, _ = lines[0].split(" ", 2)
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                k, v = line.split(":", 1)
+                headers[k.strip().lower()] = v.strip()
+        body = await reader.readexactly(int(headers.get("content-length", 0)))
+        return method, path, headers, body
+
+    async def _handle(self, reader, writer):
+        self._connections.add(writer)
+        try:
+            while True:
+                try:
+                    method, path, headers, body = await self._read_request(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                payload = json.loads(body or b"{}")
+                self.requests += 1
+                if self.outage or self.rng.random() < self.error_rate:
+                    # сбой приходит не мгновенно: балансировщик тоже думает
+                    self.errors += 1
+                    await asyncio.sleep(min(self.latency, 0.05))
+                    self._write_json(writer, 503, {"error": {"message": "The server is overloaded",
+                                                             "type": "server_error"}})
+                else:
+                    latency = max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+                    if self.rng.random() < self.slow_rate:
+                        latency = self.slow_latency
+                    if payload.get("stream"):
+                        # поток без Content-Length заканчивается закрытием соединения
+                        await self._stream(writer, payload, latency)
+                        break
+                    await asyncio.sleep(latency)
+                    self._write_json(writer, 200, self._completion(payload))
+                try:
+                    await writer.drain()
+                except ConnectionError:
+                    # клиент не дождался ответа (отменённый дубль hedge)
+                    break
+                if headers.get("connection", "").lower() == "close":
+                    break
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    def _completion(self, payload):
+        return {
+            "id": f"chatcmpl-fake-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": self.reply},
+                "finish_reason": "stop",
+            }],
+            # грубая оценка, чтобы учёт токенов в боте было на чём проверить
+            "usage": self._usage(payload),
+        }
+
+    def _usage(self, payload):
+        prompt = sum(len(re.findall(r"\S+", m.get("content", ""))) for m in payload.get("messages", []))
+        completion = len(re.findall(r"\S+", self.reply))
+        return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+    async def _stream(self, writer, payload, latency):
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Connection: close\r\n"
+            b"\r\n"
+        )
+        tokens = re.findall(r"\S+\s*", self.reply) or [""]
+        first = min(self.first_token_latency, latency)
+        step = (latency - first) / max(1, len(tokens) - 1)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for i, token in enumerate(tokens):
+            # по расписанию от начала ответа, чтобы задержки sleep не накапливались
+            await asyncio.sleep(max(0.0, started + first + i * step - loop.time()))
+            if writer.is_closing():
+                return
+            chunk = {
+                "id": f"chatcmpl-fake-{self.requests}",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": payload.get("model", "fake"),
+                "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+            }
+            writer.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            try:
+                await writer.drain()
+            except ConnectionError:
+                # клиент бросил поток
+                return
+        writer.write(b"data: [DONE]\n\n")
+
+    @staticmethod
+    def _write_json(writer, status, data):
+        body = json.dumps(data).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} OK\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "\r\n".encode("latin-1") + body
+        )
+
+
+async def _serve(args):
+    server = await FakeOpenAIServer(args.host, args.port, args.latency_ms / 1000, args.jitter_ms / 1000,
+                                    first_token_latency=args.first_token_ms / 1000, error_rate=args.error_rate,
+                                    slow_rate=args.slow_rate, slow_latency=args.slow_ms / 1000).start()
+    print(f"Fake OpenAI listening on {server.url}")
+    await server._server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local fake OpenAI chat completion server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=1500)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--first-token-ms", type=float, default=300)
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of requests answered with 503")
+    parser.add_argument("--slow-rate", type=float, default=0, help="fraction of requests answered after --slow-ms")
+    parser.add_argument("--slow-ms", type=float, default=10000)
+    asyncio.run(_serve(parser.parse_args()))
@@ -0,0 +1,108 @@
+import json
+import time
+import asyncio
+import itertools
+
+from aiohttp import web
+
+# Локальные заглушки Telegram: генератор апдейтов и fake Bot API, который
+# записывает все вызовы (sendMessage, editMessageText, ...). Бот подключается
+# к нему через ApplicationBuilder().base_url(server.base_url).
+
+ONBOARDING = ["/start", "Alex", "30", "Male", "80", "180", "Weight Loss", "Beginner"]
+PREDICT = ["/predict", "3", "45", "7.5", "yes", "no", "80"]
+
+
+def make_update(update_id, user_id, text):
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private", "first_name": f"user{user_id}"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        # CommandHandler смотрит на entity bot_command в начале сообщения
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+class UpdateGenerator:
+    def __init__(self, start_id=1):
+        self._ids = itertools.count(start_id)
+
+    def update(self, user_id, text):
+        return make_update(next(self._ids), user_id, text)
+
+    def conversation(self, user_id, texts):
+        return [self.update(user_id, text) for text in texts]
+
+
+class FakeBotAPI:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.calls = []
+        self._message_ids = itertools.count(1)
+        self._runner = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/bot"
+
+    def count(self, method):
+        return sum(1 for call in self.calls if call[0] == method)
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _params(self, request):
+        if request.content_type == "application/json":
+            return await request.json()
+        params = {}
+        for key, value in (await request.post()).items():
+            try:
+                params[key] = json.loads(value)
+            except (TypeError, ValueError):
+                params[key] = value
+        return params
+
+    async def _handle(self, request):
+        method = request.match_info["method"]
+        params = await self._params(request)
+        self.calls.append((method, params, time.perf_counter()))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response({"ok": True, "result": self._result(method, params)})
+
+    def _result(self, method, params):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+        if method in ("sendMessage", "editMessageText"):
+            chat_id = int(params.get("chat_id", 0))
+            message_id = params.get("message_id") or next(self._message_ids)
+            return {
+                "message_id": int(message_id),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", ""),
+            }
+        return True
@@ -0,0 +1,152 @@
+import os
+import time
+import asyncio
+import logging
+import argparse
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from features import ANSWER_FIELDS, FEATURE_COLUMNS, PROFILE_FIELDS, build_feature_columns
+from inference import MODEL_PATH, COMPILED_MODEL_PATH, MODEL_MMAP_MODE, load_model
+
+logger = logging.getLogger(__name__)
+
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "10000"))
+BULK_WORKERS = int(os.getenv("BULK_WORKERS", str(os.cpu_count() or 1)))
+BULK_EXECUTOR = os.getenv("BULK_EXECUTOR", "process")  # process | thread
+
+# ответы /predict, которые сценарий не задал явно
+SCENARIO_DEFAULTS = {
+    "sessions_per_week": 3,
+    "session_duration_minutes": 45,
+    "sleep_hours": 7.0,
+    "diet_followed": False,
+    "restrictions_or_breaks": False,
+    "consistency_percent": 80.0,
+}
+
+_model = None
+
+
+def _init_worker(model_path, compiled_path, mmap_mode):
+    global _model
+    _model = load_model(model_path, compiled_path, mmap_mode)
+
+
+def predict_columns(model, columns):
+    if hasattr(model, "predict_columns"):
+        return model.predict_columns(columns)
+    import pandas as pd
+    return model.predict(pd.DataFrame(columns)[FEATURE_COLUMNS])
+
+
+def score_chunk(profiles, answers):
+    # в воркере: признаки всей пачки массивами и один проход модели
+    predictions = predict_columns(_model, build_feature_columns(profiles, answers))
+    return [p["user_id"] for p in profiles], predictions.tolist()
+
+
+class BulkScorer:
+    # "Что если" по всей базе: профили читаются из Mongo кусками по chunk_size,
+    # куски считаются параллельно в пуле, результаты уходят bulk_write'ом в
+    # scenario_scores. В работе не больше workers + 1 кусков — память ограничена
+    # размером куска, а не числом профилей.
+
+    def __init__(self, db, scenario, answers, chunk_size=BULK_CHUNK_SIZE, workers=BULK_WORKERS,
+                 executor=BULK_EXECUTOR, model_path=MODEL_PATH, compiled_path=COMPILED_MODEL_PATH,
+                 mmap_mode=MODEL_MMAP_MODE):
+        self.profiles = db["user_profiles"]
+        self.scores = db["scenario_scores"]
+        self.scenario = scenario
+        self.answers = {**SCENARIO_DEFAULTS, **answers}
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.executor = executor
+        self.model_args = (model_path, compiled_path, mmap_mode)
+        self.model_version = None
+        self.scored = 0
+        self.chunks = 0
+
+    async def ensure_indexes(self):
+        await self.scores.create_index([("scenario", 1), ("user_id", 1)], unique=True)
+
+    async def _write(self, scored):
+        from pymongo import UpdateOne
+
+        user_ids, predictions = await scored
+        now = datetime.now(timezone.utc)
+        await self.scores.bulk_write([
+            UpdateOne({"scenario": self.scenario, "user_id": user_id},
+                      {"$set": {"weeks_to_goal": weeks, "kg_change": kg,
+                                "model_version": self.model_version, "scored_at": now}},
+                      upsert=True)
+            for user_id, (weeks, kg) in zip(user_ids, predictions)
+        ], ordered=False)
+        self.scored += len(user_ids)
+        self.chunks += 1
+
+    async def run(self):
+        if self.executor == "process":
+            # воркеры грузят свою копию (через mmap — общие страницы), здесь она нужна ради версии
+            model = load_model(*self.model_args)
+            pool = ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=self.model_args)
+        else:
+            _init_worker(*self.model_args)
+            model = _model
+            pool = ThreadPoolExecutor(self.workers, thread_name_prefix="bulk-score")
+        self.model_version = getattr(model, "meta", {}).get("model_version")
+        loop = asyncio.get_running_loop()
+        query = {field: {"$exists": True} for field in PROFILE_FIELDS}
+        projection = {"_id": 0, "user_id": 1, **{field: 1 for field in PROFILE_FIELDS}}
+        cursor = self.profiles.find(query, projection, batch_size=self.chunk_size)
+        in_flight = []
+        try:
+            while True:
+                profiles = await cursor.to_list(self.chunk_size)
+                if not profiles:
+                    break
+                scored = loop.run_in_executor(pool, score_chunk, profiles, self.answers)
+                in_flight.append(asyncio.ensure_future(self._write(scored)))
+                # следующий кусок читаем, пока считаются предыдущие
+                if len(in_flight) > self.workers:
+                    await in_flight.pop(0)
+            await asyncio.gather(*in_flight)
+        finally:
+            pool.shutdown(wait=True)
+        return self.scored
+
+
+async def score_all(args):
+    from storage import create_database
+
+    answers = {field: getattr(args, field) for field in ANSWER_FIELDS if getattr(args, field) is not None}
+    scorer = BulkScorer(create_database(args.mongo_uri), args.scenario, answers, args.chunk_size,
+                        args.workers, args.executor)
+    await scorer.ensure_indexes()
+    start = time.perf_counter()
+    scored = await scorer.run()
+    elapsed = time.perf_counter() - start
+    print(f"Scenario {args.scenario!r}: {scored} profiles in {elapsed:.1f}s "
+          f"({scored / max(elapsed, 1e-9):.0f}/s), model {scorer.model_version}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Score a what-if scenario for every user profile")
+    parser.add_argument("--scenario", required=True, help="name the results are stored under")
+    parser.add_argument("--sessions-per-week", dest="sessions_per_week", type=int)
+    parser.add_argument("--session-duration-minutes", dest="session_duration_minutes", type=int)
+    parser.add_argument("--sleep-hours", dest="sleep_hours", type=float)
+    parser.add_argument("--diet-followed", dest="diet_followed", type=lambda v: v.lower() in ("1", "yes", "true"))
+    parser.add_argument("--restrictions-or-breaks", dest="restrictions_or_breaks",
+                        type=lambda v: v.lower() in ("1", "yes", "true"))
+    parser.add_argument("--consistency-percent", dest="consistency_percent", type=float)
+    parser.add_argument("--chunk-size", type=int, default=BULK_CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=BULK_WORKERS)
+    parser.add_argument("--executor", choices=["process", "thread"], default=BULK_EXECUTOR)
+    parser.add_argument("--mongo-uri", default=os.getenv("MONGO_DB_URI"))
+    asyncio.run(score_all(parser.parse_args()))
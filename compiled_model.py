@@ -0,0 +1,198 @@
+import os
+import json
+
+import numpy as np
+
+# Скомпилированная модель прогресса: препроцессинг и леса из пайплайна sklearn,
+# разложенные в плоские массивы NumPy. На сервинге нужен только numpy —
+# ни pandas, ни sklearn не импортируются.
+
+COMPILED_FORMAT_VERSION = 1
+
+
+def _flatten_forest(forest):
+    # Все деревья леса в общие массивы узлов. Лист ссылается сам на себя,
+    # поэтому обход — фиксированное число шагов без проверки на лист.
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        n = tree.node_count
+        left = tree.children_left.astype(np.int32)
+        right = tree.children_right.astype(np.int32)
+        is_leaf = left == -1
+        own = np.arange(n, dtype=np.int32)
+        features.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+        thresholds.append(tree.threshold.astype(np.float64))
+        lefts.append(np.where(is_leaf, own, left) + offset)
+        rights.append(np.where(is_leaf, own, right) + offset)
+        values.append(tree.value[:, :, 0].astype(np.float64))
+        roots.append(offset)
+        offset += n
+        max_depth = max(max_depth, tree.max_depth)
+    return {
+        "feature": np.concatenate(features),
+        "threshold": np.concatenate(thresholds),
+        "left": np.concatenate(lefts).astype(np.int32),
+        "right": np.concatenate(rights).astype(np.int32),
+        "value": np.concatenate(values),
+        "roots": np.asarray(roots, dtype=np.int32),
+    }, max_depth
+
+
+def compile_pipeline(pipeline, model_version=None):
+    preprocessor = pipeline.named_steps["preprocessor"]
+    regressor = pipeline.named_steps["regressor"]
+
+    transformers = {name: (steps, columns) for name, steps, columns in preprocessor.transformers_}
+    num_steps, num_columns = transformers["num"]
+    cat_steps, cat_columns = transformers["cat"]
+    onehot = cat_steps.named_steps["onehot"]
+
+    arrays = {
+        "num_median": num_steps.named_steps["imputer"].statistics_.astype(np.float64),
+        "num_mean": num_steps.named_steps["scaler"].mean_.astype(np.float64),
+        "num_scale": num_steps.named_steps["scaler"].scale_.astype(np.float64),
+    }
+    meta = {
+        "version": COMPILED_FORMAT_VERSION,
+        # версия обучения (models/vNNNN), по ней сервинг понимает, что модель сменилась
+        "model_version": model_version,
+        "num_columns": list(num_columns),
+        "cat_columns": list(cat_columns),
+        "cat_fill": cat_steps.named_steps["imputer"].fill_value,
+        "categories": [[str(c) for c in cats] for cats in onehot.categories_],
+        "forests": [],
+    }
+
+    # MultiOutputRegressor — по лесу на выход; нативный многовыходной лес — один
+    forests = getattr(regressor, "estimators_", None)
+    if forests is None or not hasattr(forests[0], "estimators_"):
+        forests = [regressor]
+    for i, forest in enumerate(forests):
+        flat, max_depth = _flatten_forest(forest)
+        for name, array in flat.items():
+            arrays[f"forest{i}_{name}"] = array
+        meta["forests"].append({"max_depth": int(max_depth), "n_outputs": int(flat["value"].shape[1])})
+    return meta, arrays
+
+
+def export_compiled(pipeline, path, model_version=None):
+    meta, arrays = compile_pipeline(pipeline, model_version)
+    os.makedirs(path, exist_ok=True)
+    # отдельные .npy, а не .npz — их можно открыть через mmap
+    for name, array in arrays.items():
+        np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(array))
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    return CompiledProgressModel(meta, arrays)
+
+
+class CompiledProgressModel:
+    accepts_records = True
+
+    def __init__(self, meta, arrays):
+        self.meta = meta
+        self.arrays = arrays
+        self.num_columns = meta["num_columns"]
+        self.cat_columns = meta["cat_columns"]
+        self.cat_fill = meta["cat_fill"]
+        # категория -> позиция в one-hot блоке
+        self.cat_lookup = []
+        position = len(self.num_columns)
+        for cats in meta["categories"]:
+            self.cat_lookup.append({c: position + j for j, c in enumerate(cats)})
+            position += len(cats)
+        self.n_features = position
+        self.forests = [
+            {name: arrays[f"forest{i}_{name}"] for name in ("feature", "threshold", "left", "right", "value", "roots")}
+            | {"max_depth": forest["max_depth"]}
+            for i, forest in enumerate(meta["forests"])
+        ]
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        arrays = {
+            name[:-4]: np.load(os.path.join(path, name), mmap_mode=mmap_mode)
+            for name in os.listdir(path) if name.endswith(".npy")
+        }
+        return cls(meta, arrays)
+
+    def transform(self, rows):
+        if isinstance(rows, dict):
+            rows = [rows]
+        n = len(rows)
+        num = np.empty((n, len(self.num_columns)), dtype=np.float64)
+        for i, row in enumerate(rows):
+            for j, column in enumerate(self.num_columns):
+                value = row.get(column)
+                num[i, j] = np.nan if value is None else float(value)
+        median = self.arrays["num_median"]
+        missing = np.isnan(num)
+        if missing.any():
+            num[missing] = np.broadcast_to(median, num.shape)[missing]
+
+        x = np.zeros((n, self.n_features), dtype=np.float64)
+        x[:, :len(self.num_columns)] = (num - self.arrays["num_mean"]) / self.arrays["num_scale"]
+        for i, row in enumerate(rows):
+            for column, lookup in zip(self.cat_columns, self.cat_lookup):
+                value = row.get(column)
+                # неизвестная категория -> нули, как handle_unknown="ignore"
+                position = lookup.get(self.cat_fill if value is None else str(value))
+                if position is not None:
+                    x[i, position] = 1.0
+        return x
+
+    def transform_columns(self, columns):
+        # то же, что transform, но по колонкам (имя -> массив): для пакетного скоринга
+        n = len(columns[self.num_columns[0]])
+        num = np.column_stack([np.asarray(columns[c], dtype=np.float64) for c in self.num_columns])
+        missing = np.isnan(num)
+        if missing.any():
+            num[missing] = np.broadcast_to(self.arrays["num_median"], num.shape)[missing]
+
+        x = np.zeros((n, self.n_features), dtype=np.float64)
+        x[:, :len(self.num_columns)] = (num - self.arrays["num_mean"]) / self.arrays["num_scale"]
+        rows = np.arange(n)
+        for column, lookup in zip(self.cat_columns, self.cat_lookup):
+            values = np.asarray(columns[column], dtype=object)
+            values = np.where(values == None, self.cat_fill, values).astype(str)  # noqa: E711
+            uniques, inverse = np.unique(values, return_inverse=True)
+            positions = np.array([lookup.get(u, -1) for u in uniques])[inverse]
+            known = positions >= 0
+            x[rows[known], positions[known]] = 1.0
+        return x
+
+    def predict_columns(self, columns):
+        return self.predict_encoded(self.transform_columns(columns))
+
+    def predict_encoded(self, x):
+        # деревья sklearn сравнивают признаки во float32
+        x = np.asarray(x, dtype=np.float32).astype(np.float64)
+        rows = np.arange(x.shape[0])[:, None]
+        outputs = []
+        for forest in self.forests:
+            nodes = np.broadcast_to(forest["roots"], (x.shape[0], forest["roots"].shape[0])).copy()
+            feature, threshold = forest["feature"], forest["threshold"]
+            left, right = forest["left"], forest["right"]
+            for _ in range(forest["max_depth"]):
+                go_left = x[rows, feature[nodes]] <= threshold[nodes]
+                nodes = np.where(go_left, left[nodes], right[nodes])
+            outputs.append(forest["value"][nodes].mean(axis=1))
+        return np.concatenate(outputs, axis=1)
+
+    def predict(self, rows):
+        return self.predict_encoded(self.transform(rows))
+
+
+def check_compiled(pipeline, compiled, x, atol=1e-6):
+    # x — DataFrame признаков; расхождение с пиклом больше atol — ошибка экспорта
+    expected = pipeline.predict(x)
+    actual = compiled.predict(x.to_dict(orient="records"))
+    error = float(np.max(np.abs(expected - actual)))
+    if error > atol:
+        raise AssertionError(f"Compiled model differs from the pipeline by {error:.3g} (atol={atol})")
+    return error
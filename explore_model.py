@@ -11,7 +11,12 @@ print("\n===== Pipeline Structure =====")
 print(model)
 
 
-regressor = model.named_steps["regressor"].estimators_[0]  # для weeks_to_goal
+# MultiOutputRegressor — лес на каждый выход (берём weeks_to_goal); многовыходной лес — общий
+regressor = model.named_steps["regressor"]
+target_label = "weeks_to_goal + kg_change"
+if hasattr(regressor.estimators_[0], "estimators_"):
+    regressor = regressor.estimators_[0]
+    target_label = "weeks_to_goal"
 feature_names = []
 
 # Извлечение имён признаков после трансформации
@@ -32,13 +37,13 @@ feature_importance_df = pd.DataFrame({
 }).sort_values(by="Importance", ascending=False)
 
 # Печать важности
-print("\n===== Feature Importances (weeks_to_goal) =====")
+print(f"\n===== Feature Importances ({target_label}) =====")
 print(feature_importance_df)
 
 # Визуализация важности
 plt.figure(figsize=(10, 6))
 plt.barh(feature_importance_df["Feature"][:10][::-1], feature_importance_df["Importance"][:10][::-1])
-plt.title("Top 10 Feature Importances (weeks_to_goal)")
+plt.title(f"Top 10 Feature Importances ({target_label})")
 plt.xlabel("Importance")
 plt.tight_layout()
 plt.show()
@@ -47,15 +52,13 @@ plt.show()
 
 
 from sklearn.metrics import r2_score
-from sklearn.model_selection import train_test_split
 
-# Загрузка датасета, который использовался для обучения
-df = pd.read_csv("progress_dataset_extended.csv")
-X = df.drop(columns=["weeks_to_goal", "kg_change"])
-y = df[["weeks_to_goal", "kg_change"]]
+from train_progress_model import DATASET_PATH, holdout_mask, load_dataset
 
-
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+# Загрузка датасета, который использовался для обучения; тест — тот же, что при обучении
+X, y = load_dataset([DATASET_PATH])
+test = holdout_mask(X, y, 0.2)
+X_test, y_test = X[test], y[test]
 
 # Предсказание
 y_pred = model.predict(X_test)
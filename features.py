@@ -0,0 +1,80 @@
+# Признаки модели прогресса в том порядке, в котором их видел train_progress_model.py
+FEATURE_COLUMNS = [
+    "age", "weight_start", "height", "gender", "goal", "level",
+    "sessions_per_week", "session_duration_minutes", "sleep_hours",
+    "diet_followed", "restrictions_or_breaks", "consistency_percent",
+]
+TARGET_COLUMNS = ["weeks_to_goal", "kg_change"]
+# поля профиля, из которых строятся признаки
+PROFILE_FIELDS = ["age", "weight", "height", "gender", "fitness_goal", "fitness_level"]
+ANSWER_FIELDS = FEATURE_COLUMNS[6:]
+
+# Бот хранит рост в см и пол в нижнем регистре, в progress_dataset_extended.csv —
+# метры и "Male"/"Female". Приводим к датасету, иначе рост уходит за все пороги
+# деревьев, а пол в one-hot становится неизвестной категорией.
+GENDER_LABELS = {"male": "Male", "female": "Female"}
+
+
+def height_m(height):
+    height = float(height)
+    return height / 100 if height > 3 else height
+
+
+def gender_label(gender):
+    value = str(gender).strip().lower()
+    return GENDER_LABELS.get(value, value.title())
+
+
+def goal_label(goal):
+    return str(goal).strip().lower().replace(" ", "_")
+
+
+def level_label(level):
+    return str(level).strip().lower()
+
+
+def build_feature_row(profile, answers):
+    # profile — документ из user_profiles, answers — ответы из диалога /predict
+    return {
+        "age": profile["age"],
+        "weight_start": profile["weight"],
+        "height": height_m(profile["height"]),
+        "gender": gender_label(profile["gender"]),
+        "goal": goal_label(profile["fitness_goal"]),
+        "level": level_label(profile["fitness_level"]),
+        "sessions_per_week": answers["sessions_per_week"],
+        "session_duration_minutes": answers["session_duration_minutes"],
+        "sleep_hours": answers["sleep_hours"],
+        "diet_followed": answers["diet_followed"],
+        "restrictions_or_breaks": answers["restrictions_or_breaks"],
+        "consistency_percent": answers["consistency_percent"],
+    }
+
+
+def build_feature_columns(profiles, answers):
+    # То же для пачки профилей сразу: колонка -> массив numpy. answers — один
+    # сценарий на всех (скаляры). Категории нормализуются по уникальным значениям.
+    import numpy as np
+
+    n = len(profiles)
+
+    def numeric(field):
+        return np.fromiter((np.nan if p.get(field) is None else p[field] for p in profiles), np.float64, n)
+
+    def categorical(field, label):
+        raw = np.array([str(p.get(field)) for p in profiles], dtype=object)
+        uniques, inverse = np.unique(raw, return_inverse=True)
+        return np.array([label(u) for u in uniques], dtype=object)[inverse]
+
+    height = numeric("height")
+    columns = {
+        "age": numeric("age"),
+        "weight_start": numeric("weight"),
+        "height": np.where(height > 3, height / 100, height),
+        "gender": categorical("gender", gender_label),
+        "goal": categorical("fitness_goal", goal_label),
+        "level": categorical("fitness_level", level_label),
+    }
+    for field in ANSWER_FIELDS:
+        columns[field] = np.full(n, answers[field], dtype=np.float64)
+    return columns
@@ -0,0 +1,239 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import metrics
+from features import FEATURE_COLUMNS
+from prediction_memo import (PREDICTION_MEMO_CHECK_SECONDS, PredictionMemo, artifact_stamp, artifact_version,
+                             memo_key, quantize_row)
+
+logger = logging.getLogger(__name__)
+
+MODEL_PATH = os.getenv("PROGRESS_MODEL_PATH", "progress_predictor_extended.pkl")
+COMPILED_MODEL_PATH = os.getenv("PROGRESS_MODEL_COMPILED_PATH", "progress_predictor_compiled")
+# "r": массивы лесов открываются через mmap, и воркеры делят одни страницы page cache
+MODEL_MMAP_MODE = os.getenv("PROGRESS_MODEL_MMAP", "r") or None
+INFERENCE_MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH", "64"))
+INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "5"))
+INFERENCE_EXECUTOR = os.getenv("INFERENCE_EXECUTOR", "thread")  # thread | process
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+
+_worker_model = None
+
+
+def load_model(model_path=MODEL_PATH, compiled_path=COMPILED_MODEL_PATH, mmap_mode=MODEL_MMAP_MODE):
+    # скомпилированный артефакт (только numpy) предпочтительнее пикла
+    if compiled_path and os.path.isdir(compiled_path):
+        from compiled_model import CompiledProgressModel
+        return CompiledProgressModel.load(compiled_path, mmap_mode=mmap_mode)
+    import joblib
+    return joblib.load(model_path, mmap_mode=mmap_mode)
+
+
+def _init_worker(model_path, compiled_path, mmap_mode):
+    global _worker_model
+    _worker_model = load_model(model_path, compiled_path, mmap_mode)
+
+
+def predict_rows(model, rows):
+    if getattr(model, "accepts_records", False):
+        predictions = model.predict(rows)
+    else:
+        import pandas as pd
+        predictions = model.predict(pd.DataFrame(rows, columns=FEATURE_COLUMNS))
+    return [tuple(float(v) for v in pred) for pred in predictions]
+
+
+def _predict_in_worker(rows):
+    return predict_rows(_worker_model, rows)
+
+
+class BatchPredictor:
+    # Собирает одновременные запросы /predict в микробатчи (не больше max_batch_size,
+    # ждём не дольше max_wait_ms) и считает их в пуле потоков или процессов.
+    # Перед очередью — мемо по квантованной строке: повтор не доходит до леса,
+    # одинаковые строки в полёте считаются один раз. Когда train_progress_model.py
+    # публикует новую модель, мемо очищается, а модель перечитывается.
+
+    def __init__(self, model=None, model_path=MODEL_PATH, compiled_path=COMPILED_MODEL_PATH,
+                 max_batch_size=INFERENCE_MAX_BATCH, max_wait_ms=INFERENCE_MAX_WAIT_MS,
+                 executor=INFERENCE_EXECUTOR, workers=INFERENCE_WORKERS, mmap_mode=MODEL_MMAP_MODE,
+                 memo=None, check_interval=PREDICTION_MEMO_CHECK_SECONDS):
+        # модель грузится лениво, при первом /predict, а не при старте бота
+        self.model = model
+        # переданную готовой модель не перечитываем, за файлами следим только у своей
+        self._watch_artifact = model is None
+        self.model_path = model_path
+        self.compiled_path = compiled_path
+        self.mmap_mode = mmap_mode
+        self._model_lock = threading.Lock()
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.workers = workers
+        self._process = executor == "process"
+        self._executor = None
+        self._waiting = []
+        self._worker = None
+        self._pending = set()
+        self.memo = memo if memo is not None else PredictionMemo()
+        self._inflight = {}
+        self.check_interval = check_interval
+        self._next_check = 0.0
+        self._stamp = None
+        self._version = None
+        self._version_read = False
+        self.reloads = 0
+        self.batches = 0
+        self.rows = 0
+
+    def _get_model(self):
+        if self.model is None:
+            with self._model_lock:
+                if self.model is None:
+                    self.model = load_model(self.model_path, self.compiled_path, self.mmap_mode)
+                    logger.info(f"Progress model loaded: {type(self.model).__name__}")
+        return self.model
+
+    @property
+    def model_version(self):
+        # версия из models/vNNNN; у пикла — None. В режиме process модель живёт
+        # только в воркерах, поэтому версия читается из meta.json того же артефакта.
+        if self.model is not None:
+            return getattr(self.model, "meta", {}).get("model_version")
+        if not self._watch_artifact:
+            return None
+        if not self._version_read:
+            self._version = artifact_version(self.compiled_path)
+            self._version_read = True
+        return self._version
+
+    def stats(self):
+        return {"batches": self.batches, "rows": self.rows, "reloads": self.reloads, **self.memo.stats()}
+
+    def _predict(self, rows):
+        return predict_rows(self._get_model(), rows)
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self._process:
+                self._executor = ProcessPoolExecutor(
+                    self.workers, initializer=_init_worker,
+                    initargs=(self.model_path, self.compiled_path, self.mmap_mode)
+                )
+            else:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="inference")
+        return self._executor
+
+    def _check_artifact(self):
+        # stat раз в check_interval, а не на каждый запрос
+        now = time.monotonic()
+        if not self._watch_artifact or now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        stamp = artifact_stamp(self.compiled_path, self.model_path)
+        if self._stamp is None or stamp == self._stamp:
+            self._stamp = stamp
+            return
+        logger.info("Progress model artifact changed, reloading and clearing the prediction memo")
+        self._stamp = stamp
+        self.memo.clear()
+        self.reloads += 1
+        self.model = None
+        self._version_read = False
+        if self._process and self._executor is not None:
+            # начатые батчи досчитает старый пул, новые пойдут в процессы с новой моделью
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def predict(self, row):
+        start = time.perf_counter()
+        self._check_artifact()
+        row = quantize_row(row)
+        key = memo_key(row)
+        prediction = self.memo.get(key)
+        if prediction is not None:
+            elapsed = time.perf_counter() - start
+            self.memo.record_latency(True, elapsed)
+            metrics.record_phase("model", elapsed)
+            return prediction
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._predict_uncached(key, row, self.memo.generation))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        prediction = await asyncio.shield(future)
+        elapsed = time.perf_counter() - start
+        self.memo.record_latency(False, elapsed)
+        metrics.record_phase("model", elapsed)
+        return prediction
+
+    async def _predict_uncached(self, key, row, generation):
+        prediction = await self._enqueue(row)
+        self.memo.put(key, prediction, generation)
+        return prediction
+
+    async def _enqueue(self, row):
+        if self._worker is None:
+            self._wakeup = asyncio.Event()
+            self._full = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.workers)
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.append((row, future))
+        self._wakeup.set()
+        if len(self._waiting) >= self.max_batch_size:
+            self._full.set()
+        return await future
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), self.max_wait)
+            except asyncio.TimeoutError:
+                pass
+            # пока все воркеры заняты, запросы продолжают копиться в следующий батч
+            await self._slots.acquire()
+            batch = self._waiting[:self.max_batch_size]
+            self._waiting = self._waiting[self.max_batch_size:]
+            if len(self._waiting) < self.max_batch_size:
+                self._full.clear()
+            if not self._waiting:
+                self._wakeup.clear()
+            task = asyncio.create_task(self._score(batch))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+    async def _score(self, batch):
+        rows = [row for row, _ in batch]
+        loop = asyncio.get_running_loop()
+        try:
+            if self._process:
+                predictions = await loop.run_in_executor(self._get_executor(), _predict_in_worker, rows)
+            else:
+                predictions = await loop.run_in_executor(self._get_executor(), self._predict, rows)
+        except Exception as e:
+            logger.exception("Batch prediction failed")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+        self.batches += 1
+        self.rows += len(rows)
+        for (_, future), prediction in zip(batch, predictions):
+            if not future.done():
+                future.set_result(prediction)
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, *self._pending, return_exceptions=True)
+            self._worker = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
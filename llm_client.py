@@ -0,0 +1,323 @@
+import os
+import json
+import asyncio
+import time
+import random
+import hashlib
+import logging
+import itertools
+from collections import deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_API_BASE = os.getenv("LLM_API_BASE")  # напр. http://127.0.0.1:8089/v1 для fake-сервера
+# LLM_TIMEOUT — общий срок на вызов со всеми повторами; на одну попытку — LLM_ATTEMPT_TIMEOUT
+LLM_ATTEMPT_TIMEOUT = float(os.getenv("LLM_ATTEMPT_TIMEOUT", "30"))
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+# дублирующий запрос, если ответа нет дольше p95 последних ответов
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+# p95 считается, когда ответов накопилось хотя бы столько
+HEDGE_MIN_SAMPLES = 20
+
+
+class LLMUnavailable(Exception):
+    # GPT не ответил: попытки исчерпаны или предохранитель разомкнут
+    pass
+
+
+class CircuitOpen(LLMUnavailable):
+    def __init__(self, retry_after):
+        super().__init__(f"GPT circuit is open, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def is_retryable(error):
+    # сеть, таймауты, 429 и 5xx; неверный запрос или ключ повтор не исправит
+    import openai
+
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    if isinstance(error, (openai.error.Timeout, openai.error.APIConnectionError, openai.error.RateLimitError,
+                          openai.error.ServiceUnavailableError, openai.error.TryAgain)):
+        return True
+    if isinstance(error, openai.error.APIError):
+        return (error.http_status or 500) >= 500
+    try:
+        import aiohttp
+    except ImportError:
+        return False
+    return isinstance(error, aiohttp.ClientError)
+
+
+class CircuitBreaker:
+    # После failures неудачных попыток подряд размыкается на cooldown секунд:
+    # вызовы сразу получают CircuitOpen. Потом пропускает одну пробную попытку —
+    # успех замыкает цепь, неудача снова размыкает.
+
+    def __init__(self, failures=LLM_BREAKER_FAILURES, cooldown=LLM_BREAKER_COOLDOWN, registry=metrics.REGISTRY):
+        self.threshold = failures
+        self.cooldown = cooldown
+        self.registry = registry
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.opened = 0
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def retry_after(self):
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if not self.probing and time.monotonic() - self.opened_at >= self.cooldown:
+            self.probing = True
+            return True
+        return False
+
+    def record(self, ok):
+        # ok=None — попытка отменена (проигравший дубль): на состояние не влияет
+        if ok is None:
+            self.probing = False
+        elif ok:
+            if self.opened_at is not None:
+                logger.info("[LLM] circuit closed")
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+        else:
+            self.failures += 1
+            if self.probing or (self.opened_at is None and self.failures >= self.threshold):
+                if self.opened_at is None:
+                    self.opened += 1
+                    self.registry.inc("bot_llm_circuit_opened_total")
+                    logger.warning(f"[LLM] circuit opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+
+class AsyncLLMClient:
+    # Общий клиент: семафор на исходящие запросы, общий срок на вызов, повторы
+    # с экспоненциальной паузой со случайным разбросом, пока срок позволяет,
+    # дубль медленного запроса (hedge) и предохранитель. Одинаковые
+    # одновременные промпты делят один запрос.
+
+    def __init__(self, model=LLM_MODEL, max_concurrency=LLM_MAX_CONCURRENCY,
+                 timeout=LLM_TIMEOUT, api_base=LLM_API_BASE, api_key=None,
+                 attempt_timeout=LLM_ATTEMPT_TIMEOUT, retries=LLM_RETRIES, backoff_base=LLM_BACKOFF_BASE,
+                 backoff_max=LLM_BACKOFF_MAX, hedge=LLM_HEDGE, hedge_min_delay=LLM_HEDGE_MIN_DELAY,
+                 breaker=None, registry=metrics.REGISTRY):
+        self.model = model
+        self.timeout = timeout
+        self.api_base = api_base
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.max_concurrency = max_concurrency
+        self.attempt_timeout = attempt_timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.breaker = breaker or CircuitBreaker(registry=registry)
+        self.registry = registry
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._in_flight = {}
+        self._session = None
+        self._latencies = deque(maxlen=500)
+        self.coalesced = 0
+        self.retried = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def _key(self, messages):
+        raw = json.dumps([self.model, messages], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def complete(self, messages, timeout=None):
+        key = self._key(messages)
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._request(messages, timeout or self.timeout))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.coalesced += 1
+        # shield: отмена одного ожидающего не должна отменять общий запрос;
+        # ожидание записывается каждому ожидающему хендлеру
+        with metrics.phase("openai"):
+            return await asyncio.shield(task)
+
+    async def _request(self, messages, timeout):
+        deadline = asyncio.get_running_loop().time() + timeout
+        return await self._with_retries(lambda: self._hedged(messages, deadline), deadline)
+
+    async def _with_retries(self, attempt, deadline):
+        loop = asyncio.get_running_loop()
+        for number in itertools.count(1):
+            try:
+                return await attempt()
+            except LLMUnavailable:
+                raise
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                # full jitter: повторы разных хендлеров не приходят к API одной волной
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (number - 1)))
+                if number > self.retries or loop.time() + delay >= deadline:
+                    raise LLMUnavailable(f"GPT request failed after {number} attempt(s): {e!r}") from e
+                self.retried += 1
+                self.registry.inc("bot_llm_retries_total")
+                logger.warning(f"[LLM] attempt {number} failed: {e!r}; retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def _attempt(self, call, deadline, sample=False):
+        # одна попытка под предохранителем и в пределах общего срока
+        if not self.breaker.allow():
+            self.registry.inc("bot_llm_short_circuited_total")
+            raise CircuitOpen(self.breaker.retry_after())
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            result = await asyncio.wait_for(call(), min(self.attempt_timeout, deadline - start))
+        except asyncio.CancelledError:
+            self.breaker.record(None)
+            raise
+        except Exception as e:
+            # ошибки самого запроса (400, 401) значат, что API живо
+            self.breaker.record(False if is_retryable(e) else True)
+            raise
+        self.breaker.record(True)
+        if sample:
+            self._latencies.append(loop.time() - start)
+        return result
+
+    def hedge_delay(self):
+        if not self.hedge or len(self._latencies) < HEDGE_MIN_SAMPLES or self.breaker.state != "closed":
+            return None
+        ordered = sorted(self._latencies)
+        return max(self.hedge_min_delay, ordered[int(len(ordered) * 0.95)])
+
+    async def _hedged(self, messages, deadline):
+        loop = asyncio.get_running_loop()
+        first = asyncio.ensure_future(self._attempt(lambda: self._call(messages), deadline, sample=True))
+        delay = self.hedge_delay()
+        if delay is None or loop.time() + delay >= deadline:
+            return await first
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return first.result()
+            # ответа нет дольше p95 — тот же запрос второй раз, берём первый успешный
+            self.hedged += 1
+            self.registry.inc("bot_llm_hedged_total")
+            second = asyncio.ensure_future(self._attempt(lambda: self._call(messages), deadline, sample=True))
+            tasks.add(second)
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self):
+        return {"retried": self.retried, "hedged": self.hedged, "hedge_wins": self.hedge_wins,
+                "coalesced": self.coalesced, "circuit": self.breaker.state, "circuit_opened": self.breaker.opened}
+
+    async def _call(self, messages):
+        # openai и aiohttp тянут numpy/pandas-хелперы — импортируем при первом запросе
+        import aiohttp
+        import openai
+
+        async with self._semaphore:
+            self._use_session(aiohttp, openai)
+            response = await openai.ChatCompletion.acreate(
+                model=self.model,
+                messages=messages,
+                api_base=self.api_base,
+                api_key=self.api_key,
+            )
+        usage = response.get("usage")
+        if usage:
+            metrics.count_tokens(usage["prompt_tokens"], usage["completion_tokens"])
+        return response["choices"][0]["message"]["content"]
+
+    async def stream(self, messages, timeout=None):
+        # Куски ответа по мере генерации. Таймаут общий на весь ответ;
+        # одинаковые промпты здесь не объединяются — каждому нужен свой поток.
+        import aiohttp
+        import openai
+        from prompts import count_message_tokens, count_tokens
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or self.timeout)
+        # в потоковом ответе usage нет — токены считаем локально
+        completion_tokens = 0
+        start = time.perf_counter()
+        async with self._semaphore:
+            self._use_session(aiohttp, openai)
+            # повторы и предохранитель — только до начала ответа: показанный
+            # пользователю текст не переигрывается
+            response = await self._with_retries(lambda: self._attempt(lambda: openai.ChatCompletion.acreate(
+                model=self.model,
+                messages=messages,
+                api_base=self.api_base,
+                api_key=self.api_key,
+                stream=True,
+            ), deadline), deadline)
+            chunks = response.__aiter__()
+            try:
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), deadline - loop.time())
+                    except StopAsyncIteration:
+                        break
+                    finally:
+                        # в фазу openai — только ожидание кусков, не правки сообщения между ними
+                        metrics.record_phase("openai", time.perf_counter() - start)
+                    delta = chunk["choices"][0]["delta"].get("content")
+                    if delta:
+                        completion_tokens += count_tokens(delta)
+                        yield delta
+                    start = time.perf_counter()
+            finally:
+                # закрывает HTTP-ответ, если читатель бросил поток на середине
+                await chunks.aclose()
+                metrics.count_tokens(count_message_tokens(messages), completion_tokens)
+
+    def _use_session(self, aiohttp, openai):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency)
+            )
+        # без общей сессии openai<1.0 открывает новое соединение на каждый вызов
+        openai.aiosession.set(self._session)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
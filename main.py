@@ -1,103 +1,95 @@
 import os
-import json
+import time
+import asyncio
 from dotenv import load_dotenv
-import openai
 from telegram import Update
-import joblib
-import pandas as pd
 from telegram.ext import (ApplicationBuilder, CommandHandler, MessageHandler,
-                          ConversationHandler, filters, ContextTypes)
-from pymongo import MongoClient
+                          ConversationHandler, TypeHandler, filters, ContextTypes)
 import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-progress_model = joblib.load("progress_predictor_extended.pkl")
 load_dotenv()
 
+from llm_client import AsyncLLMClient, CircuitOpen, LLMUnavailable
+from plan_cache import PlanCache, PLAN_CACHE_MONGO, canonical_profile
+from plan_templates import PlanTemplates
+from storage import (UserProfileManager, TimedDatabase, create_database,
+                     PREDICT_FIELDS, PLAN_FIELDS, PLAN_REF_FIELDS)
+from metrics import METRICS_PORT, MetricsExporter, timed_request, traced_handlers
+from scheduler import SCHEDULER_ENABLED, CHEAP, EXPENSIVE, PriorityUpdateProcessor, matching_callback
+from features import build_feature_row
+from persistence import create_persistence, STATE_TTL
+from inference import BatchPredictor
+from outcome_log import OutcomeLog
+from streaming import STREAM_REPLIES, StreamingReply, reply_long
+from prompts import (plan_messages, improve_messages, plan_sections, requested_days,
+                     merge_plan, render_plan, parse_plan, changed_days)
+
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 MONGO_DB_URI = os.getenv("MONGO_DB_URI")
 
 (START, NAME, AGE, GENDER, WEIGHT, HEIGHT, FITNESS_GOAL, FITNESS_LEVEL, IMPROVE_REQUEST, EDIT_PLAN) = range(10)
 (PREDICT_SESSIONS, PREDICT_DURATION, PREDICT_SLEEP, PREDICT_DIET, PREDICT_BREAKS, PREDICT_CONSISTENCY) = range(100, 106)
+# хендлеры, которые ходят в GPT: для них лимиты и очередь планировщика
+EXPENSIVE_CALLBACKS = {"get_fitness_plan", "process_improvement"}
 
+GPT_DOWN_TEXT = "⏳ GPT is unavailable right now. Please try again in a few minutes."
+GPT_FAILED_TEXT = "❌ Couldn't get an answer from GPT. Please try again later."
+FALLBACK_PLAN_PREFIX = "GPT is unavailable right now, so here is a plan for a similar profile:\n"
 
-class UserProfileManager:
-    import logging
-    logger = logging.getLogger(__name__)
 
-    client = MongoClient(MONGO_DB_URI)
-    db = client['fitness_bot']
-    collection = db['user_profiles']
+def llm_error_text(error):
+    # текст для пользователя; в профиль и кэш он не попадает
+    return GPT_DOWN_TEXT if isinstance(error, CircuitOpen) else GPT_FAILED_TEXT
 
-    @classmethod
-    def save_user_profile(cls, user_id, profile_data):
-    # Убеждаемся, что user_id записан в профиль
-        profile_data["user_id"] = user_id
 
-        result = cls.collection.update_one(
-            {"user_id": user_id},
-            {"$set": profile_data},
-            upsert=True
-        )
+class AIAssistant:
+    def __init__(self):
+        self.api_key = OPENAI_API_KEY
+        self.llm = AsyncLLMClient(api_key=OPENAI_API_KEY)
 
-        if result.modified_count > 0 or result.upserted_id:
-            logger.info(f"[✅] Profile saved for user_id: {user_id}")
-        else:
-            logger.warning(f"[⚠️] Profile save attempted but no changes for user_id: {user_id}")
+    async def generate_fitness_plan(self, user_profile, ):
+        return await self.llm.complete(plan_messages(user_profile))
 
-    @classmethod
-    def get_user_profile(cls, user_id):
-        return cls.collection.find_one({"user_id": user_id}, {"_id": 0, "user_id": 0})
-    
-    @classmethod
-    def save_user_plan(cls, user_id, plan):
-        logger.info(f"[🔍] About to save plan:\n{plan[:100]}...") 
-        result = cls.collection.update_one(
-        {"user_id": user_id},
-        {"$set": {"last_plan": plan}},
-            upsert=False  
-        )
+    async def improve_fitness_plan(self, profile, request, days=()):
+        return await self.llm.complete(improve_messages(profile, request, days))
 
-        if result.modified_count > 0:
-            logger.info(f"[✅] Plan updated for user_id: {user_id}")
-        else:
-            logger.error(f"[❌] Plan NOT updated — user_id not found: {user_id}")
+    def stream_fitness_plan(self, user_profile):
+        return self.llm.stream(plan_messages(user_profile))
 
-    @classmethod
-    def delete_user_plan(cls, user_id):
-        cls.collection.update_one(
-            {"user_id": user_id},
-            {"$unset": {"last_plan": ""}}
-        )
+    def stream_improved_plan(self, profile, request, days=()):
+        return self.llm.stream(improve_messages(profile, request, days))
 
-
-class AIAssistant:
-    def __init__(self):
-        self.api_key = OPENAI_API_KEY
-
-    def generate_fitness_plan(self, user_profile, ):
-        prompt = (
-            f"User Profile: {json.dumps(user_profile)}\n\n"
-             "Generate a personalized workout plan based on the user's profile, fitness goal, and fitness level. for next 7 days only PLAN nothing else. and dont exceed limit  answer more than 200 words."
-        )
-        try:
-            response = openai.ChatCompletion.create(
-                model="gpt-4o",
-                messages=[{"role": "system", "content": "You are a fitness expert."},
-                          {"role": "user", "content": prompt}]
-            )
-            return response["choices"][0]["message"]["content"]
-        except Exception as e:
-            return f"Error: {str(e)}"
+    async def close(self):
+        await self.llm.close()
 
 class FitnessAssistantBot:
-    def __init__(self, telegram_token):
-        self.application = ApplicationBuilder().token(telegram_token).build()
+    def __init__(self, telegram_token, db=None, persistence=None, base_url=None, metrics_port=METRICS_PORT):
+        self.db = TimedDatabase(db if db is not None else create_database(MONGO_DB_URI))
+        self.profiles = UserProfileManager(self.db['user_profiles'], self.db['user_plans'])
         self.ai_assistant = AIAssistant()
+        self.predictor = BatchPredictor()
+        self.outcomes = OutcomeLog()
+        self.plan_cache = PlanCache(collection=self.db['plan_cache'] if PLAN_CACHE_MONGO else None)
+        self.templates = PlanTemplates()
+        self.persistence = persistence
+        self.streaming = STREAM_REPLIES
+        self.metrics = MetricsExporter(port=metrics_port)
+        # запросы к Bot API — через HTTPXRequest с замером фазы "telegram"
+        builder = (ApplicationBuilder().token(telegram_token).request(timed_request(connection_pool_size=256))
+                   .post_init(self.startup).post_shutdown(self.shutdown))
+        if persistence is not None:
+            builder = builder.persistence(persistence)
+        if SCHEDULER_ENABLED:
+            builder = builder.concurrent_updates(PriorityUpdateProcessor(self.update_priority))
+        if base_url:
+            builder = builder.base_url(base_url)
+        self.application = builder.build()
         self.setup_handlers()
 
+    @traced_handlers
     def setup_handlers(self):
         conv_handler = ConversationHandler(
             entry_points=[CommandHandler('start', self.start_profile_creation)],
@@ -109,8 +101,12 @@ class FitnessAssistantBot:
             HEIGHT: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.collect_height)],
             FITNESS_GOAL: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.collect_fitness_goal)],
             FITNESS_LEVEL: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.collect_fitness_level)],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, self.conversation_timeout)],
             },
-            fallbacks=[CommandHandler('cancel', self.cancel_profile_creation)]
+            fallbacks=[CommandHandler('cancel', self.cancel_profile_creation)],
+            name="profile",
+            persistent=self.persistence is not None,
+            conversation_timeout=STATE_TTL
             )
 
         predict_conv = ConversationHandler(
@@ -122,16 +118,24 @@ class FitnessAssistantBot:
             PREDICT_DIET: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.get_diet)],
             PREDICT_BREAKS: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.get_breaks)],
             PREDICT_CONSISTENCY: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.get_consistency)],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, self.conversation_timeout)],
             },
-            fallbacks=[CommandHandler("cancel", self.cancel_profile_creation)]
+            fallbacks=[CommandHandler("cancel", self.cancel_profile_creation)],
+            name="predict",
+            persistent=self.persistence is not None,
+            conversation_timeout=STATE_TTL
         )
 
         improve_conv = ConversationHandler(
             entry_points=[CommandHandler("improve", self.improve_plan)],
             states={
-                IMPROVE_REQUEST: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.process_improvement)]
+                IMPROVE_REQUEST: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.process_improvement)],
+                ConversationHandler.TIMEOUT: [TypeHandler(Update, self.conversation_timeout)],
             },
-            fallbacks=[CommandHandler("cancel", self.cancel_profile_creation)]
+            fallbacks=[CommandHandler("cancel", self.cancel_profile_creation)],
+            name="improve",
+            persistent=self.persistence is not None,
+            conversation_timeout=STATE_TTL
         )
 
         self.application.add_handler(predict_conv)
@@ -140,10 +144,29 @@ class FitnessAssistantBot:
         self.application.add_handler(CommandHandler('profile', self.show_profile))
         self.application.add_handler(CommandHandler('plan', self.get_fitness_plan))
         self.application.add_handler(CommandHandler('deleteplan', self.delete_plan))
+        self.application.add_handler(CommandHandler('outcome', self.record_outcome))
         self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.unknown_message))
 
 
         
+    def update_priority(self, update):
+        callback = matching_callback(self.application, update)
+        if callback == "get_fitness_plan" and not self.plan_needs_gpt(update.effective_user.id):
+            return CHEAP
+        return EXPENSIVE if callback in EXPENSIVE_CALLBACKS else CHEAP
+
+    def plan_needs_gpt(self, user_id):
+        # Без I/O: ответят ли /plan шаблон, кэш планов или "план уже есть".
+        # Профиля нет в кэше — не знаем, считаем, что GPT нужен.
+        if self.templates.complete:
+            return False
+        profile = self.profiles.cached_profile(user_id, PLAN_FIELDS)
+        if profile is None:
+            return True
+        if profile.plan_id is not None:
+            return False
+        return not (self.templates.covers(profile) or self.plan_cache.contains(profile))
+
     async def unknown_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❗ I didn't understand that. Please use commands like /start or /plan.")
 
@@ -159,11 +182,15 @@ class FitnessAssistantBot:
         return AGE
 
     async def handle_ai_query(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user_profile = UserProfileManager.get_user_profile(update.effective_user.id)
+        user_profile = await self.profiles.get_user_profile(update.effective_user.id, PREDICT_FIELDS)
         if not user_profile:
             await update.message.reply_text("Create a profile first using /start.")
             return
-        response = self.ai_assistant.generate_fitness_plan(user_profile)
+        try:
+            response = await self.ai_assistant.generate_fitness_plan(user_profile)
+        except Exception as e:
+            logger.warning(f"[GPT] {e!r}")
+            response = llm_error_text(e)
         await update.message.reply_text(response)
 
     async def collect_age(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -179,15 +206,15 @@ class FitnessAssistantBot:
         return AGE
 
     async def show_profile(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        profile = UserProfileManager.get_user_profile(update.effective_user.id)
+        profile = await self.profiles.get_user_profile(update.effective_user.id)
         if profile:
             profile_text = "\n".join(
-                f"{k.title().replace('_', ' ')}: {v}" for k, v in profile.items() if k != "last_plan"
+                f"{k.title().replace('_', ' ')}: {v}" for k, v in profile.items() if k != "plan_id"
             )
-            plan = profile.get("last_plan")
+            plan = await self.profiles.get_user_plan(profile.plan_id)
             if plan:
-                profile_text += f"\n\n📋 Your Plan:\n{plan}"
-            await update.message.reply_text(f"Your Profile:\n{profile_text}")
+                profile_text += f"\n\n📋 Your Plan:\n{plan['plan']}"
+            await reply_long(update.message, f"Your Profile:\n{profile_text}")
         else:
             await update.message.reply_text("No profile found. Use /start to create one.")
 
@@ -228,9 +255,9 @@ class FitnessAssistantBot:
         level = update.message.text.lower()
         if level in ["beginner", "intermediate", "advanced"]:
             context.user_data["fitness_level"] = level
-            UserProfileManager.save_user_profile(update.effective_user.id, context.user_data)
+            await self.profiles.save_user_profile(update.effective_user.id, context.user_data)
             await update.message.reply_text(" Profile saved! Use /plan to get your personalized plan.")
-            return ConversationHandler.END
+            return self.end_conversation(update, context)
         await update.message.reply_text("Please choose: Beginner, Intermediate or Advanced.")
         return FITNESS_LEVEL
 
@@ -245,23 +272,70 @@ class FitnessAssistantBot:
         return FITNESS_GOAL
 
     async def get_fitness_plan(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        profile = UserProfileManager.get_user_profile(update.effective_user.id)
+        profile = await self.profiles.get_user_profile(update.effective_user.id, PLAN_FIELDS)
         if not profile:
             await update.message.reply_text("No profile found. Use /start to create one.")
             return
-        if "last_plan" in profile:
+        if profile.plan_id is not None:
             await update.message.reply_text(
                 "You already have a fitness plan.\nUse /improve to enhance it or /deleteplan to start over."
             )
             return
-        plan = self.ai_assistant.generate_fitness_plan(profile)
-        UserProfileManager.save_user_plan(update.effective_user.id, plan)
-        await update.message.reply_text(f"Your Fitness Plan:\n{plan}")
+        # готовый шаблон корзины, дополненный цифрами пользователя; GPT — только если шаблона нет
+        plan = self.templates.get(profile)
+        if plan is None:
+            plan = await self.plan_cache.get(profile)
+        if plan is not None:
+            await reply_long(update.message, f"Your Fitness Plan:\n{plan}")
+        else:
+            # при включённом кэше план генерируется по корзине профиля, чтобы подходить всем в ней
+            plan_profile = canonical_profile(profile) if self.plan_cache.enabled else profile
+            if self.streaming:
+                plan = await self.stream_reply(update, "Your Fitness Plan:\n",
+                                               self.ai_assistant.stream_fitness_plan(plan_profile))
+            else:
+                try:
+                    plan = await self.ai_assistant.generate_fitness_plan(plan_profile)
+                    if not plan.strip():
+                        raise LLMUnavailable("empty reply")
+                except Exception as e:
+                    logger.warning(f"[GPT] {e!r}")
+                    await update.message.reply_text(llm_error_text(e))
+                    plan = None
+                else:
+                    await reply_long(update.message, f"Your Fitness Plan:\n{plan}")
+            if plan is None:
+                # GPT недоступен: устаревший план той же корзины лучше, чем ничего
+                plan = self.plan_cache.get_stale(profile)
+                if plan is None:
+                    return
+                await reply_long(update.message, FALLBACK_PLAN_PREFIX + plan)
+            else:
+                await self.plan_cache.put(profile, plan)
+        logger.debug(f"[plan cache] {self.plan_cache.stats()}")
+        await self.profiles.save_user_plan(update.effective_user.id, plan, parse_plan(plan))
+
+    async def stream_reply(self, update: Update, prefix, chunks):
+        # ответ GPT правится в одном сообщении по мере генерации; None — генерация не удалась
+        reply = await StreamingReply(update.message, prefix=prefix).start()
+        try:
+            async for delta in chunks:
+                await reply.feed(delta)
+        except Exception as e:
+            logger.warning(f"[GPT stream] {e!r}")
+            await reply.fail(llm_error_text(e))
+            return None
+        if not reply.text.strip():
+            # пустой ответ — тоже неудача: ни в кэш, ни в профиль
+            logger.warning("[GPT stream] empty reply")
+            await reply.fail(GPT_FAILED_TEXT)
+            return None
+        return await reply.finish()
 
 
     async def improve_plan(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        profile = UserProfileManager.get_user_profile(update.effective_user.id)
-        if not profile or "last_plan" not in profile:
+        profile = await self.profiles.get_user_profile(update.effective_user.id, PLAN_REF_FIELDS)
+        if not profile or profile.plan_id is None:
             await update.message.reply_text("You don't have a saved plan. Use /plan first.")
             return ConversationHandler.END
         await update.message.reply_text("How would you like to improve your current plan? (e.g., make it easier, add more cardio)")
@@ -269,52 +343,61 @@ class FitnessAssistantBot:
 
     async def process_improvement(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
-            profile = UserProfileManager.get_user_profile(update.effective_user.id)
+            user_profile = await self.profiles.get_user_profile(update.effective_user.id, PLAN_FIELDS)
+            plan = await self.profiles.get_user_plan(user_profile.plan_id if user_profile else None)
+            if plan is None:
+                await update.message.reply_text("You don't have a saved plan. Use /plan first.")
+                return ConversationHandler.END
+            profile = {**user_profile.as_dict(PREDICT_FIELDS), "last_plan": plan["plan"],
+                       "plan_days": plan.get("plan_days")}
             request = update.message.text
-            prompt = (
-            f"User profile: {json.dumps(profile)}\n\n"
-            f"Current plan: {profile.get('last_plan', '')}\n\n"
-            f"User wants to improve the plan as follows: {request}\n\n"
-            "Please provide an improved version of the plan only. Keep it under 200 words."
-            )
-
-            response = openai.ChatCompletion.create(
-                model="gpt-4o",
-                messages=[
-                 {"role": "system", "content": "You are a fitness expert."},
-                    {"role": "user", "content": prompt}
-                ]
-            )
-           
-
-            improved_plan = response["choices"][0]["message"]["content"]
-            
-            UserProfileManager.save_user_plan(update.effective_user.id, improved_plan)
-            logger.info(f"[DEBUG] Plan updated for user {update.effective_user.id}")
-            logger.debug(f"[GPT response]: {response}")
-            await update.message.reply_text(f"✅ Updated Plan:\n{improved_plan}")
-
+            # названы конкретные дни — переписываем только их, остальной план не трогаем
+            sections = plan_sections(profile)
+            days = requested_days(request, sections)
+            prefix = f"✅ Updated {', '.join(f'Day {day}' for day in days)}:\n" if days else "✅ Updated Plan:\n"
+            if self.streaming:
+                reply = await self.stream_reply(update, prefix,
+                                                self.ai_assistant.stream_improved_plan(profile, request, days))
+                if reply is None:
+                    return ConversationHandler.END
+            else:
+                reply = await self.ai_assistant.improve_fitness_plan(profile, request, days)
+                if not reply.strip():
+                    raise LLMUnavailable("empty reply")
+                await reply_long(update.message, prefix + reply)
+
+            new_sections = merge_plan(sections, reply, days)
+            improved_plan = render_plan(new_sections)
+            await self.profiles.save_user_plan(update.effective_user.id, improved_plan, new_sections)
+            logger.info(f"[DEBUG] Plan updated for user {update.effective_user.id}, "
+                        f"changed days: {changed_days(sections, new_sections)}")
+            logger.debug(f"[GPT response]: {reply}")
+
+        except LLMUnavailable as e:
+            logger.warning(f"[GPT] {e!r}")
+            await update.message.reply_text(llm_error_text(e))
         except Exception as e:
-            print(f"[ERROR] GPT or DB issue: {str(e)}")
+            logger.exception(f"[ERROR] GPT or DB issue: {str(e)}")
             await update.message.reply_text(f"Error improving plan: {str(e)}")
         return ConversationHandler.END
 
     
 
     async def delete_plan(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        profile = UserProfileManager.get_user_profile(update.effective_user.id)
-        if not profile or "last_plan" not in profile:
+        profile = await self.profiles.get_user_profile(update.effective_user.id, PLAN_REF_FIELDS)
+        if not profile or profile.plan_id is None:
             await update.message.reply_text("No saved plan found.")
             return
-        UserProfileManager.delete_user_plan(update.effective_user.id)
+        await self.profiles.delete_user_plan(update.effective_user.id)
         await update.message.reply_text("✅ Your fitness plan has been deleted. Use /plan to create a new one.")
 
     async def predict_entry(self, update, context):
-        profile = UserProfileManager.get_user_profile(update.effective_user.id)
+        profile = await self.profiles.get_user_profile(update.effective_user.id, PREDICT_FIELDS)
         if not profile:
             await update.message.reply_text("You need a profile first. Use /start.")
             return ConversationHandler.END
-        context.user_data["predict_profile"] = profile
+        # в user_data (и в persistence) — только поля для признаков модели
+        context.user_data["predict_profile"] = profile.as_dict(PREDICT_FIELDS)
         await update.message.reply_text("How many sessions per week do you plan?")
         return PREDICT_SESSIONS
     
@@ -347,27 +430,28 @@ class FitnessAssistantBot:
         context.user_data["consistency_percent"] = float(update.message.text)
 
     # Сбор профиля
-        p = context.user_data["predict_profile"]
-        x = pd.DataFrame([{
-            "age": p["age"],
-            "weight_start": p["weight"],
-            "height": p["height"],
-            "gender": p["gender"],
-            "goal": p["fitness_goal"].strip().lower().replace(" ", "_"),
-            "level": p["fitness_level"],
-            "sessions_per_week": context.user_data["sessions_per_week"],
-            "session_duration_minutes": context.user_data["session_duration_minutes"],
-            "sleep_hours": context.user_data["sleep_hours"],
-            "diet_followed": context.user_data["diet_followed"],
-            "restrictions_or_breaks": context.user_data["restrictions_or_breaks"],
-            "consistency_percent": context.user_data["consistency_percent"]
-        }])
-        print("INPUT TO MODEL:", x.to_dict(orient="records")[0])
-        prediction = progress_model.predict(x)[0]
+        x = build_feature_row(context.user_data["predict_profile"], context.user_data)
+        prediction = await self.predictor.predict(x)
+        logger.debug(f"[prediction memo] {self.predictor.stats()}")
+        # вход и выход модели — в журнал исходов, из него потом собирается датасет
+        self.outcomes.log_prediction(update.effective_user.id, x, prediction, self.predictor.model_version)
         weeks, kg = round(prediction[0], 1), round(prediction[1], 1)
 
         await update.message.reply_text(f"📊 Predicted time to goal: {weeks} weeks\n⚖️ Expected weight change: {kg} kg")
-        return ConversationHandler.END
+        return self.end_conversation(update, context)
+
+    async def record_outcome(self, update, context):
+        # /outcome <weeks> <kg>: фактический результат после /predict
+        try:
+            weeks, kg = float(context.args[0]), float(context.args[1])
+        except (IndexError, ValueError):
+            await update.message.reply_text("Usage: /outcome <weeks it took> <kg change>, e.g. /outcome 10 -4.5")
+            return
+        if not 0 < weeks <= 260 or not -100 <= kg <= 100:
+            await update.message.reply_text("Enter weeks between 0 and 260 and a kg change between -100 and 100.")
+            return
+        self.outcomes.log_outcome(update.effective_user.id, weeks, kg)
+        await update.message.reply_text("✅ Thanks! Your result will help improve future predictions.")
 
 
 
@@ -377,14 +461,77 @@ class FitnessAssistantBot:
 
 
     async def finish_profile_creation(self, update: Update, context: ContextTypes.DEFAULT_TYPE):        
-        UserProfileManager.save_user_profile(update.effective_user.id, context.user_data)
+        await self.profiles.save_user_profile(update.effective_user.id, context.user_data)
         await update.message.reply_text("Profile saved! Use /plan to get a personalized fitness plan.")
-        return ConversationHandler.END
+        return self.end_conversation(update, context)
 
     async def cancel_profile_creation(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Canceled conversation and profile creation.")
+        return self.end_conversation(update, context)
+
+    async def conversation_timeout(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # диалог простоял дольше STATE_TTL — освобождаем его данные
+        self.end_conversation(update, context)
+
+    def end_conversation(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # user_data нужен только на время диалога: профиль уже в Mongo
+        context.application.drop_user_data(update.effective_user.id)
         return ConversationHandler.END
 
+    async def startup(self, application):
+        await self.metrics.start()
+        await asyncio.to_thread(self.templates.load)
+        await self.profiles.ensure_indexes()
+        await self.profiles.migrate_embedded_plans()
+        if self.persistence is not None:
+            await self.persistence.ensure_indexes()
+            self.expire_restored_conversations(application)
+
+    def expire_restored_conversations(self, application):
+        # Таймеры conversation_timeout живут только в памяти: у диалогов, поднятых
+        # из persistence после рестарта, их нет. Ставим таймер на остаток ttl от
+        # updated_at; user_data без незавершённого диалога не нужен — удаляем сразу.
+        restored, self.persistence.restored = self.persistence.restored, {}
+        if application.job_queue is None:
+            return
+        handlers = {handler.name: handler for group in application.handlers.values() for handler in group
+                    if isinstance(handler, ConversationHandler) and handler.persistent}
+        now = time.time()
+        users = set()
+        for (name, key), updated_at in restored.items():
+            handler = handlers.get(name)
+            if handler is None:
+                continue
+            users.add(key[-1])
+            application.job_queue.run_once(self.expire_restored, max(0.0, updated_at + self.persistence.ttl - now),
+                                           data=(handler, key), name=f"expire-{name}-{key}")
+        for user_id in [user_id for user_id in application.user_data if user_id not in users]:
+            application.drop_user_data(user_id)
+        if restored:
+            logger.info(f"Restored {len(restored)} conversations, expiring them after {self.persistence.ttl:.0f}s idle")
+
+    async def expire_restored(self, context: ContextTypes.DEFAULT_TYPE):
+        handler, key = context.job.data
+        # пользователь написал после рестарта — таймаут уже ведёт сам ConversationHandler
+        if key in handler.timeout_jobs:
+            return
+        # тот же путь, которым PTB завершает диалоги при загрузке из persistence
+        handler._update_state(handler.END, key)
+        # user_data общий для всех диалогов: не трогаем, пока идёт другой
+        active = any(key in other.timeout_jobs for group in context.application.handlers.values()
+                     for other in group if isinstance(other, ConversationHandler))
+        if not active:
+            context.application.drop_user_data(key[-1])
+
+    async def shutdown(self, application):
+        await self.ai_assistant.close()
+        await self.predictor.close()
+        logger.info(f"[prediction memo] {self.predictor.stats()}")
+        logger.info(f"[plan templates] {self.templates.stats()}")
+        logger.info(f"[LLM] {self.ai_assistant.llm.stats()}")
+        await self.outcomes.close()
+        await self.metrics.close()
+
     def run(self):
         self.application.run_polling()
 
@@ -393,6 +540,7 @@ class FitnessAssistantBot:
 
 if __name__ == '__main__':
     telegram_token = os.getenv("TELEGRAM_API_TOKEN")
-    print("Fitness Assistant Bot") 
-    FitnessAssistantBot(telegram_token).run()
+    logger.info("Fitness Assistant Bot")
+    db = create_database(MONGO_DB_URI)
+    FitnessAssistantBot(telegram_token, db=db, persistence=create_persistence(db)).run()
     
@@ -0,0 +1,315 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import functools
+import contextvars
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 — без HTTP-экспортера
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_JSON_PATH = os.getenv("METRICS_JSON_PATH", "")  # "{pid}" в пути заменяется на pid процесса
+METRICS_JSON_INTERVAL = float(os.getenv("METRICS_JSON_INTERVAL", "60"))
+
+# верхние границы корзин гистограмм, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# время хендлера вне этих фаз записывается как "app" (свой код, парсинг, очередь событий)
+PHASES = ("mongo", "openai", "model", "telegram")
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # верхняя граница корзины, в которую попал квантиль
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Registry:
+    # Счётчики, гейджи и гистограммы в словарях по (имя, метки). Всё в одном
+    # потоке event loop, поэтому без блокировок; метки — кортеж пар.
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def add_gauge(self, name, labels=(), value=1):
+        key = (name, labels)
+        self.gauges[key] = self.gauges.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def clear(self):
+        self.counters.clear()
+        self.gauges.clear()
+        self.histograms.clear()
+
+    def prometheus(self):
+        lines = []
+        for kind, metrics in (("counter", self.counters), ("gauge", self.gauges)):
+            for name in sorted({name for name, _ in metrics}):
+                lines.append(f"# TYPE {name} {kind}")
+                for (metric, labels), value in sorted(metrics.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_labels(labels)} {value}")
+        for name in sorted({name for name, _ in self.histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        def key(name, labels):
+            return name + _labels(labels)
+
+        return {
+            "time": time.time(),
+            "counters": {key(*k): v for k, v in self.counters.items()},
+            "gauges": {key(*k): v for k, v in self.gauges.items()},
+            "histograms": {
+                key(*k): {"count": h.count, "sum": round(h.sum, 6), "p50": h.quantile(0.5), "p99": h.quantile(0.99)}
+                for k, h in self.histograms.items()
+            },
+        }
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+REGISTRY = Registry()
+
+
+class Span:
+    # время одного вызова хендлера по фазам
+    __slots__ = ("handler", "phases")
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.phases = dict.fromkeys(PHASES, 0.0)
+
+
+_span = contextvars.ContextVar("metrics_span", default=None)
+
+
+def current_command():
+    span = _span.get()
+    return span.handler if span is not None else "background"
+
+
+def record_phase(name, seconds):
+    # время ожидания внешней системы — в текущий хендлер; вне хендлера (фоновые
+    # сбросы, прогрев) — сразу в гистограмму с handler="background"
+    if not METRICS_ENABLED:
+        return
+    span = _span.get()
+    if span is not None:
+        span.phases[name] = span.phases.get(name, 0.0) + seconds
+    else:
+        REGISTRY.observe("bot_phase_seconds", (("handler", "background"), ("phase", name)), seconds)
+
+
+class phase:
+    # with phase("mongo"): ... / async with phase("openai"): ...
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record_phase(self.name, time.perf_counter() - self.start)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc):
+        return self.__exit__(*exc)
+
+
+def count_tokens(prompt_tokens, completion_tokens):
+    if not METRICS_ENABLED:
+        return
+    command = current_command()
+    REGISTRY.inc("bot_llm_tokens_total", (("command", command), ("kind", "prompt")), prompt_tokens)
+    REGISTRY.inc("bot_llm_tokens_total", (("command", command), ("kind", "completion")), completion_tokens)
+
+
+def trace_handler(callback, name=None, registry=REGISTRY):
+    # Обёртка колбэка PTB: гистограмма полного времени и времени по фазам,
+    # счётчик вызовов по исходу и число хендлеров в работе.
+    name = name or callback.__name__
+    handler_labels = (("handler", name),)
+    phase_labels = {phase_name: (("handler", name), ("phase", phase_name)) for phase_name in PHASES + ("app",)}
+
+    @functools.wraps(callback)
+    async def traced(update, context):
+        span = Span(name)
+        token = _span.set(span)
+        registry.add_gauge("bot_handlers_in_flight", handler_labels, 1)
+        start = time.perf_counter()
+        status = "error"
+        try:
+            result = await callback(update, context)
+            status = "ok"
+            return result
+        finally:
+            elapsed = time.perf_counter() - start
+            _span.reset(token)
+            registry.add_gauge("bot_handlers_in_flight", handler_labels, -1)
+            registry.inc("bot_handler_calls_total", handler_labels + (("status", status),))
+            registry.observe("bot_handler_seconds", handler_labels, elapsed)
+            waited = 0.0
+            for phase_name, seconds in span.phases.items():
+                if seconds:
+                    waited += seconds
+                    registry.observe("bot_phase_seconds", phase_labels.get(phase_name) or
+                                     (("handler", name), ("phase", phase_name)), seconds)
+            registry.observe("bot_phase_seconds", phase_labels["app"], max(0.0, elapsed - waited))
+
+    return traced
+
+
+def _instrument(handler):
+    # ConversationHandler — контейнер: оборачиваем вложенные хендлеры
+    for attr in ("entry_points", "fallbacks"):
+        for child in getattr(handler, attr, None) or ():
+            _instrument(child)
+    for children in (getattr(handler, "states", None) or {}).values():
+        for child in children:
+            _instrument(child)
+    callback = getattr(handler, "callback", None)
+    if callback is not None and not hasattr(callback, "__wrapped__"):
+        handler.callback = trace_handler(callback)
+
+
+def traced_handlers(setup_handlers):
+    # Декоратор над FitnessAssistantBot.setup_handlers: после регистрации
+    # каждый колбэк приложения оборачивается trace_handler
+    @functools.wraps(setup_handlers)
+    def setup(self, *args, **kwargs):
+        result = setup_handlers(self, *args, **kwargs)
+        if METRICS_ENABLED:
+            for handlers in self.application.handlers.values():
+                for handler in handlers:
+                    _instrument(handler)
+        return result
+
+    return setup
+
+
+_request_class = None
+
+
+def timed_request(**kwargs):
+    # HTTPXRequest, у которого каждый вызов Bot API — фаза "telegram"
+    global _request_class
+    if _request_class is None:
+        from telegram.request import HTTPXRequest
+
+        class TimedRequest(HTTPXRequest):
+            async def do_request(self, *args, **kw):
+                with phase("telegram"):
+                    return await super().do_request(*args, **kw)
+
+        _request_class = TimedRequest
+    return _request_class(**kwargs)
+
+
+class MetricsExporter:
+    # /metrics в формате Prometheus (aiohttp) и/или периодический JSON-дамп
+
+    def __init__(self, registry=REGISTRY, host=METRICS_HOST, port=METRICS_PORT, json_path=METRICS_JSON_PATH,
+                 json_interval=METRICS_JSON_INTERVAL):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.json_path = json_path.replace("{pid}", str(os.getpid())) if json_path else ""
+        self.json_interval = json_interval
+        self._runner = None
+        self._dumper = None
+
+    async def start(self):
+        if self.port:
+            from aiohttp import web
+
+            async def handle(request):
+                return web.Response(text=self.registry.prometheus(), content_type="text/plain", charset="utf-8")
+
+            app = web.Application()
+            app.router.add_get("/metrics", handle)
+            self._runner = web.AppRunner(app, access_log=None)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, self.host, self.port).start()
+            logger.info(f"Metrics on http://{self.host}:{self.port}/metrics")
+        if self.json_path:
+            self._dumper = asyncio.create_task(self._dump_forever())
+        return self
+
+    def dump(self):
+        # через временный файл: читатель не увидит половину JSON
+        tmp = f"{self.json_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.registry.snapshot(), f)
+        os.replace(tmp, self.json_path)
+
+    async def _dump_forever(self):
+        while True:
+            await asyncio.sleep(self.json_interval)
+            try:
+                self.dump()
+            except OSError as e:
+                logger.warning(f"Metrics dump failed: {e}")
+
+    async def close(self):
+        if self._dumper is not None:
+            self._dumper.cancel()
+            await asyncio.gather(self._dumper, return_exceptions=True)
+            self._dumper = None
+            self.dump()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,236 @@
+import os
+import glob
+import time
+import asyncio
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from features import FEATURE_COLUMNS, TARGET_COLUMNS, gender_label, height_m
+
+logger = logging.getLogger(__name__)
+
+OUTCOME_LOG_ENABLED = os.getenv("OUTCOME_LOG_ENABLED", "1") == "1"
+OUTCOME_LOG_DIR = os.getenv("OUTCOME_LOG_DIR", "outcome_log")
+OUTCOME_LOG_FLUSH_ROWS = int(os.getenv("OUTCOME_LOG_FLUSH_ROWS", "1000"))
+OUTCOME_LOG_FLUSH_MS = float(os.getenv("OUTCOME_LOG_FLUSH_MS", "1000"))
+OUTCOME_LOG_ROTATE_ROWS = int(os.getenv("OUTCOME_LOG_ROTATE_ROWS", "100000"))
+OUTCOME_LOG_ROTATE_SECONDS = float(os.getenv("OUTCOME_LOG_ROTATE_SECONDS", "3600"))
+
+# Колонки лога: событие, признаки строки /predict, предсказание и фактический исход.
+# У "prediction" пусты actual_*, у "outcome" — признаки и predicted_*.
+PREDICTION_COLUMNS = ["predicted_weeks_to_goal", "predicted_kg_change"]
+ACTUAL_COLUMNS = ["actual_weeks_to_goal", "actual_kg_change"]
+LOG_COLUMNS = ["kind", "ts", "user_id", "model_version", *FEATURE_COLUMNS, *PREDICTION_COLUMNS, *ACTUAL_COLUMNS]
+STRING_COLUMNS = {"kind", "model_version", "gender", "goal", "level"}
+BOOL_COLUMNS = {"diet_followed", "restrictions_or_breaks"}
+
+
+def log_schema():
+    import pyarrow as pa
+
+    def column_type(name):
+        if name in STRING_COLUMNS:
+            return pa.string()
+        if name in BOOL_COLUMNS:
+            return pa.bool_()
+        if name == "user_id":
+            return pa.int64()
+        if name == "ts":
+            return pa.timestamp("ms", tz="UTC")
+        return pa.float64()
+
+    return pa.schema([(name, column_type(name)) for name in LOG_COLUMNS])
+
+
+class OutcomeLog:
+    # Журнал только на дозапись. Хендлер кладёт событие в колоночный буфер в памяти
+    # (без ввода-вывода), буфер уходит одной пачкой раз в flush_ms или после
+    # flush_rows событий в единственный поток-писатель. Файлы — Arrow IPC stream:
+    # каждая пачка дописывается record batch'ем, файл читаем и без закрытия.
+    # Новый файл — после rotate_rows строк или rotate_seconds.
+
+    def __init__(self, directory=OUTCOME_LOG_DIR, flush_rows=OUTCOME_LOG_FLUSH_ROWS,
+                 flush_ms=OUTCOME_LOG_FLUSH_MS, rotate_rows=OUTCOME_LOG_ROTATE_ROWS,
+                 rotate_seconds=OUTCOME_LOG_ROTATE_SECONDS, enabled=OUTCOME_LOG_ENABLED):
+        self.directory = directory
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_ms / 1000
+        self.rotate_rows = rotate_rows
+        self.rotate_seconds = rotate_seconds
+        self.enabled = enabled
+        self._columns = {name: [] for name in LOG_COLUMNS}
+        self._size = 0
+        self._flush_timer = None
+        self._executor = None
+        self._futures = set()
+        # состояние писателя трогает только его поток
+        self._writer = None
+        self._segment_rows = 0
+        self._segment_started = 0.0
+        self._sequence = 0
+        self.events = 0
+        self.rows_written = 0
+        self.segments = 0
+        self.dropped = 0
+
+    def log_prediction(self, user_id, row, prediction, model_version=None):
+        self._append({"kind": "prediction", "user_id": user_id, "model_version": model_version, **row,
+                      "predicted_weeks_to_goal": prediction[0], "predicted_kg_change": prediction[1]})
+
+    def log_outcome(self, user_id, weeks_to_goal, kg_change):
+        self._append({"kind": "outcome", "user_id": user_id,
+                      "actual_weeks_to_goal": weeks_to_goal, "actual_kg_change": kg_change})
+
+    def _append(self, event):
+        if not self.enabled:
+            return
+        event["ts"] = int(time.time() * 1000)
+        for name, values in self._columns.items():
+            values.append(event.get(name))
+        self._size += 1
+        self.events += 1
+        if self._size >= self.flush_rows:
+            self.flush()
+        elif self._flush_timer is None:
+            self._flush_timer = asyncio.get_running_loop().call_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        # не блокирует: пачка передаётся писателю, запись идёт в его потоке
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if not self._size:
+            return
+        columns, self._columns = self._columns, {name: [] for name in LOG_COLUMNS}
+        self._size = 0
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(1, thread_name_prefix="outcome-log")
+        future = self._executor.submit(self._write, columns)
+        self._futures.add(future)
+        future.add_done_callback(self._written)
+
+    def _written(self, future):
+        self._futures.discard(future)
+        if future.exception() is not None:
+            logger.error("Outcome log write failed", exc_info=future.exception())
+
+    def _write(self, columns):
+        try:
+            import pyarrow as pa
+        except ImportError:
+            self.dropped += len(columns["kind"])
+            logger.error("pyarrow is not installed, outcome events are dropped")
+            return
+        schema = log_schema()
+        batch = pa.RecordBatch.from_arrays(
+            [pa.array(columns[field.name], type=field.type) for field in schema], schema=schema
+        )
+        if self._writer is not None and (self._segment_rows >= self.rotate_rows or
+                                         time.monotonic() - self._segment_started >= self.rotate_seconds):
+            self._close_segment()
+        if self._writer is None:
+            self._open_segment(pa, schema)
+        self._writer.write_batch(batch)
+        self._sink.flush()
+        self._segment_rows += batch.num_rows
+        self.rows_written += batch.num_rows
+
+    def _open_segment(self, pa, schema):
+        os.makedirs(self.directory, exist_ok=True)
+        self._sequence += 1
+        # pid в имени: у каждого воркера webhook свои файлы
+        name = f"events-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{self._sequence:04d}.arrows"
+        self._sink = pa.OSFile(os.path.join(self.directory, name), "wb")
+        # zstd по колонкам: повторяющиеся признаки и версии модели жмутся в разы
+        self._writer = pa.ipc.new_stream(self._sink, schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
+        self._segment_rows = 0
+        self._segment_started = time.monotonic()
+        self.segments += 1
+
+    def _close_segment(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._sink.close()
+        self._writer = None
+
+    async def close(self):
+        self.flush()
+        if self._executor is not None:
+            self._executor.submit(self._close_segment)
+            await asyncio.to_thread(self._executor.shutdown, True)
+            self._executor = None
+
+
+def read_log(directory=OUTCOME_LOG_DIR):
+    # Все сегменты в один DataFrame. Хвост сегмента, оборванный при падении
+    # процесса, отбрасывается, прочитанные до него пачки остаются.
+    import pyarrow as pa
+    import pyarrow.ipc
+
+    batches = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.arrows"))):
+        with pa.OSFile(path, "rb") as source:
+            try:
+                reader = pa.ipc.open_stream(source)
+            except pa.ArrowInvalid:
+                continue
+            while True:
+                try:
+                    batches.append(reader.read_next_batch())
+                except StopIteration:
+                    break
+                except (pa.ArrowInvalid, OSError):
+                    logger.warning(f"Truncated outcome log segment {path}")
+                    break
+    if not batches:
+        return log_schema().empty_table().to_pandas()
+    return pa.Table.from_batches(batches, schema=log_schema()).to_pandas()
+
+
+def outcome_rows(events):
+    # Фактический исход -> строка датасета: признаки берём из последнего
+    # предсказания того же пользователя до исхода.
+    import pandas as pd
+
+    predictions = events[events["kind"] == "prediction"].sort_values("ts")
+    outcomes = events[events["kind"] == "outcome"].sort_values("ts")
+    if predictions.empty or outcomes.empty:
+        return pd.DataFrame(columns=FEATURE_COLUMNS + TARGET_COLUMNS)
+    joined = pd.merge_asof(
+        outcomes[["ts", "user_id", *ACTUAL_COLUMNS]], predictions[["ts", "user_id", *FEATURE_COLUMNS]],
+        on="ts", by="user_id", direction="backward",
+    ).dropna(subset=FEATURE_COLUMNS)
+    joined = joined.rename(columns=dict(zip(ACTUAL_COLUMNS, TARGET_COLUMNS)))
+    # старые записи могли попасть в лог с ростом в см и полом в нижнем регистре
+    joined["height"] = joined["height"].map(height_m)
+    joined["gender"] = joined["gender"].map(gender_label)
+    # один пользователь — одна строка: последний сообщённый исход
+    return joined.drop_duplicates("user_id", keep="last")[FEATURE_COLUMNS + TARGET_COLUMNS]
+
+
+def export_dataset(directory=OUTCOME_LOG_DIR, base_path="progress_dataset_extended.csv",
+                   out_path="progress_dataset_merged.csv"):
+    import pandas as pd
+
+    base = pd.read_csv(base_path)
+    rows = outcome_rows(read_log(directory))
+    # типы как в исходном CSV: иначе целые колонки станут float, строки датасета
+    # запишутся как "37.0" и holdout при обучении разложит их по-другому
+    merged = pd.concat([base, rows[base.columns].astype(base.dtypes.to_dict())], ignore_index=True)
+    # вывод детерминирован: те же события дают тот же файл и тот же отпечаток при обучении
+    merged.to_csv(out_path, index=False)
+    return len(base), len(rows)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Export logged /predict outcomes for retraining")
+    parser.add_argument("--log-dir", default=OUTCOME_LOG_DIR)
+    parser.add_argument("--base", default="progress_dataset_extended.csv")
+    parser.add_argument("--out", default="progress_dataset_merged.csv")
+    args = parser.parse_args()
+    base_rows, new_rows = export_dataset(args.log_dir, args.base, args.out)
+    print(f"{args.out}: {base_rows} dataset rows + {new_rows} real outcomes")
+    print(f"Retrain with: python train_progress_model.py --data {args.out}")
@@ -0,0 +1,270 @@
+import os
+import abc
+import json
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "mongo")  # mongo | file | none
+STATE_FILE = os.getenv("STATE_FILE", "bot_state.json")
+STATE_FLUSH_MS = float(os.getenv("STATE_FLUSH_MS", "500"))
+STATE_FLUSH_UPDATES = int(os.getenv("STATE_FLUSH_UPDATES", "200"))
+STATE_TTL = float(os.getenv("STATE_TTL", str(24 * 3600)))
+
+
+def shard_for(user_id, shard_count):
+    return user_id % shard_count
+
+
+class BufferedPersistence(BasePersistence):
+    # Состояния ConversationHandler и user_data с объединением записей:
+    # изменения копятся в памяти (последняя запись по ключу побеждает) и уходят
+    # в хранилище одной пачкой раз в flush_ms или после flush_updates изменений.
+    # Записи старше ttl при загрузке не поднимаются, а хранилище удаляет их само.
+
+    def __init__(self, shard_index=0, shard_count=1, flush_ms=STATE_FLUSH_MS,
+                 flush_updates=STATE_FLUSH_UPDATES, ttl=STATE_TTL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=flush_ms / 1000,
+        )
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.flush_interval = flush_ms / 1000
+        self.flush_updates = flush_updates
+        self.ttl = ttl
+        self._conversation_writes = {}
+        self._user_data_writes = {}
+        self._flush_timer = None
+        self._flush_lock = asyncio.Lock()
+        # (name, key) -> updated_at (unix time) диалогов, поднятых при загрузке:
+        # таймеры conversation_timeout в хранилище не попадают, бот ставит их заново
+        self.restored = {}
+        self.flushes = 0
+        self.writes = 0
+
+    def _owns(self, user_id):
+        # фильтр по шарду на стороне Python: $mod не везде поддерживается (mongomock)
+        return shard_for(user_id, self.shard_count) == self.shard_index
+
+    @property
+    def pending(self):
+        return len(self._conversation_writes) + len(self._user_data_writes)
+
+    async def ensure_indexes(self):
+        pass
+
+    @abc.abstractmethod
+    async def _write(self, conversations, user_data):
+        # одна пачка изменений в хранилище; вызывается из flush()
+        pass
+
+    async def _buffer(self):
+        if self.pending >= self.flush_updates:
+            await self.flush()
+        elif self._flush_timer is None:
+            self._flush_timer = asyncio.get_running_loop().call_later(
+                self.flush_interval, lambda: asyncio.ensure_future(self._timed_flush())
+            )
+
+    async def _timed_flush(self):
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("State flush failed, will retry with the next batch")
+
+    async def flush(self):
+        async with self._flush_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if not self.pending:
+                return
+            conversations, self._conversation_writes = self._conversation_writes, {}
+            user_data, self._user_data_writes = self._user_data_writes, {}
+            try:
+                await self._write(conversations, user_data)
+            except Exception:
+                # возвращаем пачку в буфер, более свежие записи не перетираем
+                for key, value in conversations.items():
+                    self._conversation_writes.setdefault(key, value)
+                for key, value in user_data.items():
+                    self._user_data_writes.setdefault(key, value)
+                raise
+            self.flushes += 1
+            self.writes += len(conversations) + len(user_data)
+
+    async def update_conversation(self, name, key, new_state):
+        # None — диалог завершён, запись удаляется
+        self._conversation_writes[(name, tuple(key))] = new_state
+        await self._buffer()
+
+    async def update_user_data(self, user_id, data):
+        # пустой user_data не храним: после END хендлеры его очищают
+        self._user_data_writes[user_id] = data or None
+        await self._buffer()
+
+    async def drop_user_data(self, user_id):
+        self._user_data_writes[user_id] = None
+        await self._buffer()
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        # пользователь принадлежит одному воркеру, данные в памяти всегда свежие
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+
+class MongoPersistence(BufferedPersistence):
+    # Общее хранилище для всех воркеров. Воркер i из N при старте читает только
+    # своих пользователей (user_id % N == i), поэтому после рестарта или смены
+    # числа воркеров диалоги продолжаются там, куда фронт шлёт апдейты пользователя.
+
+    def __init__(self, db, shard_index=0, shard_count=1, **kwargs):
+        super().__init__(shard_index, shard_count, **kwargs)
+        self.conversations = db["conversations"]
+        self.user_data = db["user_data"]
+
+    async def ensure_indexes(self):
+        await self.conversations.create_index([("name", 1), ("key", 1)], unique=True)
+        await self.conversations.create_index("updated_at", expireAfterSeconds=int(self.ttl))
+        await self.user_data.create_index("user_id", unique=True)
+        await self.user_data.create_index("updated_at", expireAfterSeconds=int(self.ttl))
+
+    def _fresh(self):
+        return {"updated_at": {"$gt": datetime.now(timezone.utc) - timedelta(seconds=self.ttl)}}
+
+    async def get_user_data(self):
+        docs = await self.user_data.find(self._fresh(), {"_id": 0, "user_id": 1, "data": 1}).to_list(None)
+        return {doc["user_id"]: doc["data"] for doc in docs if self._owns(doc["user_id"])}
+
+    async def get_conversations(self, name):
+        query = {"name": name, **self._fresh()}
+        docs = await self.conversations.find(query, {"_id": 0, "key": 1, "state": 1, "user_id": 1, "updated_at": 1}
+                                             ).to_list(None)
+        docs = [doc for doc in docs if self._owns(doc["user_id"])]
+        for doc in docs:
+            updated_at = doc["updated_at"]
+            # pymongo без tz_aware отдаёт naive datetime в UTC
+            if updated_at.tzinfo is None:
+                updated_at = updated_at.replace(tzinfo=timezone.utc)
+            self.restored[(name, tuple(doc["key"]))] = updated_at.timestamp()
+        return {tuple(doc["key"]): doc["state"] for doc in docs}
+
+    async def _write(self, conversations, user_data):
+        from pymongo import DeleteOne, UpdateOne
+
+        now = datetime.now(timezone.utc)
+        # ключ диалога (chat_id, user_id) — шардируем по user_id
+        conversation_ops = [
+            DeleteOne({"name": name, "key": list(key)}) if state is None else
+            UpdateOne({"name": name, "key": list(key)},
+                      {"$set": {"state": state, "user_id": key[-1], "updated_at": now}}, upsert=True)
+            for (name, key), state in conversations.items()
+        ]
+        user_data_ops = [
+            DeleteOne({"user_id": user_id}) if data is None else
+            UpdateOne({"user_id": user_id}, {"$set": {"data": data, "updated_at": now}}, upsert=True)
+            for user_id, data in user_data.items()
+        ]
+        if conversation_ops:
+            await self.conversations.bulk_write(conversation_ops, ordered=False)
+        if user_data_ops:
+            await self.user_data.bulk_write(user_data_ops, ordered=False)
+
+
+class FilePersistence(BufferedPersistence):
+    # Локальный JSON-файл для одного процесса (режим polling без Mongo).
+    # Файл переписывается целиком при flush: в нём только незавершённые диалоги.
+
+    def __init__(self, path=STATE_FILE, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._state = None
+
+    def _load(self):
+        if self._state is None:
+            try:
+                with open(self.path) as f:
+                    self._state = json.load(f)
+            except (OSError, ValueError):
+                self._state = {"conversations": {}, "user_data": {}}
+            self._expire(time.time())
+        return self._state
+
+    def _expire(self, now):
+        for records in [self._state["user_data"], *self._state["conversations"].values()]:
+            for key in [k for k, (_, updated_at) in records.items() if now - updated_at > self.ttl]:
+                del records[key]
+
+    async def get_user_data(self):
+        state = self._load()
+        return {int(user_id): data for user_id, (data, _) in state["user_data"].items()}
+
+    async def get_conversations(self, name):
+        records = self._load()["conversations"].get(name, {})
+        for key, (_, updated_at) in records.items():
+            self.restored[(name, tuple(json.loads(key)))] = updated_at
+        return {tuple(json.loads(key)): state for key, (state, _) in records.items()}
+
+    async def _write(self, conversations, user_data):
+        state = self._load()
+        now = time.time()
+        for (name, key), new_state in conversations.items():
+            records = state["conversations"].setdefault(name, {})
+            if new_state is None:
+                records.pop(json.dumps(list(key)), None)
+            else:
+                records[json.dumps(list(key))] = [new_state, now]
+        for user_id, data in user_data.items():
+            if data is None:
+                state["user_data"].pop(str(user_id), None)
+            else:
+                state["user_data"][str(user_id)] = [data, now]
+        self._expire(now)
+        payload = json.dumps(state, separators=(",", ":"), default=str)
+        await asyncio.to_thread(self._dump, payload)
+
+    def _dump(self, payload):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(payload)
+        os.replace(tmp_path, self.path)
+
+
+def create_persistence(db=None, backend=STATE_BACKEND, **kwargs):
+    if backend == "mongo" and db is not None:
+        return MongoPersistence(db, **kwargs)
+    if backend == "file":
+        return FilePersistence(**kwargs)
+    return None
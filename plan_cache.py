@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+PLAN_CACHE_ENABLED = os.getenv("PLAN_CACHE_ENABLED", "1") == "1"
+PLAN_CACHE_SIZE = int(os.getenv("PLAN_CACHE_SIZE", "1024"))
+PLAN_CACHE_TTL = float(os.getenv("PLAN_CACHE_TTL", str(7 * 24 * 3600)))
+PLAN_CACHE_MONGO = os.getenv("PLAN_CACHE_MONGO", "0") == "1"
+
+AGE_BANDS = [(13, 17), (18, 29), (30, 39), (40, 49), (50, 59), (60, 100)]
+BMI_BANDS = [(0, 18.5, "underweight"), (18.5, 25, "normal"), (25, 30, "overweight"), (30, 1000, "obese")]
+
+
+def age_band(age):
+    for low, high in AGE_BANDS:
+        if low <= age <= high:
+            return f"{low}-{high}"
+    return "unknown"
+
+
+def bmi_band(weight, height_cm):
+    bmi = weight / (height_cm / 100) ** 2
+    for low, high, name in BMI_BANDS:
+        if low <= bmi < high:
+            return name
+    return "unknown"
+
+
+def canonical_profile(profile):
+    # Всё, что влияет на базовый план; имя и точные цифры сюда не попадают
+    return {
+        "gender": str(profile["gender"]).strip().lower(),
+        "fitness_goal": str(profile["fitness_goal"]).strip().lower(),
+        "fitness_level": str(profile["fitness_level"]).strip().lower(),
+        "age_band": age_band(int(profile["age"])),
+        "bmi_band": bmi_band(float(profile["weight"]), float(profile["height"])),
+    }
+
+
+def profile_key(profile):
+    raw = json.dumps(canonical_profile(profile), sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class PlanCache:
+    # Двухуровневый кэш планов: LRU+TTL в памяти, опционально коллекция Mongo
+    # (motor или storage.ThreadedCollection).
+
+    def __init__(self, maxsize=PLAN_CACHE_SIZE, ttl=PLAN_CACHE_TTL, collection=None, enabled=PLAN_CACHE_ENABLED):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.collection = collection
+        self.enabled = enabled
+        self._entries = OrderedDict()
+        self._index_ready = False
+        self.hits = 0
+        self.l2_hits = 0
+        self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.l2_hits + self.misses
+        return {
+            "hits": self.hits,
+            "l2_hits": self.l2_hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "hit_ratio": (self.hits + self.l2_hits) / lookups if lookups else 0.0,
+        }
+
+    async def get(self, profile):
+        if not self.enabled:
+            return None
+        key = profile_key(profile)
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, plan = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return plan
+            # устаревшая запись остаётся до вытеснения: get_stale отдаёт её, пока GPT недоступен
+
+        if self.collection is not None:
+            doc = await self._find(key)
+            if doc is not None:
+                self.l2_hits += 1
+                self._remember(key, doc["plan"])
+                return doc["plan"]
+
+        self.misses += 1
+        return None
+
+    def contains(self, profile):
+        # свежая запись в памяти, без счётчиков — для планировщика (Mongo не спрашиваем)
+        if not self.enabled:
+            return False
+        entry = self._entries.get(profile_key(profile))
+        return entry is not None and entry[0] > time.monotonic()
+
+    def get_stale(self, profile):
+        # план корзины без учёта TTL (только память) — запасной ответ, когда GPT недоступен
+        if not self.enabled:
+            return None
+        entry = self._entries.get(profile_key(profile))
+        return entry[1] if entry is not None else None
+
+    async def put(self, profile, plan):
+        if not self.enabled:
+            return
+        key = profile_key(profile)
+        self._remember(key, plan)
+        if self.collection is not None:
+            await self._store(key, canonical_profile(profile), plan)
+
+    def clear(self):
+        self._entries.clear()
+
+    def _remember(self, key, plan):
+        self._entries[key] = (time.monotonic() + self.ttl, plan)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def _ensure_index(self):
+        if not self._index_ready:
+            await self.collection.create_index("created_at", expireAfterSeconds=int(self.ttl))
+            await self.collection.create_index("key", unique=True)
+            self._index_ready = True
+
+    async def _find(self, key):
+        await self._ensure_index()
+        fresh_after = datetime.now(timezone.utc) - timedelta(seconds=self.ttl)
+        return await self.collection.find_one({"key": key, "created_at": {"$gt": fresh_after}}, {"_id": 0, "plan": 1})
+
+    async def _store(self, key, bucket, plan):
+        await self._ensure_index()
+        await self.collection.update_one(
+            {"key": key},
+            {"$set": {"plan": plan, "profile": bucket, "created_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
@@ -0,0 +1,232 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import hashlib
+import logging
+import argparse
+import itertools
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import metrics
+from plan_cache import AGE_BANDS, age_band
+from prompts import plan_messages
+
+logger = logging.getLogger(__name__)
+
+PLAN_TEMPLATES_ENABLED = os.getenv("PLAN_TEMPLATES_ENABLED", "1") == "1"
+PLAN_TEMPLATES_PATH = os.getenv("PLAN_TEMPLATES_PATH", "plan_templates.sqlite")
+PLAN_TEMPLATES_CONCURRENCY = int(os.getenv("PLAN_TEMPLATES_CONCURRENCY", "8"))
+
+# те же варианты, что принимает анкета /start
+GOALS = ("weight loss", "muscle gain", "endurance")
+LEVELS = ("beginner", "intermediate", "advanced")
+GENDERS = ("male", "female", "other")
+AGE_BAND_NAMES = tuple(f"{low}-{high}" for low, high in AGE_BANDS)
+
+# белок, г на кг веса в день
+PROTEIN_PER_KG = {"weight loss": 1.6, "muscle gain": 2.0, "endurance": 1.4}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS plan_templates (
+    goal TEXT NOT NULL,
+    level TEXT NOT NULL,
+    gender TEXT NOT NULL,
+    age_band TEXT NOT NULL,
+    plan TEXT NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    model TEXT,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (goal, level, gender, age_band)
+) WITHOUT ROWID
+"""
+
+
+def template_key(profile):
+    # (goal, level, gender, age_band): всё, от чего зависит базовый план
+    return (
+        str(profile["fitness_goal"]).strip().lower(),
+        str(profile["fitness_level"]).strip().lower(),
+        str(profile["gender"]).strip().lower(),
+        age_band(int(profile["age"])),
+    )
+
+
+def all_keys():
+    return list(itertools.product(GOALS, LEVELS, GENDERS, AGE_BAND_NAMES))
+
+
+def template_messages(key):
+    goal, level, gender, band = key
+    return plan_messages({"gender": gender, "fitness_goal": goal, "fitness_level": level, "age_band": band})
+
+
+def prompt_hash(messages, model):
+    raw = json.dumps([model, messages], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def personalize(plan, profile):
+    # Шаблон общий для корзины; цифры пользователя подставляются здесь, без GPT
+    weight = float(profile["weight"])
+    height = float(profile["height"])
+    bmi = weight / (height / 100) ** 2
+    protein = weight * PROTEIN_PER_KG.get(str(profile["fitness_goal"]).strip().lower(), 1.6)
+    water = weight * 0.035
+    header = (f"For {weight:g} kg, {height:g} cm (BMI {bmi:.1f}): "
+              f"aim for ~{protein:.0f} g protein and ~{water:.1f} L water a day.")
+    return f"{header}\n\n{plan.strip()}"
+
+
+class TemplateStore:
+    # SQLite-файл с библиотекой шаблонов, первичный ключ — (goal, level, gender, age_band).
+    # Пишет только офлайн-генератор; бот читает файл целиком при старте.
+
+    def __init__(self, path=PLAN_TEMPLATES_PATH):
+        import sqlite3
+
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute(SCHEMA)
+
+    def get(self, key):
+        row = self.db.execute(
+            "SELECT plan FROM plan_templates WHERE goal = ? AND level = ? AND gender = ? AND age_band = ?", key
+        ).fetchone()
+        return row[0] if row else None
+
+    def hashes(self):
+        rows = self.db.execute("SELECT goal, level, gender, age_band, prompt_hash FROM plan_templates")
+        return {tuple(row[:4]): row[4] for row in rows}
+
+    def all(self):
+        rows = self.db.execute("SELECT goal, level, gender, age_band, plan FROM plan_templates")
+        return {tuple(row[:4]): row[4] for row in rows}
+
+    def put(self, key, plan, hash_, model):
+        # коммит на каждый шаблон: упавшая генерация продолжается с того же места
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO plan_templates VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            (*key, plan, hash_, model, time.time()))
+
+    def close(self):
+        self.db.close()
+
+
+class PlanTemplates:
+    # Библиотека в памяти бота: шаблонов немного (goal × level × gender × age band),
+    # поиск — обращение к словарю, без I/O в хендлере.
+
+    def __init__(self, path=PLAN_TEMPLATES_PATH, enabled=PLAN_TEMPLATES_ENABLED, registry=metrics.REGISTRY):
+        self.path = path
+        self.enabled = enabled
+        self.registry = registry
+        self._plans = {}
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        if not self.enabled or not os.path.exists(self.path):
+            return self
+        store = TemplateStore(self.path)
+        try:
+            self._plans = store.all()
+        finally:
+            store.close()
+        logger.info(f"Loaded {len(self._plans)} plan templates from {self.path}")
+        if not self.complete:
+            logger.warning(f"Plan template library is incomplete: {len(self._plans)}/{len(all_keys())}")
+        return self
+
+    @property
+    def complete(self):
+        # есть шаблон на любой профиль из анкеты — /plan не ходит в GPT
+        return self.enabled and len(self._plans) >= len(all_keys()) and all(k in self._plans for k in all_keys())
+
+    def covers(self, profile):
+        return self.enabled and template_key(profile) in self._plans
+
+    def get(self, profile):
+        if not self.enabled:
+            return None
+        plan = self._plans.get(template_key(profile))
+        if plan is None:
+            self.misses += 1
+            self.registry.inc("bot_plan_templates_total", (("result", "miss"),))
+            return None
+        self.hits += 1
+        self.registry.inc("bot_plan_templates_total", (("result", "hit"),))
+        return personalize(plan, profile)
+
+    def stats(self):
+        return {"templates": len(self._plans), "hits": self.hits, "misses": self.misses}
+
+
+async def generate(store, llm, keys, concurrency=PLAN_TEMPLATES_CONCURRENCY, retries=3, force=False):
+    # Пропускает готовые шаблоны с тем же промптом и моделью; остальные генерирует,
+    # не больше concurrency одновременно. Возвращает (создано, пропущено, не удалось).
+    done = {} if force else store.hashes()
+    todo = []
+    for key in keys:
+        hash_ = prompt_hash(template_messages(key), llm.model)
+        if done.get(key) != hash_:
+            todo.append((key, hash_))
+    slots = asyncio.Semaphore(concurrency)
+    failed = []
+
+    async def one(key, hash_):
+        async with slots:
+            for attempt in range(retries):
+                try:
+                    plan = (await llm.complete(template_messages(key))).strip()
+                    if not plan:
+                        raise ValueError(f"unusable reply: {plan[:80]!r}")
+                    store.put(key, plan, hash_, llm.model)
+                    return
+                except Exception as e:
+                    logger.warning(f"[templates] {key} attempt {attempt + 1}/{retries}: {e!r}")
+                    if attempt + 1 < retries:
+                        await asyncio.sleep(2 ** attempt + random.random())
+            failed.append(key)
+
+    await asyncio.gather(*(one(key, hash_) for key, hash_ in todo))
+    return len(todo) - len(failed), len(keys) - len(todo), failed
+
+
+async def build(args):
+    from llm_client import AsyncLLMClient, LLM_MODEL
+
+    store = TemplateStore(args.path)
+    llm = AsyncLLMClient(model=args.model or LLM_MODEL, max_concurrency=args.concurrency,
+                         api_base=args.api_base, api_key=args.api_key)
+    start = time.perf_counter()
+    try:
+        created, skipped, failed = await generate(store, llm, all_keys(), args.concurrency, args.retries, args.force)
+    finally:
+        await llm.close()
+        store.close()
+    print(f"{created} templates generated, {skipped} already up to date, {len(failed)} failed "
+          f"in {time.perf_counter() - start:.1f}s -> {args.path}")
+    if failed:
+        # повторный запуск догенерирует только их
+        print("Failed: " + ", ".join("/".join(key) for key in failed))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Pre-generate the library of base 7-day plans")
+    parser.add_argument("--path", default=PLAN_TEMPLATES_PATH)
+    parser.add_argument("--concurrency", type=int, default=PLAN_TEMPLATES_CONCURRENCY)
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--api-base", default=os.getenv("LLM_API_BASE"),
+                        help="e.g. http://127.0.0.1:8089/v1 for benchmarks/fake_openai.py")
+    parser.add_argument("--api-key", default=os.getenv("OPENAI_API_KEY"))
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--force", action="store_true", help="regenerate every template")
+    asyncio.run(build(parser.parse_args()))
@@ -0,0 +1,139 @@
+import os
+import json
+import time
+from collections import OrderedDict, deque
+
+from features import FEATURE_COLUMNS
+
+PREDICTION_MEMO_ENABLED = os.getenv("PREDICTION_MEMO_ENABLED", "1") == "1"
+PREDICTION_MEMO_SIZE = int(os.getenv("PREDICTION_MEMO_SIZE", "50000"))
+PREDICTION_MEMO_TTL = float(os.getenv("PREDICTION_MEMO_TTL", str(24 * 3600)))
+# как часто проверять, не опубликована ли новая модель
+PREDICTION_MEMO_CHECK_SECONDS = float(os.getenv("PREDICTION_MEMO_CHECK_SECONDS", "5"))
+
+# Шаг квантования числовых признаков. Мельче точности, с которой пользователь
+# отвечает в диалоге, так что строка почти не меняется, а повторы совпадают:
+# 80 и 80.04 кг, 7 и 7.0 часов сна — один ключ.
+QUANTA = {
+    "age": 1,
+    "weight_start": 0.1,
+    "height": 0.01,
+    "sessions_per_week": 1,
+    "session_duration_minutes": 1,
+    "sleep_hours": 0.1,
+    "consistency_percent": 1,
+}
+BOOL_FEATURES = {"diet_followed", "restrictions_or_breaks"}
+
+
+def quantize_row(row):
+    # Каноническая строка признаков. Модель считает именно её, поэтому
+    # результат из мемо совпадает с тем, что вернул бы лес.
+    canonical = {}
+    for column in FEATURE_COLUMNS:
+        value = row.get(column)
+        if value is None:
+            canonical[column] = None
+        elif column in QUANTA:
+            step = QUANTA[column]
+            canonical[column] = round(round(float(value) / step) * step, 6)
+        elif column in BOOL_FEATURES:
+            canonical[column] = bool(value)
+        else:
+            canonical[column] = str(value)
+    return canonical
+
+
+def memo_key(row):
+    return tuple(row[column] for column in FEATURE_COLUMNS)
+
+
+def artifact_stamp(compiled_path, model_path):
+    # publish() подменяет каталог переименованием и пикл через os.replace:
+    # у новой версии другой inode, даже если mtime совпал
+    for path in (os.path.join(compiled_path, "meta.json") if compiled_path else None, model_path):
+        if path and os.path.exists(path):
+            stat = os.stat(path)
+            return path, stat.st_ino, stat.st_mtime_ns, stat.st_size
+    return None
+
+
+def artifact_version(compiled_path):
+    # model_version из meta.json скомпилированной модели; у пикла версии нет
+    path = os.path.join(compiled_path, "meta.json") if compiled_path else None
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f).get("model_version")
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+class PredictionMemo:
+    # LRU+TTL результатов модели по квантованной строке признаков. Очищается
+    # целиком при смене артефакта модели (BatchPredictor следит за ним).
+
+    def __init__(self, maxsize=PREDICTION_MEMO_SIZE, ttl=PREDICTION_MEMO_TTL, enabled=PREDICTION_MEMO_ENABLED):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.enabled = enabled
+        self._entries = OrderedDict()
+        # растёт при каждой очистке: расчёт, начатый старой моделью, не попадёт в мемо
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._hit_latencies = deque(maxlen=10_000)
+        self._miss_latencies = deque(maxlen=10_000)
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, prediction = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return prediction
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, prediction, generation):
+        if not self.enabled or generation != self.generation:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, prediction)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.generation += 1
+        self.invalidations += 1
+
+    def record_latency(self, hit, seconds):
+        (self._hit_latencies if hit else self._miss_latencies).append(seconds)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "hit_p50_ms": percentile(self._hit_latencies, 50) * 1000,
+            "hit_p99_ms": percentile(self._hit_latencies, 99) * 1000,
+            "miss_p50_ms": percentile(self._miss_latencies, 50) * 1000,
+            "miss_p99_ms": percentile(self._miss_latencies, 99) * 1000,
+        }
@@ -0,0 +1,152 @@
+import os
+import re
+
+from llm_client import LLM_MODEL
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "800"))  # входные токены на запрос к GPT
+# поля профиля, которые модели не нужны или уже есть в промпте отдельно
+PROMPT_EXCLUDED_FIELDS = {"_id", "user_id", "name", "last_plan", "plan_days", "plan_id"}
+
+SYSTEM_PROMPT = "You are a fitness expert."
+DAY_HEADER = re.compile(r"^[ \t*#_-]*day\s+(\d+)\b", re.IGNORECASE | re.MULTILINE)
+DAY_MENTION = re.compile(r"\bdays?\s+(\d+(?:\s*(?:-|–|to|,|and|&)\s*\d+)*)", re.IGNORECASE)
+
+_encoding = None
+
+
+def count_tokens(text):
+    # tiktoken, если установлен; иначе оценка: слово режется на куски по 4 символа, как у BPE
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+
+            try:
+                _encoding = tiktoken.encoding_for_model(LLM_MODEL)
+            except KeyError:
+                _encoding = tiktoken.get_encoding("cl100k_base")
+        except ImportError:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return len(re.findall(r"\w{1,4}|[^\w\s]", text))
+
+
+def count_message_tokens(messages):
+    # ~4 служебных токена на сообщение и 3 на начало ответа, как в учёте OpenAI
+    return sum(count_tokens(m["content"]) + 4 for m in messages) + 3
+
+
+def truncate_tokens(text, max_tokens):
+    if count_tokens(text) <= max_tokens:
+        return text
+    words = text.split(" ")
+    low, high = 0, len(words)
+    # бинарный поиск по числу слов: count_tokens дорогой на длинных планах
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(" ".join(words[:mid]) + "…") <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return " ".join(words[:low]) + "…"
+
+
+def compact_profile(profile):
+    # "age: 30; gender: male; ..." вместо json.dumps всего документа
+    return "; ".join(f"{k}: {v}" for k, v in profile.items() if k not in PROMPT_EXCLUDED_FIELDS)
+
+
+def parse_plan(text):
+    # План -> [{"day": N, "text": "Day N: ..."}]; текст до первого дня идёт с day=0
+    sections = []
+    starts = [m.start() for m in DAY_HEADER.finditer(text)]
+    if not starts or starts[0] > 0:
+        head = text[:starts[0] if starts else len(text)].strip()
+        if head:
+            sections.append({"day": 0, "text": head})
+    for start, end in zip(starts, starts[1:] + [len(text)]):
+        chunk = text[start:end].strip()
+        sections.append({"day": int(DAY_HEADER.match(chunk).group(1)), "text": chunk})
+    return sections
+
+
+def render_plan(sections):
+    return "\n".join(section["text"] for section in sections)
+
+
+def plan_sections(profile):
+    # старые профили хранят только текст плана
+    return profile.get("plan_days") or parse_plan(profile.get("last_plan", ""))
+
+
+def requested_days(request, sections):
+    # "make day 3 harder", "days 2 and 4", "day 5-7" -> {3}, {2, 4}, {5, 6, 7}
+    days = set()
+    for match in DAY_MENTION.finditer(request):
+        numbers = match.group(1)
+        for part in re.split(r"\s*(?:,|and|&)\s*", numbers):
+            bounds = [int(n) for n in re.findall(r"\d+", part)]
+            if len(bounds) == 2:
+                days.update(range(min(bounds), max(bounds) + 1))
+            elif bounds:
+                days.add(bounds[0])
+    known = {section["day"] for section in sections if section["day"]}
+    return sorted(days & known)
+
+
+def plan_messages(profile):
+    prompt = (
+        f"User Profile: {compact_profile(profile)}\n\n"
+         "Generate a personalized workout plan based on the user's profile, fitness goal, and fitness level. for next 7 days only PLAN nothing else. and dont exceed limit  answer more than 200 words."
+    )
+    return [{"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}]
+
+
+def improve_messages(profile, request, days=(), budget=PROMPT_TOKEN_BUDGET):
+    # Если в запросе названы дни, модели уходят только они и переписывает она только их.
+    # План не повторяется в профиле; всё вместе укладывается в budget токенов.
+    sections = plan_sections(profile)
+    if days:
+        context = [s for s in sections if s["day"] in days]
+        names = ", ".join(f"Day {day}" for day in days)
+        task = (f"Rewrite only {names} of the plan as requested. Reply with only those days, "
+                "each starting with 'Day N:'. Keep each day under 60 words.")
+    else:
+        context = sections
+        task = "Please provide an improved version of the plan only. Keep it under 200 words."
+
+    def build(request_text, plan_text):
+        prompt = (
+            f"User profile: {compact_profile(profile)}\n\n"
+            f"Current plan:\n{plan_text}\n\n"
+            f"User wants to improve the plan as follows: {request_text}\n\n"
+            f"{task}"
+        )
+        return [{"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}]
+
+    request = truncate_tokens(request, budget // 4)
+    fixed = count_message_tokens(build(request, ""))
+    plan_text = render_plan(context)
+    if fixed + count_tokens(plan_text) > budget and context:
+        # режем каждый день поровну, чтобы модель видела структуру всего плана
+        share = max(1, (budget - fixed) // len(context) - 1)
+        plan_text = "\n".join(truncate_tokens(s["text"], share) for s in context)
+    return build(request, plan_text)
+
+
+def merge_plan(sections, reply, days):
+    # Подставляет переписанные дни в план; если дни не выделены — ответ целиком новый план
+    if not days:
+        return parse_plan(reply)
+    updates = {s["day"]: s for s in parse_plan(reply) if s["day"] in days}
+    if not updates and len(days) == 1:
+        updates = {days[0]: {"day": days[0], "text": f"Day {days[0]}: {reply.strip()}"}}
+    return [updates.get(s["day"], s) for s in sections]
+
+
+def changed_days(old_sections, new_sections):
+    old = {s["day"]: s["text"] for s in old_sections}
+    return [s["day"] for s in new_sections if s["day"] and old.get(s["day"]) != s["text"]]
@@ -0,0 +1,209 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+from telegram.ext import BaseUpdateProcessor
+
+import metrics
+from llm_client import LLM_MAX_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1") == "1"
+# апдейтов в обработке одновременно (все классы); с запасом над очередью GPT,
+# чтобы ждущие /plan не занимали все места дешёвых шагов
+SCHEDULER_MAX_CONCURRENT = int(os.getenv("SCHEDULER_MAX_CONCURRENT", "512"))
+SCHEDULER_GPT_CONCURRENCY = int(os.getenv("SCHEDULER_GPT_CONCURRENCY", str(LLM_MAX_CONCURRENCY)))
+SCHEDULER_QUEUE_LIMIT = int(os.getenv("SCHEDULER_QUEUE_LIMIT", "256"))
+SCHEDULER_QUEUE_TIMEOUT = float(os.getenv("SCHEDULER_QUEUE_TIMEOUT", "30"))
+GPT_USER_BURST = float(os.getenv("GPT_USER_BURST", "3"))
+GPT_USER_PER_HOUR = float(os.getenv("GPT_USER_PER_HOUR", "20"))
+GPT_GLOBAL_BURST = float(os.getenv("GPT_GLOBAL_BURST", "30"))
+GPT_GLOBAL_PER_MINUTE = float(os.getenv("GPT_GLOBAL_PER_MINUTE", "120"))
+USER_BUCKETS_MAX = int(os.getenv("USER_BUCKETS_MAX", "100000"))
+
+CHEAP = "cheap"
+EXPENSIVE = "expensive"
+
+RATE_LIMITED_TEXT = "⏳ You've asked GPT for several plans in a row. Please try again in {seconds} s."
+BUSY_TEXT = "⏳ The bot is busy right now. Please try again in a minute."
+
+
+def matching_callback(application, update):
+    # имя колбэка, который PTB вызовет для апдейта (внутри ConversationHandler —
+    # хендлер текущего состояния); тот же порядок поиска, что в process_update
+    from telegram.ext import ConversationHandler
+
+    for group in sorted(application.handlers):
+        for handler in application.handlers[group]:
+            check = handler.check_update(update)
+            if check is None or check is False:
+                continue
+            if isinstance(handler, ConversationHandler):
+                handler = check[2]
+            return getattr(handler.callback, "__name__", None)
+    return None
+
+
+class TokenBucket:
+    # rate токенов в секунду, не больше capacity. reserve() может увести баланс
+    # в минус: ждущие получают токены строго по очереди, без опроса.
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        # 0 — токен взят, иначе через сколько секунд он появится
+        self._refill(time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def reserve(self, max_wait):
+        # токен в долг: сколько ждать до него; None — дольше max_wait, ничего не взято
+        self._refill(time.monotonic())
+        wait = max(0.0, (1 - self.tokens) / self.rate)
+        if wait > max_wait:
+            return None
+        self.tokens -= 1
+        return wait
+
+    def refund(self):
+        # токен вернуть: запрос, под который он взят, так и не дошёл до GPT
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class PriorityUpdateProcessor(BaseUpdateProcessor):
+    # Обработчик апдейтов PTB с классами приоритета. Дешёвые апдейты (шаги анкеты,
+    # /profile, /predict) идут сразу и параллельно. Дорогие (запросы к GPT) проходят
+    # лимит пользователя (отказ с подсказкой, когда повторить), общий лимит и
+    # ограничение одновременных вызовов — ждут в очереди, при переполнении или
+    # долгом ожидании получают отказ. Апдейты одного пользователя обрабатываются
+    # по порядку: диалоги ConversationHandler без этого ломаются.
+
+    def __init__(self, classify, max_concurrent=SCHEDULER_MAX_CONCURRENT, gpt_concurrency=SCHEDULER_GPT_CONCURRENCY,
+                 queue_limit=SCHEDULER_QUEUE_LIMIT, queue_timeout=SCHEDULER_QUEUE_TIMEOUT,
+                 user_burst=GPT_USER_BURST, user_per_hour=GPT_USER_PER_HOUR,
+                 global_burst=GPT_GLOBAL_BURST, global_per_minute=GPT_GLOBAL_PER_MINUTE,
+                 registry=metrics.REGISTRY):
+        super().__init__(max_concurrent)
+        self.classify = classify
+        self.gpt_concurrency = gpt_concurrency
+        self.queue_limit = queue_limit
+        self.queue_timeout = queue_timeout
+        self.user_burst = user_burst
+        self.user_rate = user_per_hour / 3600
+        self.global_bucket = TokenBucket(global_per_minute / 60, global_burst)
+        self.registry = registry
+        self._user_buckets = OrderedDict()
+        self._user_locks = {}
+        self._gpt_slots = None
+        # on_reject(update, reason) — для нагрузочных тестов: хендлер не запустится
+        self.on_reject = None
+        self.queued = 0
+        self.rejected = 0
+
+    async def initialize(self):
+        self._gpt_slots = asyncio.Semaphore(self.gpt_concurrency)
+
+    async def shutdown(self):
+        pass
+
+    def _user_bucket(self, user_id):
+        bucket = self._user_buckets.get(user_id)
+        if bucket is None:
+            bucket = self._user_buckets[user_id] = TokenBucket(self.user_rate, self.user_burst)
+            # давно неактивный пользователь уходит из LRU — его лимит всё равно был бы полным
+            while len(self._user_buckets) > USER_BUCKETS_MAX:
+                self._user_buckets.popitem(last=False)
+        else:
+            self._user_buckets.move_to_end(user_id)
+        return bucket
+
+    async def do_process_update(self, update, coroutine):
+        user = getattr(update, "effective_user", None)
+        if user is None:
+            await coroutine
+            return
+        # замок на пользователя: следующий апдейт ждёт, пока обработан предыдущий
+        lock = self._user_locks.get(user.id)
+        if lock is None:
+            lock = self._user_locks[user.id] = [asyncio.Lock(), 0]
+        lock[1] += 1
+        start = time.perf_counter()
+        try:
+            async with lock[0]:
+                # класс — после замка: он зависит от состояния диалога после прошлого апдейта
+                update_class = self.classify(update)
+                self.registry.inc("bot_scheduler_updates_total", (("class", update_class),))
+                if update_class == EXPENSIVE:
+                    await self._run_expensive(update, user.id, coroutine)
+                else:
+                    self.registry.observe("bot_scheduler_wait_seconds", (("class", CHEAP),),
+                                          time.perf_counter() - start)
+                    await coroutine
+        finally:
+            lock[1] -= 1
+            if not lock[1]:
+                del self._user_locks[user.id]
+
+    async def _run_expensive(self, update, user_id, coroutine):
+        user_bucket = self._user_bucket(user_id)
+        retry_after = user_bucket.take()
+        if retry_after:
+            await self._reject(update, coroutine, "user_rate", RATE_LIMITED_TEXT.format(seconds=int(retry_after) + 1))
+            return
+        # отказ на следующих шагах — не вина пользователя: его токен возвращается
+        if self.queued >= self.queue_limit:
+            user_bucket.refund()
+            await self._reject(update, coroutine, "queue_full", BUSY_TEXT)
+            return
+        wait = self.global_bucket.reserve(self.queue_timeout)
+        if wait is None:
+            user_bucket.refund()
+            await self._reject(update, coroutine, "global_rate", BUSY_TEXT)
+            return
+        start = time.perf_counter()
+        self._queue_depth(1)
+        try:
+            if wait:
+                await asyncio.sleep(wait)
+            remaining = self.queue_timeout - (time.perf_counter() - start)
+            await asyncio.wait_for(self._gpt_slots.acquire(), max(remaining, 0.001))
+        except asyncio.TimeoutError:
+            user_bucket.refund()
+            self.global_bucket.refund()
+            await self._reject(update, coroutine, "queue_timeout", BUSY_TEXT)
+            return
+        finally:
+            self._queue_depth(-1)
+        self.registry.observe("bot_scheduler_wait_seconds", (("class", EXPENSIVE),), time.perf_counter() - start)
+        try:
+            await coroutine
+        finally:
+            self._gpt_slots.release()
+
+    def _queue_depth(self, delta):
+        self.queued += delta
+        self.registry.add_gauge("bot_scheduler_queue_depth", (), delta)
+
+    async def _reject(self, update, coroutine, reason, text):
+        # хендлер не запускается; закрываем корутину, чтобы не было "never awaited"
+        coroutine.close()
+        self.rejected += 1
+        self.registry.inc("bot_scheduler_rejected_total", (("reason", reason),))
+        logger.info(f"[scheduler] rejected update from {update.effective_user.id}: {reason}")
+        if update.effective_message is not None:
+            await update.effective_message.reply_text(text)
+        if self.on_reject is not None:
+            self.on_reject(update, reason)
@@ -0,0 +1,364 @@
+import os
+import asyncio
+import hashlib
+import logging
+import itertools
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "fitness_bot")
+MONGO_POOL_SIZE = int(os.getenv("MONGO_POOL_SIZE", "50"))
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+# планы неизменяемы (правка — новый документ), кэш по id не устаревает
+PLAN_DOC_CACHE_SIZE = int(os.getenv("PLAN_DOC_CACHE_SIZE", "1000"))
+
+# Документ user_profiles: анкета и ссылка на текущий план в user_plans.
+# Наборы полей под хендлеры — из Mongo читается только нужное.
+PROFILE_DOC_FIELDS = ("name", "age", "gender", "weight", "height", "fitness_goal", "fitness_level", "plan_id")
+ANSWER_DOC_FIELDS = PROFILE_DOC_FIELDS[:-1]
+PREDICT_FIELDS = ("age", "weight", "height", "gender", "fitness_goal", "fitness_level")
+PLAN_FIELDS = PREDICT_FIELDS + ("plan_id",)
+PLAN_REF_FIELDS = ("plan_id",)
+
+
+def create_database(uri=None, pool_size=None, db_name=MONGO_DB_NAME):
+    # motor импортируется лениво, чтобы модуль работал и с mongomock
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(
+        uri or os.getenv("MONGO_DB_URI"),
+        maxPoolSize=pool_size or MONGO_POOL_SIZE,
+    )
+    return client[db_name]
+
+
+class ThreadedCollection:
+    # Обёртка над синхронной коллекцией (pymongo/mongomock) с интерфейсом motor:
+    # каждый вызов уходит в поток и возвращает awaitable.
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def find(self, *args, **kwargs):
+        # как в motor: find синхронно отдаёт курсор, а читается он через await
+        return ThreadedCursor(self.collection.find(*args, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(method, *args, **kwargs)
+
+        return call
+
+
+class ThreadedCursor:
+    # to_list(length), как в motor, отдаёт следующие length документов —
+    # так курсор можно читать кусками
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    async def to_list(self, length=None):
+        return await asyncio.to_thread(list, itertools.islice(self.cursor, length))
+
+
+class ThreadedDatabase:
+    # То же для базы: db["name"] отдаёт ThreadedCollection (mongomock в бенчмарках).
+
+    def __init__(self, database):
+        self.database = database
+
+    def __getitem__(self, name):
+        return ThreadedCollection(self.database[name])
+
+
+class TimedCollection:
+    # Та же коллекция (motor или ThreadedCollection), но ожидание каждого вызова
+    # записывается в фазу "mongo" текущего хендлера (metrics.py).
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def find(self, *args, **kwargs):
+        return TimedCursor(self.collection.find(*args, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+
+        async def call(*args, **kwargs):
+            with metrics.phase("mongo"):
+                return await method(*args, **kwargs)
+
+        return call
+
+
+class TimedCursor:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    async def to_list(self, length=None):
+        with metrics.phase("mongo"):
+            return await self.cursor.to_list(length)
+
+
+class TimedDatabase:
+    def __init__(self, database):
+        self.database = database
+
+    def __getitem__(self, name):
+        return TimedCollection(self.database[name])
+
+
+def legacy_plan_id(user_id):
+    # один и тот же _id у перенесённого плана при любом числе запусков миграции
+    from bson import ObjectId
+
+    return ObjectId(hashlib.sha256(f"legacy-plan:{user_id}".encode()).digest()[:12])
+
+
+def projection(fields):
+    return {"_id": 0, **{field: 1 for field in fields}}
+
+
+class UserProfile:
+    # Профиль в кэше и в хендлерах: только поля схемы, без словаря на объект.
+    # Незагруженное поле — пустой слот; загруженное, но отсутствующее в Mongo — None.
+    # Читается как словарь (profile["age"], .get, .items), но не меняется хендлерами.
+    __slots__ = PROFILE_DOC_FIELDS
+
+    def __init__(self, doc=None, fields=()):
+        for field in fields:
+            setattr(self, field, None)
+        if doc:
+            self.update(doc)
+
+    def update(self, doc):
+        for field, value in doc.items():
+            if field in PROFILE_DOC_FIELDS:
+                setattr(self, field, value)
+
+    def loaded(self, fields):
+        return all(hasattr(self, field) for field in fields)
+
+    def get(self, field, default=None):
+        value = getattr(self, field, None) if field in PROFILE_DOC_FIELDS else None
+        return default if value is None else value
+
+    def __getitem__(self, field):
+        value = self.get(field)
+        if value is None:
+            raise KeyError(field)
+        return value
+
+    def __contains__(self, field):
+        return self.get(field) is not None
+
+    def items(self):
+        return [(field, value) for field in PROFILE_DOC_FIELDS if (value := getattr(self, field, None)) is not None]
+
+    def as_dict(self, fields=PROFILE_DOC_FIELDS):
+        return {field: value for field in fields if (value := getattr(self, field, None)) is not None}
+
+    def __repr__(self):
+        return f"UserProfile({self.as_dict()})"
+
+
+class UserProfileManager:
+    # Асинхронный репозиторий профилей с read-through кэшем в процессе.
+    # Все записи проходят через этот класс и сразу обновляют кэш. Хендлер
+    # просит нужные поля; кэш догружает только те, которых в нём ещё нет.
+    # Планы — отдельные документы user_plans, в профиле только plan_id текущего:
+    # /improve создаёт новый документ, старые остаются историей.
+
+    def __init__(self, collection, plans=None, cache_size=PROFILE_CACHE_SIZE, plan_cache_size=PLAN_DOC_CACHE_SIZE):
+        self.collection = collection
+        self.plans = plans
+        self.cache_size = cache_size
+        self.plan_cache_size = plan_cache_size
+        self._cache = OrderedDict()
+        self._plans = OrderedDict()
+        self.round_trips = 0
+
+    async def ensure_indexes(self):
+        self.round_trips += 1
+        await self.collection.create_index("user_id", unique=True)
+        if self.plans is not None:
+            self.round_trips += 1
+            await self.plans.create_index([("user_id", 1), ("created_at", -1)])
+
+    def _cache_get(self, user_id):
+        profile = self._cache.get(user_id)
+        if profile is not None:
+            self._cache.move_to_end(user_id)
+        return profile
+
+    def _cache_put(self, user_id, profile):
+        if self.cache_size <= 0:
+            return
+        self._cache[user_id] = profile
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def cached_profile(self, user_id, fields=PROFILE_DOC_FIELDS):
+        # профиль из кэша без запроса к Mongo; None, если его там нет или полей не хватает
+        profile = self._cache.get(user_id)
+        return profile if profile is not None and profile.loaded(fields) else None
+
+    def invalidate(self, user_id):
+        self._cache.pop(user_id, None)
+
+    async def get_user_profile(self, user_id, fields=PROFILE_DOC_FIELDS):
+        profile = self._cache_get(user_id)
+        if profile is not None and profile.loaded(fields):
+            return profile
+        missing = fields if profile is None else tuple(f for f in fields if not hasattr(profile, f))
+        self.round_trips += 1
+        doc = await self.collection.find_one({"user_id": user_id}, projection(missing))
+        if doc is None:
+            self.invalidate(user_id)
+            return None
+        if profile is None:
+            profile = UserProfile()
+        profile.update(dict.fromkeys(missing))
+        profile.update(doc)
+        self._cache_put(user_id, profile)
+        return profile
+
+    async def save_user_profile(self, user_id, profile_data):
+        # в профиль — только поля анкеты: в user_data бывают и служебные ключи диалогов
+        fields = {k: v for k, v in profile_data.items() if k in ANSWER_DOC_FIELDS}
+
+        self.round_trips += 1
+        result = await self.collection.update_one(
+            {"user_id": user_id},
+            {"$set": {**fields, "user_id": user_id}},
+            upsert=True
+        )
+
+        # $set сливает поля, поэтому кэш обновляем только если знаем весь документ
+        cached = self._cache.get(user_id)
+        if cached is not None:
+            cached.update(fields)
+        elif result.upserted_id:
+            self._cache_put(user_id, UserProfile(fields, PROFILE_DOC_FIELDS))
+
+        if result.modified_count > 0 or result.upserted_id:
+            logger.info(f"[✅] Profile saved for user_id: {user_id}")
+        else:
+            logger.warning(f"[⚠️] Profile save attempted but no changes for user_id: {user_id}")
+
+    def _plan_put(self, plan_id, plan):
+        if self.plan_cache_size <= 0:
+            return
+        self._plans[plan_id] = plan
+        self._plans.move_to_end(plan_id)
+        while len(self._plans) > self.plan_cache_size:
+            self._plans.popitem(last=False)
+
+    async def get_user_plan(self, plan_id):
+        # {"plan": текст, "plan_days": [...]} по plan_id из профиля
+        if plan_id is None:
+            return None
+        plan = self._plans.get(plan_id)
+        if plan is not None:
+            self._plans.move_to_end(plan_id)
+            return plan
+        self.round_trips += 1
+        plan = await self.plans.find_one({"_id": plan_id}, {"_id": 0, "plan": 1, "plan_days": 1})
+        if plan is not None:
+            self._plan_put(plan_id, plan)
+        return plan
+
+    async def save_user_plan(self, user_id, plan, plan_days=None):
+        # plan_days — тот же план по дням (prompts.parse_plan), для точечных правок в /improve
+        from bson import ObjectId
+
+        logger.info(f"[🔍] About to save plan:\n{plan[:100]}...")
+        doc = {"plan": plan}
+        if plan_days is not None:
+            doc["plan_days"] = plan_days
+        # сначала документ плана, потом ссылка на него: упавшая вставка не оставит
+        # в профиле plan_id на несуществующий план
+        plan_id = ObjectId()
+        self.round_trips += 2
+        await self.plans.insert_one({"_id": plan_id, "user_id": user_id, "created_at": datetime.now(timezone.utc), **doc})
+        result = await self.collection.update_one({"user_id": user_id}, {"$set": {"plan_id": plan_id}}, upsert=False)
+
+        if result.matched_count > 0:
+            cached = self._cache.get(user_id)
+            if cached is not None:
+                cached.plan_id = plan_id
+            self._plan_put(plan_id, doc)
+            logger.info(f"[✅] Plan updated for user_id: {user_id}")
+        else:
+            logger.error(f"[❌] Plan NOT updated — user_id not found: {user_id}")
+            self.round_trips += 1
+            await self.plans.delete_one({"_id": plan_id})
+
+    async def plan_history(self, user_id, limit=10):
+        # прошлые планы пользователя, новые первыми
+        self.round_trips += 1
+        cursor = self.plans.find({"user_id": user_id}, {"user_id": 0}, sort=[("created_at", -1)], limit=limit)
+        return await cursor.to_list(limit)
+
+    async def delete_user_plan(self, user_id):
+        # документ плана остаётся в истории, профиль больше на него не ссылается
+        self.round_trips += 1
+        await self.collection.update_one(
+            {"user_id": user_id},
+            {"$unset": {"plan_id": ""}}
+        )
+        cached = self._cache.get(user_id)
+        if cached is not None:
+            cached.plan_id = None
+
+    async def migrate_embedded_plans(self, batch_size=500):
+        # Профили старого формата хранят last_plan/plan_days в самом документе:
+        # переносим их в user_plans и оставляем в профиле plan_id. Миграцию
+        # запускает каждый воркер при старте, поэтому каждый шаг идемпотентен:
+        # документ плана с _id от user_id (upsert), затем plan_id, и только
+        # потом $unset старых полей. Сбой на любом шаге ничего не теряет —
+        # следующий запуск продолжит с того же места.
+        cursor = self.collection.find({"last_plan": {"$exists": True}}, {"_id": 0, "user_id": 1})
+        moved = 0
+        failed = 0
+        now = datetime.now(timezone.utc)
+
+        async def move(user_id):
+            doc = await self.collection.find_one({"user_id": user_id, "last_plan": {"$exists": True}},
+                                                 {"_id": 0, "last_plan": 1, "plan_days": 1})
+            if doc is None:
+                return 0
+            plan_id = legacy_plan_id(user_id)
+            await self.plans.update_one(
+                {"_id": plan_id},
+                {"$setOnInsert": {"user_id": user_id, "created_at": now, "legacy": True, "plan": doc["last_plan"],
+                                  **({"plan_days": doc["plan_days"]} if doc.get("plan_days") else {})}},
+                upsert=True,
+            )
+            # новый план, сохранённый после выкатки, старым не перезаписываем
+            await self.collection.update_one({"user_id": user_id, "plan_id": {"$exists": False}},
+                                             {"$set": {"plan_id": plan_id}})
+            result = await self.collection.update_one({"user_id": user_id, "last_plan": {"$exists": True}},
+                                                      {"$unset": {"last_plan": "", "plan_days": ""}})
+            self.invalidate(user_id)
+            return result.modified_count
+
+        while True:
+            docs = await cursor.to_list(batch_size)
+            if not docs:
+                break
+            for result in await asyncio.gather(*(move(doc["user_id"]) for doc in docs), return_exceptions=True):
+                if isinstance(result, Exception):
+                    failed += 1
+                    logger.error(f"Embedded plan migration failed: {result!r}")
+                else:
+                    moved += result
+        if moved or failed:
+            logger.info(f"Moved {moved} embedded plans to user_plans, {failed} left for the next start")
+        return moved
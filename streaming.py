@@ -0,0 +1,131 @@
+import os
+import time
+import asyncio
+
+from telegram.error import BadRequest, RetryAfter
+
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "1") == "1"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))  # секунды между правками одного сообщения
+STREAM_PLACEHOLDER = os.getenv("STREAM_PLACEHOLDER", "✍️ Generating...")
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+
+def split_point(text, limit=TELEGRAM_MESSAGE_LIMIT):
+    # режем по последнему переводу строки (день плана), иначе по пробелу, иначе жёстко
+    if len(text) <= limit:
+        return len(text)
+    for separator in ("\n", " "):
+        cut = text.rfind(separator, 0, limit)
+        if cut > 0:
+            return cut
+    return limit
+
+
+def split_message(text, limit=TELEGRAM_MESSAGE_LIMIT):
+    parts = []
+    while len(text) > limit:
+        cut = split_point(text, limit)
+        parts.append(text[:cut])
+        text = text[cut:].lstrip()
+    if text or not parts:
+        parts.append(text)
+    return parts
+
+
+async def reply_long(message, text):
+    for part in split_message(text):
+        await message.reply_text(part)
+
+
+class StreamingReply:
+    # Ответ, который растёт по мере генерации: сначала заглушка, потом правки
+    # того же сообщения не чаще interval. Когда текст перерастает лимит Telegram,
+    # текущее сообщение дописывается до точки разреза и начинается следующее.
+
+    def __init__(self, message, prefix="", placeholder=STREAM_PLACEHOLDER,
+                 interval=STREAM_EDIT_INTERVAL, limit=TELEGRAM_MESSAGE_LIMIT):
+        self.message = message
+        self.prefix = prefix
+        self.placeholder = placeholder
+        self.interval = interval
+        self.limit = limit
+        self.text = ""
+        self.edits = 0
+        self.messages = 0
+        self._current = None
+        self._shown = ""
+        self._offset = 0
+        self._next_edit = 0.0
+
+    async def start(self):
+        # первый кусок показываем сразу, дальше правки не чаще interval
+        await self._send(self.placeholder)
+        return self
+
+    async def feed(self, delta):
+        self.text += delta
+        if time.monotonic() >= self._next_edit:
+            await self._flush(final=False)
+
+    async def finish(self):
+        await self._flush(final=True)
+        return self.text
+
+    async def fail(self, error_text):
+        # текущее сообщение заменяется текстом ошибки
+        if self._current is None:
+            await self._send(error_text)
+            return
+        await self._show(error_text, final=True)
+
+    async def _send(self, text):
+        self._current = await self.message.reply_text(text)
+        self._shown = text
+        self.messages += 1
+
+    async def _flush(self, final):
+        self._next_edit = time.monotonic() + self.interval
+        body = (self.prefix + self.text)[self._offset:]
+        if self._current is None:
+            # прошлое сообщение закрыто разрезом: следующее — с первого непробельного символа
+            rest = body.lstrip()
+            if not rest:
+                return
+            self._offset += len(body) - len(rest)
+            body = rest
+            await self._send(body[:self.limit])
+        while len(body) > self.limit:
+            cut = split_point(body, self.limit)
+            await self._show(body[:cut], final=True)
+            rest = body[cut:].lstrip()
+            if not rest:
+                # после разреза одни пробелы: пустое сообщение Telegram не примет,
+                # новое начнётся, когда придёт текст
+                self._offset += cut
+                self._current = None
+                return
+            self._offset += len(body) - len(rest)
+            body = rest
+            await self._send(body[:self.limit])
+        if body.strip():
+            await self._show(body, final)
+
+    async def _show(self, text, final):
+        if text == self._shown:
+            return
+        while True:
+            try:
+                await self._current.edit_text(text)
+                break
+            except RetryAfter as e:
+                if not final:
+                    # промежуточную правку пропускаем, следующая придёт после паузы
+                    self._next_edit = time.monotonic() + e.retry_after
+                    return
+                await asyncio.sleep(e.retry_after)
+            except BadRequest as e:
+                if "not modified" not in str(e).lower():
+                    raise
+                break
+        self._shown = text
+        self.edits += 1
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.multioutput import MultiOutputRegressor
+from sklearn.ensemble import RandomForestRegressor
+
+from compiled_model import CompiledProgressModel, check_compiled, compile_pipeline, export_compiled
+from features import FEATURE_COLUMNS
+from train_progress_model import CATEGORICAL_FEATURES, DATASET_PATH, build_pipeline, load_dataset
+
+# Скомпилированная модель должна отвечать как пикл: на строках датасета,
+# на неизвестных категориях и на пропусках. Леса маленькие — тест быстрый.
+
+ATOL = 1e-6
+
+
+@pytest.fixture(scope="module")
+def dataset():
+    return load_dataset([DATASET_PATH])
+
+
+def fitted_pipeline(x, y, multi_output):
+    numerical = [col for col in x.columns if col not in CATEGORICAL_FEATURES]
+    pipeline = build_pipeline(numerical, n_estimators=8, n_jobs=1, random_state=0)
+    if multi_output:
+        # старые пиклы: MultiOutputRegressor с лесом на каждый выход
+        pipeline.steps[-1] = ("regressor", MultiOutputRegressor(RandomForestRegressor(n_estimators=4, random_state=0)))
+    return pipeline.fit(x, y)
+
+
+@pytest.fixture(scope="module", params=[False, True], ids=["forest", "multi_output"])
+def pipeline(request, dataset):
+    x, y = dataset
+    return fitted_pipeline(x, y, request.param)
+
+
+def edge_rows(x):
+    # неизвестные категории, пропуски в числах и категориях
+    rows = x.head(6).to_dict(orient="records")
+    rows[0]["gender"] = "Other"
+    rows[1]["goal"] = "flexibility"
+    rows[2]["level"] = None
+    rows[3]["age"] = None
+    rows[4]["sleep_hours"] = None
+    rows[4]["consistency_percent"] = None
+    rows[5].update({column: None for column in FEATURE_COLUMNS})
+    return rows
+
+
+def expected(pipeline, rows):
+    frame = pd.DataFrame(rows, columns=FEATURE_COLUMNS)
+    for column in CATEGORICAL_FEATURES:
+        frame[column] = frame[column].astype(object)
+    return pipeline.predict(frame.astype({c: float for c in frame.columns if c not in CATEGORICAL_FEATURES}))
+
+
+def test_predict_matches_pipeline(pipeline, dataset):
+    x, _ = dataset
+    compiled = CompiledProgressModel(*compile_pipeline(pipeline))
+    assert check_compiled(pipeline, compiled, x, atol=ATOL) <= ATOL
+
+
+def test_predict_columns_matches_pipeline(pipeline, dataset):
+    x, _ = dataset
+    compiled = CompiledProgressModel(*compile_pipeline(pipeline))
+    columns = {column: x[column].to_numpy() for column in FEATURE_COLUMNS}
+    np.testing.assert_allclose(compiled.predict_columns(columns), pipeline.predict(x), rtol=0, atol=ATOL)
+
+
+def test_unknown_categories_and_missing_values(pipeline, dataset):
+    x, _ = dataset
+    rows = edge_rows(x)
+    compiled = CompiledProgressModel(*compile_pipeline(pipeline))
+    want = expected(pipeline, rows)
+    np.testing.assert_allclose(compiled.predict(rows), want, rtol=0, atol=ATOL)
+    columns = {column: [row[column] for row in rows] for column in FEATURE_COLUMNS}
+    columns = {column: np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+               if column not in CATEGORICAL_FEATURES else np.array(values, dtype=object)
+               for column, values in columns.items()}
+    np.testing.assert_allclose(compiled.predict_columns(columns), want, rtol=0, atol=ATOL)
+
+
+def test_exported_artifact_round_trip(pipeline, dataset, tmp_path):
+    x, _ = dataset
+    export_compiled(pipeline, str(tmp_path), model_version="v0001")
+    compiled = CompiledProgressModel.load(str(tmp_path), mmap_mode="r")
+    assert compiled.meta["model_version"] == "v0001"
+    rows = x.head(50).to_dict(orient="records") + edge_rows(x)
+    np.testing.assert_allclose(compiled.predict(rows), expected(pipeline, rows), rtol=0, atol=ATOL)
@@ -1,51 +1,234 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+from datetime import datetime, timezone
 
 import pandas as pd
-from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler, OneHotEncoder
 from sklearn.compose import ColumnTransformer
 from sklearn.pipeline import Pipeline
 from sklearn.ensemble import RandomForestRegressor
-from sklearn.multioutput import MultiOutputRegressor
 from sklearn.impute import SimpleImputer
+from sklearn.metrics import mean_absolute_error, r2_score
 import joblib
 
+from compiled_model import export_compiled, check_compiled
+from features import TARGET_COLUMNS
+from inference import MODEL_PATH, COMPILED_MODEL_PATH
 
-df = pd.read_csv("progress_dataset_extended.csv")
+# Обучение модели прогресса. Каждый запуск пишет версию в models/vNNNN
+# (model.pkl, compiled/, metrics.json) и публикует её туда, откуда читает бот.
+# Запуск: python train_progress_model.py [--data extra_outcomes.csv ...] [--warm-start]
 
-# Подготовка X и y
-X = df.drop(columns=["weeks_to_goal", "kg_change"])
-y = df[["weeks_to_goal", "kg_change"]]
+DATASET_PATH = "progress_dataset_extended.csv"
+MODELS_DIR = os.getenv("PROGRESS_MODELS_DIR", "models")
+CATEGORICAL_FEATURES = ["gender", "goal", "level"]
 
-# Признаки
-categorical_features = ["gender", "goal", "level"]
-numerical_features = [col for col in X.columns if col not in categorical_features]
 
-# Препроцессинг
-numeric_transformer = Pipeline([
-    ("imputer", SimpleImputer(strategy="median")),
-    ("scaler", StandardScaler())
-])
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
-categorical_transformer = Pipeline([
-    ("imputer", SimpleImputer(strategy="constant", fill_value="missing")),
-    ("onehot", OneHotEncoder(handle_unknown="ignore"))
-])
 
-preprocessor = ColumnTransformer([
-    ("num", numeric_transformer, numerical_features),
-    ("cat", categorical_transformer, categorical_features)
-])
+def dataset_fingerprint(digests, params):
+    # хэш байтов файлов и параметров: CSV не нужно парсить, чтобы понять, что учить нечего
+    raw = json.dumps({"files": digests, "params": params}, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
 
-# Модель
-regressor = MultiOutputRegressor(RandomForestRegressor(n_estimators=200, random_state=42))
-pipeline = Pipeline([
-    ("preprocessor", preprocessor),
-    ("regressor", regressor)
-])
 
-# Обучение
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-pipeline.fit(X_train, y_train)
+def load_dataset(paths):
+    df = pd.concat([pd.read_csv(p) for p in paths], ignore_index=True)
+    return df.drop(columns=TARGET_COLUMNS), df[TARGET_COLUMNS]
 
-# Сохранение
-joblib.dump(pipeline, "progress_predictor_extended.pkl")
+
+def holdout_mask(x, y, test_size):
+    # Строка попадает в тест по хэшу своего содержимого, а не по позиции:
+    # при дообучении на новых исходах старые тестовые строки не уходят в train.
+    # Числа (и bool) приводятся к float64: хэш зависит от dtype, а одна и та же
+    # колонка бывает int или float в зависимости от того, что склеено в CSV.
+    frame = pd.concat([x, y], axis=1)
+    frame = frame.apply(lambda col: col.astype("float64") if pd.api.types.is_numeric_dtype(col) else col)
+    hashes = pd.util.hash_pandas_object(frame, index=False).to_numpy()
+    return hashes % 10_000 < int(test_size * 10_000)
+
+
+def build_pipeline(numerical_features, n_estimators=200, n_jobs=-1, random_state=42,
+                   min_samples_leaf=1, max_samples=None):
+    numeric_transformer = Pipeline([
+        ("imputer", SimpleImputer(strategy="median")),
+        ("scaler", StandardScaler())
+    ])
+
+    categorical_transformer = Pipeline([
+        ("imputer", SimpleImputer(strategy="constant", fill_value="missing")),
+        ("onehot", OneHotEncoder(handle_unknown="ignore"))
+    ])
+
+    preprocessor = ColumnTransformer([
+        ("num", numeric_transformer, numerical_features),
+        ("cat", categorical_transformer, CATEGORICAL_FEATURES)
+    ])
+
+    # Один многовыходной лес вместо MultiOutputRegressor с двумя: деревья строятся
+    # один раз на оба выхода, n_jobs раскладывает их по ядрам.
+    regressor = RandomForestRegressor(
+        n_estimators=n_estimators, n_jobs=n_jobs, random_state=random_state,
+        min_samples_leaf=min_samples_leaf, max_samples=max_samples,
+    )
+    return Pipeline([
+        ("preprocessor", preprocessor),
+        ("regressor", regressor)
+    ])
+
+
+def evaluate(pipeline, x, y):
+    predicted = pipeline.predict(x)
+    metrics = {"r2": float(r2_score(y, predicted, multioutput="uniform_average"))}
+    for i, target in enumerate(TARGET_COLUMNS):
+        metrics[f"r2_{target}"] = float(r2_score(y.iloc[:, i], predicted[:, i]))
+        metrics[f"mae_{target}"] = float(mean_absolute_error(y.iloc[:, i], predicted[:, i]))
+    return metrics
+
+
+def version_dirs(models_dir=MODELS_DIR):
+    return sorted(name for name in os.listdir(models_dir) if name.startswith("v")) \
+        if os.path.isdir(models_dir) else []
+
+
+def latest_version(models_dir=MODELS_DIR):
+    # версия без metrics.json не дописана (прерванный запуск старого формата) — пропускаем
+    for version in reversed(version_dirs(models_dir)):
+        path = os.path.join(models_dir, version, "metrics.json")
+        if os.path.exists(path):
+            with open(path) as f:
+                return version, json.load(f)
+    return None, None
+
+
+def publish(version_dir, model_path=MODEL_PATH, compiled_path=COMPILED_MODEL_PATH):
+    # Пикл заменяется атомарно, каталог — переименованием; воркеры, у которых
+    # старые .npy открыты через mmap, дочитывают старые файлы.
+    shutil.copyfile(os.path.join(version_dir, "model.pkl"), f"{model_path}.tmp")
+    os.replace(f"{model_path}.tmp", model_path)
+    staging = f"{compiled_path}.tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    shutil.copytree(os.path.join(version_dir, "compiled"), staging)
+    if os.path.isdir(compiled_path):
+        os.rename(compiled_path, f"{compiled_path}.old")
+    os.rename(staging, compiled_path)
+    shutil.rmtree(f"{compiled_path}.old", ignore_errors=True)
+
+
+def train(args):
+    params = {
+        "n_estimators": args.n_estimators, "min_samples_leaf": args.min_samples_leaf,
+        "max_samples": args.max_samples, "test_size": args.test_size, "random_state": args.random_state,
+    }
+    digests = [file_digest(path) for path in args.data]
+    fingerprint = dataset_fingerprint(digests, params)
+    parent, parent_metrics = latest_version(args.models_dir)
+    if parent and parent_metrics["fingerprint"] == fingerprint and not args.force:
+        print(f"Dataset and parameters unchanged since {parent}, nothing to train (--force to retrain)")
+        return None
+
+    x, y = load_dataset(args.data)
+    test = holdout_mask(x, y, args.test_size)
+    x_train, y_train, x_test, y_test = x[~test], y[~test], x[test], y[test]
+
+    pipeline = None
+    warm_started = False
+    if args.warm_start and parent:
+        pipeline = joblib.load(os.path.join(args.models_dir, parent, "model.pkl"))
+        regressor = pipeline.named_steps["regressor"]
+        if not isinstance(regressor, RandomForestRegressor):
+            print(f"{parent} is not a native multi-output forest, training from scratch")
+            pipeline = None
+    start = time.perf_counter()
+    if pipeline is not None:
+        warm_started = True
+        # Дообучение: препроцессинг прежний (старые деревья обучены в его шкале),
+        # к лесу добавляются add_trees деревьев, обученных на текущих данных.
+        regressor.set_params(warm_start=True, n_jobs=args.n_jobs,
+                             n_estimators=regressor.n_estimators + args.add_trees)
+        regressor.fit(pipeline.named_steps["preprocessor"].transform(x_train), y_train)
+        regressor.set_params(warm_start=False)
+    else:
+        numerical_features = [col for col in x.columns if col not in CATEGORICAL_FEATURES]
+        pipeline = build_pipeline(numerical_features, args.n_estimators, args.n_jobs, args.random_state,
+                                  args.min_samples_leaf, args.max_samples)
+        pipeline.fit(x_train, y_train)
+    fit_seconds = time.perf_counter() - start
+
+    regressor = pipeline.named_steps["regressor"]
+    metrics = evaluate(pipeline, x_test, y_test) if len(x_test) else {}
+    # в пикле n_jobs=1: запасной путь сервинга предсказывает по одной строке
+    regressor.set_params(n_jobs=1)
+
+    versions = version_dirs(args.models_dir)
+    version = f"v{int(versions[-1][1:]) + 1 if versions else 1:04d}"
+    version_dir = os.path.join(args.models_dir, version)
+    # Версия собирается во временном каталоге и переименовывается в vNNNN только
+    # после записи metrics.json: упавший запуск не оставляет недописанную версию.
+    staging = os.path.join(args.models_dir, f".{version}.tmp")
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    joblib.dump(pipeline, os.path.join(staging, "model.pkl"))
+    # Компиляция в массивы NumPy для сервинга без pandas/sklearn и сверка с пиклом
+    compiled = export_compiled(pipeline, os.path.join(staging, "compiled"), model_version=version)
+    compiled_error = check_compiled(pipeline, compiled, x.head(10_000))
+
+    manifest = {
+        "version": version,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "fingerprint": fingerprint,
+        "data": [{"path": path, "sha256": digest} for path, digest in zip(args.data, digests)],
+        "params": params,
+        "parent": parent if warm_started else None,
+        "n_estimators": regressor.n_estimators,
+        "node_count": int(sum(tree.tree_.node_count for tree in regressor.estimators_)),
+        "rows_train": int(len(x_train)),
+        "rows_test": int(len(x_test)),
+        "fit_seconds": round(fit_seconds, 3),
+        "n_jobs": args.n_jobs,
+        "compiled_max_abs_diff": compiled_error,
+        "metrics": metrics,
+    }
+    with open(os.path.join(staging, "metrics.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.rename(staging, version_dir)
+    if args.publish:
+        publish(version_dir, args.model_path, args.compiled_path)
+
+    print(f"{version}: {manifest['rows_train']} train / {manifest['rows_test']} test rows, "
+          f"{regressor.n_estimators} trees, fit {fit_seconds:.2f}s, R² {metrics.get('r2', float('nan')):.3f}")
+    print(f"Compiled model exported, max abs diff vs pickle: {compiled_error:.2e}")
+    return manifest
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Train the progress model")
+    parser.add_argument("--data", nargs="+", default=[DATASET_PATH], help="CSV files with features and targets")
+    parser.add_argument("--models-dir", default=MODELS_DIR)
+    parser.add_argument("--n-estimators", type=int, default=200)
+    parser.add_argument("--n-jobs", type=int, default=-1, help="-1 uses every core")
+    parser.add_argument("--min-samples-leaf", type=int, default=1)
+    parser.add_argument("--max-samples", type=float, default=None, help="bootstrap fraction per tree, for large data")
+    parser.add_argument("--test-size", type=float, default=0.2)
+    parser.add_argument("--random-state", type=int, default=42)
+    parser.add_argument("--warm-start", action="store_true", help="add trees to the latest version instead of retraining")
+    parser.add_argument("--add-trees", type=int, default=50)
+    parser.add_argument("--force", action="store_true", help="train even if the dataset is unchanged")
+    parser.add_argument("--no-publish", dest="publish", action="store_false")
+    parser.add_argument("--model-path", default=MODEL_PATH)
+    parser.add_argument("--compiled-path", default=COMPILED_MODEL_PATH)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    train(parse_args())
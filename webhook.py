@@ -0,0 +1,218 @@
+import os
+import time
+import queue
+import asyncio
+import logging
+import argparse
+import multiprocessing
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from persistence import MongoPersistence, shard_for
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # публичный https-адрес фронта, без пути
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", str(os.cpu_count() or 1)))
+# упавший воркер перезапускается не чаще раза в столько секунд
+WEBHOOK_RESTART_DELAY = float(os.getenv("WEBHOOK_RESTART_DELAY", "5"))
+
+_STOP = None
+_DRAIN_LIMIT = 256
+
+
+def update_user_id(data):
+    # Кому принадлежит апдейт: from.id любого вложенного объекта, иначе chat.id
+    for value in data.values():
+        if isinstance(value, dict):
+            sender = value.get("from") or value.get("user")
+            if sender:
+                return sender["id"]
+            chat = value.get("chat") or value.get("message", {}).get("chat")
+            if chat:
+                return chat["id"]
+    return data.get("update_id", 0)
+
+
+def default_bot_factory(shard_index, shard_count):
+    from main import FitnessAssistantBot
+    from metrics import METRICS_PORT
+    from storage import create_database
+
+    db = create_database()
+    persistence = MongoPersistence(db, shard_index, shard_count)
+    # у каждого воркера свой порт /metrics: METRICS_PORT + номер шарда
+    metrics_port = METRICS_PORT + shard_index if METRICS_PORT else 0
+    return FitnessAssistantBot(os.getenv("TELEGRAM_API_TOKEN"), db=db, persistence=persistence,
+                               metrics_port=metrics_port)
+
+
+def _drain(updates):
+    batch = [updates.get()]
+    while len(batch) < _DRAIN_LIMIT:
+        try:
+            batch.append(updates.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+
+async def _run_worker(shard_index, shard_count, updates, bot_factory):
+    from telegram import Update
+
+    bot = bot_factory(shard_index, shard_count)
+    application = bot.application
+    # то же, что делает run_polling, но апдейты приходят из очереди фронта
+    await application.initialize()
+    await bot.startup(application)
+    await application.start()
+    logger.info(f"Worker {shard_index}/{shard_count} ready")
+
+    loop = asyncio.get_running_loop()
+    running = True
+    while running:
+        for data in await loop.run_in_executor(None, _drain, updates):
+            if data is _STOP:
+                running = False
+                break
+            await application.update_queue.put(Update.de_json(data, application.bot))
+
+    await application.stop()
+    await application.shutdown()
+    await bot.shutdown(application)
+
+
+def worker_main(shard_index, shard_count, updates, bot_factory):
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_run_worker(shard_index, shard_count, updates, bot_factory))
+
+
+class WebhookFrontend:
+    # Один порт, N процессов-воркеров. Апдейты шардируются по user_id, поэтому
+    # все сообщения пользователя обрабатывает один воркер в порядке прихода.
+
+    def __init__(self, workers=WEBHOOK_WORKERS, bot_factory=default_bot_factory, host=WEBHOOK_HOST,
+                 port=WEBHOOK_PORT, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET, restart_delay=WEBHOOK_RESTART_DELAY):
+        self.workers = workers
+        self.bot_factory = bot_factory
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret = secret
+        self.restart_delay = restart_delay
+        self.received = 0
+        self.restarts = 0
+        self._queues = []
+        self._processes = []
+        self._restart_at = []
+        self._runner = None
+        # spawn, а не fork: родитель уже держит event loop и потоки
+        self._context = multiprocessing.get_context("spawn")
+
+    def start_workers(self):
+        for index in range(self.workers):
+            self._queues.append(self._context.Queue())
+            self._processes.append(None)
+            self._restart_at.append(0.0)
+            self._start_worker(index)
+
+    def _start_worker(self, index):
+        process = self._context.Process(
+            target=worker_main, args=(index, self.workers, self._queues[index], self.bot_factory),
+            name=f"bot-worker-{index}", daemon=True
+        )
+        process.start()
+        self._processes[index] = process
+
+    def _ensure_worker(self, index):
+        # Воркер шарда жив или перезапущен. Очередь упавшего заменяется новой
+        # (он мог умереть, держа её замок); что в ней осталось — переносится.
+        if self._processes[index].is_alive():
+            return True
+        now = time.monotonic()
+        if now < self._restart_at[index]:
+            return False
+        self._restart_at[index] = now + self.restart_delay
+        logger.error(f"Worker {index} died with exit code {self._processes[index].exitcode}, restarting")
+        old, self._queues[index] = self._queues[index], self._context.Queue()
+        while True:
+            try:
+                self._queues[index].put(old.get_nowait())
+            except queue.Empty:
+                break
+        self._start_worker(index)
+        self.restarts += 1
+        return True
+
+    def alive(self):
+        return all(process.is_alive() for process in self._processes)
+
+    async def handle(self, request):
+        from aiohttp import web
+
+        if self.secret and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != self.secret:
+            return web.Response(status=403)
+        data = await request.json()
+        index = shard_for(update_user_id(data), self.workers)
+        if not self._ensure_worker(index):
+            # воркер шарда только что упал снова: не 200, чтобы Telegram прислал апдейт повторно
+            return web.Response(status=503)
+        self.received += 1
+        self._queues[index].put(data)
+        return web.Response()
+
+    async def start(self):
+        from aiohttp import web
+
+        self.start_workers()
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        logger.info(f"Webhook front end on {self.host}:{self.port}{self.path} with {self.workers} workers")
+        return self
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+        for updates in self._queues:
+            updates.put(_STOP)
+        for process in self._processes:
+            await asyncio.get_running_loop().run_in_executor(None, process.join, 30)
+
+
+async def set_webhook(token, url, secret):
+    from telegram import Bot
+
+    async with Bot(token) as bot:
+        await bot.set_webhook(url, secret_token=secret)
+
+
+async def serve(args):
+    frontend = await WebhookFrontend(args.workers, port=args.port, path=args.path, secret=args.secret).start()
+    if args.url:
+        await set_webhook(os.getenv("TELEGRAM_API_TOKEN"), args.url + args.path, args.secret)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await frontend.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Fitness Assistant Bot webhook front end")
+    parser.add_argument("--workers", type=int, default=WEBHOOK_WORKERS)
+    parser.add_argument("--port", type=int, default=WEBHOOK_PORT)
+    parser.add_argument("--path", default=WEBHOOK_PATH)
+    parser.add_argument("--secret", default=WEBHOOK_SECRET)
+    parser.add_argument("--url", default=WEBHOOK_URL, help="public base URL; setWebhook is called when given")
+    asyncio.run(serve(parser.parse_args()))